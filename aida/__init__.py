@@ -2,3 +2,14 @@ from .core import *
 from .branching import *
 from .choices import *
 from .lang import *
+from .compiler import *
+from .batch import *
+from .parallel import *
+from .columnar import *
+from .profiling import *
+from .serialization import *
+from .variants import *
+from .aio import *
+from .memo import *
+from .incremental import *
+from .lexicon import *
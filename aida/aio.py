@@ -0,0 +1,103 @@
+import asyncio
+import inspect
+from typing import Any, Dict, FrozenSet, List, Mapping, Set, Tuple
+
+from .branching import Branch, Match
+from .choices import Choices
+from .compiler import _walk
+from .core import Ctx, Injector, Node, Operation, ValidType, Var, render
+
+__all__ = ['render_async']
+
+
+def _needed(template: ValidType, values: Mapping[str, Any], unknown: Set[str]) -> Set[str]:
+    '''
+    Names of the variables that rendering the template reads, as far as
+    the values known so far tell. Branches whose condition reads a
+    variable in `unknown` are not followed yet, branches that check the
+    context, draw at random, or read the records of an injector, follow
+    all their arms: the render draws its own choices.
+    '''
+    ret: Set[str] = set()
+    if not isinstance(template, Node):
+        return ret
+
+    ctx = Ctx(values)
+    seen: Set[Tuple[int, FrozenSet[str]]] = set()
+    # variables of the enclosing injectors take the values of its records
+    stack: List[Tuple[Node, FrozenSet[str]]] = [(template, frozenset())]
+    while stack:
+        node, injected = stack.pop()
+        if (id(node), injected) in seen:
+            continue
+        seen.add((id(node), injected))
+
+        if isinstance(node, Var):
+            if node.name is not None and node.name not in injected:
+                ret.add(node.name)
+            if isinstance(node, Injector):
+                injected = injected.union(var.name for var in node.children.values())
+
+        if isinstance(node, (Branch, Match)):
+            cond = list(_walk(node.cond if isinstance(node, Branch) else node.label))
+            names = {var.name for var in cond if isinstance(var, Var)}
+            ret.update(names - injected)
+            if names & injected or any(isinstance(n, Choices) or isinstance(n, Operation) and n.op == 'in_ctx'
+                                       for n in cond):
+                arms = (node.left, node.right) if isinstance(node, Branch) else (*node.cases.values(), node.default)
+                stack.extend((arm, injected) for arm in arms)
+            elif not names & unknown:
+                stack.append((node._arm(ctx), injected))
+        else:
+            stack.extend((child, injected) for child in node.child_nodes())
+    return ret
+
+
+def _is_source(value: Any) -> bool:
+    return inspect.isawaitable(value) or callable(value)
+
+
+async def _fetch(source: Any) -> Any:
+    if callable(source):
+        source = source()
+    if inspect.isawaitable(source):
+        return await source
+    return source
+
+
+async def render_async(template: ValidType, ctx: Ctx = None, bindings: Mapping[str, Any] = None) -> str:
+    '''
+    Renders a node with variables bound to sources that take time to
+    answer: awaitables, or callables (async or not) that are called
+    without arguments. Only the sources of the variables that the render
+    reads are fetched, all at once with `asyncio.gather`, so the render
+    waits for the slowest lookup rather than for their sum. Values that
+    aren't sources are bound as they are.
+
+    A branch that tests a variable is only followed once its value is
+    known, so the variables of its arms are fetched in another round,
+    like the chain of branches of `create_match` after its label.
+    '''
+    values: Dict[str, Any] = {}
+    sources: Dict[str, Any] = {}
+    for name, value in (bindings or {}).items():
+        if _is_source(value):
+            sources[name] = value
+        else:
+            values[name] = value
+
+    try:
+        while True:
+            needed = _needed(template, values, set(sources))
+            names = [name for name in sources if name in needed]
+            if not names:
+                break
+            results = await asyncio.gather(*(_fetch(sources.pop(name)) for name in names))
+            values.update(zip(names, results))
+    finally:
+        # coroutines that weren't needed are never awaited
+        for source in sources.values():
+            if inspect.iscoroutine(source):
+                source.close()
+
+    return render(template, ctx, values)
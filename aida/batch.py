@@ -0,0 +1,111 @@
+import random
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, TextIO, Tuple
+
+from .choices import BatchRandom
+from .compiler import _program
+from .core import Ctx, Injector, Repeat, ValidType
+
+__all__ = ['render_many', 'iter_render', 'write_render']
+
+Record = Mapping[str, Any]
+
+
+def render_many(template: ValidType, records: Iterable[Record], seed: Any = None,
+                predraw: bool = False, cache: Any = None) -> List[str]:
+    '''
+    Renders the template once per record, binding its variables to the
+    values in the record. Every record gets a context of its own and nothing
+    is assigned to the template, so it can be shared between threads.
+
+    The batch draws its random choices from a generator seeded with `seed`,
+    or from the global one if no seed is given. With `predraw` the indices
+    of each choice are drawn for many records at once. With a `RenderCache`
+    as `cache`, the parts of the template that only depend on their
+    variables render once for each of their values.
+    '''
+    program = _program(template, lean=True)
+    if cache is not None:
+        program = program.memoized()
+    if predraw:
+        rng = BatchRandom(seed)
+    elif seed is not None:
+        rng = random.Random(seed)
+    else:
+        rng = None
+    return [program.render(Ctx(record, rng, cache=cache)) for record in records]
+
+
+def _unwrap(template: ValidType) -> Tuple[ValidType, Optional[Injector]]:
+    # a repeat over an injector renders one record per iteration: stream the
+    # records into the injected node instead
+    if isinstance(template, Repeat):
+        template = template.node
+    if isinstance(template, Injector):
+        return template.node, template
+    return template, None
+
+
+def iter_render(template: ValidType, records: Iterable[Record], ctx: Ctx = None,
+                scoped: bool = None) -> Iterator[str]:
+    '''
+    Lazily renders the template for each record pulled from `records`,
+    yielding the texts one at a time. All records share one context, like
+    the iterations of a `Repeat` over an `Injector`, which can be passed as
+    the template directly. With `scoped`, or if the template is a scoped
+    `Repeat`, each record renders in a scope of its own, and what it
+    mentions is forgotten after it.
+    '''
+    node, injector = _unwrap(template)
+    # a context of its own only needs what the template checks
+    program = _program(node, lean=ctx is None)
+    ctx = ctx if ctx is not None else Ctx()
+
+    for record in _bindings(injector, records):
+        with _scope(template, ctx, scoped):
+            text = program.render(ctx, bindings=record)
+        yield text
+
+
+@contextmanager
+def _scope(template: ValidType, ctx: Ctx, scoped: Optional[bool]) -> Iterator[Ctx]:
+    if scoped is None:
+        scoped = isinstance(template, Repeat) and template.scoped
+    if scoped:
+        with ctx.scope():
+            yield ctx
+    else:
+        yield ctx
+
+
+def _bindings(injector: Optional[Injector], records: Iterable[Record]) -> Iterator[Record]:
+    for record in records:
+        if injector is not None:
+            # same check as injecting the record into the variables
+            record = {injector.children[name].name: value for name, value in record.items()}
+        yield record
+
+
+def write_render(template: ValidType, records: Iterable[Record], file: TextIO,
+                 ctx: Ctx = None, sep: str = None, scoped: bool = None) -> int:
+    '''
+    Streams the texts of `iter_render` into a file-like object, separated by
+    `sep` (the separator of a `Repeat` template or a new line by default).
+    Each text is written as it renders, without being built first.
+    Returns the number of records written.
+    '''
+    if sep is None:
+        sep = template.sep if isinstance(template, Repeat) else '\n'
+    node, injector = _unwrap(template)
+    # a context of its own only needs what the template checks
+    program = _program(node, lean=ctx is None)
+    ctx = ctx if ctx is not None else Ctx()
+
+    count = 0
+    for record in _bindings(injector, records):
+        if count:
+            file.write(sep)
+        with _scope(template, ctx, scoped):
+            program.render_to(file, ctx, bindings=record)
+        count += 1
+    return count
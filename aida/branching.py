@@ -1,29 +1,83 @@
-from typing import cast
+from typing import Dict, Mapping, Tuple, cast
 
 from .choices import Choices
 from .core import (
-    Ctx, Empty, Node, Operation, ValidType, Var, _update_ctx, to_node)
+    Ctx, Empty, Node, Operation, ValidType, Var, _key, _render, _update_ctx, to_node)
 
-__all__ = ['Branch', 'create_alt', 'create_ref', 'create_match', 'create_once']
+__all__ = ['Branch', 'Match', 'create_alt', 'create_ref', 'create_match', 'create_once']
 
 
 class Branch(Node):
+    __slots__ = ('cond', 'left', 'right')
+
     def __init__(self, cond: Node, left: ValidType, right: ValidType = None) -> None:
+        self.parent = None
+        self._clear_caches()
         self.cond = cond
         self.left = to_node(left)
         self.right = to_node(right or Empty)
 
-    def __hash__(self) -> int:
-        return hash((self.__class__.__name__, self.cond, self.left, self.right))
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return hash((self.__class__.__name__, _key(self.cond, ctx),
+                     _key(self.left, ctx), _key(self.right, ctx)))
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return (self.cond, self.left, self.right)
 
     def __repr__(self) -> str:
         return f'Branch({self.cond} ? {self.left} : {self.right})'
 
+    def _arm(self, ctx: Ctx) -> Node:
+        '''
+        Evaluates the condition, giving the arm the branch renders.
+        '''
+        if isinstance(self.cond.value, Operation):
+            cond_eval = cast(Operation, self.cond.value).render(ctx)
+        elif isinstance(self.cond, Var):
+            cond_eval = self.cond.resolve(ctx)
+        else:
+            cond_eval = self.cond.value
+        return self.left if cond_eval else self.right
+
+    def render(self, ctx: Ctx) -> ValidType:
+        ret = self._arm(ctx).render(ctx)
+        return _update_ctx(ctx, self, ret)
+
+
+class Match(Node):
+    '''
+    Renders the case named by the text of `label`, or `default` if there is
+    none, finding it in a dict instead of testing the cases one by one.
+    '''
+
+    __slots__ = ('label', 'cases', 'default')
+
+    def __init__(self, label: ValidType, cases: Mapping[str, ValidType], default: ValidType = None) -> None:
+        self.parent = None
+        self._clear_caches()
+        self.label = to_node(label)
+        self.cases: Dict[str, Node] = {name: to_node(case) for name, case in cases.items()}
+        self.default = to_node(default or Empty)
+
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return hash((self.__class__.__name__, _key(self.label, ctx),
+                     tuple((name, _key(case, ctx)) for name, case in self.cases.items()),
+                     _key(self.default, ctx)))
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return (self.label, *self.cases.values(), self.default)
+
+    def __repr__(self) -> str:
+        return f'Match({self.label} ? {self.cases} : {self.default})'
+
+    def _arm(self, ctx: Ctx) -> Node:
+        '''
+        Renders the label, giving the case the match renders.
+        '''
+        return self.cases.get(str(_render(self.label, ctx)), self.default)
+
     def render(self, ctx: Ctx) -> ValidType:
-        cond_eval = cast(Operation, self.cond.value).render(
-            ctx) if isinstance(self.cond.value, Operation) else self.cond.value
-        alternative = self.left if cond_eval else self.right
-        ret = alternative.render(ctx)
+        ret = self._arm(ctx).render(ctx)
         return _update_ctx(ctx, self, ret)
 
 
@@ -41,7 +95,10 @@ def create_once(node: ValidType) -> Branch:
 
 
 def create_match(label_var: Var, default: ValidType = None, **matches) -> Node:
-    b = to_node(default or Empty)
-    for label_value, output in matches.items():
-        b = Branch(label_var == label_value, output, b)
-    return b
+    '''
+    Renders the match whose name is the text of `label_var`, or `default`.
+    '''
+    if not matches:
+        # nothing to match, so the label isn't rendered nor added
+        return to_node(default or Empty)
+    return Match(label_var, matches, default)
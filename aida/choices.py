@@ -1,23 +1,223 @@
 import random
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, cast
 
-from .core import Ctx, Node, ValidType, _update_ctx, to_node
+from . import core
+from .core import Ctx, Node, ValidType, _key, _update_ctx, to_node
 
 
-__all__ = ['Choices']
+__all__ = ['Choices', 'BatchRandom']
+
+
+class BatchRandom(random.Random):
+    '''
+    Random generator shared by a batch of renders. The indices drawn from
+    each sequence are drawn `size` at a time in a single call, instead of
+    one call per `choice`.
+    '''
+
+    def __init__(self, seed: Any = None, size: int = 1024) -> None:
+        super().__init__(seed)
+        self.size = size
+        self._draws: Dict[int, List[Any]] = {}
+        # holding the sequences keeps their ids from being reused
+        self._seqs: Dict[int, Sequence] = {}
+
+    def choice(self, seq: Sequence) -> Any:
+        try:
+            return self._draws[id(seq)].pop()
+        except (KeyError, IndexError):
+            self._seqs[id(seq)] = seq
+            draws = self._draws[id(seq)] = self.choices(seq, k=self.size)
+            return draws.pop()
+
+
+# draws of an excluding choice that may hit items already said, before
+# the ones left are drawn from
+_TRIES = 8
+
+
+# probability of taking each column of an alias table, and its alias
+_Alias = Tuple[Tuple[float, ...], Tuple[int, ...]]
+
+
+def _alias_table(weights: Sequence[float]) -> _Alias:
+    '''
+    Alias table of the weights, by Vose's method: each of the `n` columns
+    holds a weight of `1 / n`, split between its own position and an alias,
+    so a draw takes one column at random and a biased coin.
+    '''
+    n = len(weights)
+    total = sum(weights)
+    scaled = [weight * n / total for weight in weights]
+    probs = [1.0] * n
+    aliases = list(range(n))
+    small = [i for i, weight in enumerate(scaled) if weight < 1]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1]
+    while small and large:
+        less = small.pop()
+        more = large[-1]
+        probs[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1 - scaled[less]
+        if scaled[more] < 1:
+            small.append(large.pop())
+    # what is left is only off by rounding, and takes its own position
+    return tuple(probs), tuple(aliases)
+
+
+class _Unsaid(object):
+    '''
+    Positions of the items of an excluding choice not found said in a
+    context. An item found said is swapped out with the last one, so it is
+    skipped once instead of at every draw.
+    '''
+
+    __slots__ = ('node', 'left', 'said', 'dynamic', 'state')
+
+    def __init__(self, node: 'Choices') -> None:
+        self.node = node
+        # listed when the draws first go through them
+        self.left: Optional[List[int]] = None
+        self.said: List[int] = []
+        self.dynamic = node._is_dynamic()
+        # what the context was when the items were found said
+        self.state: Optional[Tuple[Any, int, Any, int]] = None
 
 
 class Choices(Node):
-    def __init__(self, *items: ValidType, seed=None) -> None:
+    '''
+    Renders one of its items, drawn at random.
+
+    With `weights`, items are drawn in proportion to their weight, in
+    constant time from an alias table built once; items weighing zero are
+    never drawn. With `exclude`, items already in the context are skipped,
+    like a phrasing that was just used, unless all of them are. They are
+    drawn again a few times, then drawn from the ones the context keeps as
+    not said, so a draw stays in constant time amortized.
+    '''
+
+    __slots__ = ('items', 'rng', 'weights', 'exclude', '_pool', '_alias', '_heaviest')
+
+    def __init__(self, *items: ValidType, seed=None, weights: Sequence[float] = None,
+                 exclude: bool = False) -> None:
+        self.parent = None
+        self._clear_caches()
         self.items = tuple(map(to_node, items))
-        if seed is not None:
-            random.seed(seed)
+        # a seeded node draws from its own generator when the render has none
+        self.rng = random.Random(seed) if seed is not None else None
+        self.weights: Optional[Tuple[float, ...]] = None
+        self.exclude = exclude
+        # positions of the items that can be drawn
+        self._pool = tuple(range(len(self.items)))
+        self._alias: Optional[_Alias] = None
+        self._heaviest = 1.0
+        if weights is not None:
+            self.weights = tuple(map(float, weights))
+            assert len(self.weights) == len(self.items), 'There must be one weight per item.'
+            assert all(weight >= 0 for weight in self.weights), 'Weights can\'t be negative.'
+            self._pool = tuple(i for i, weight in enumerate(self.weights) if weight > 0)
+            assert self._pool, 'Some item must weigh more than zero.'
+            self._alias = _alias_table([self.weights[i] for i in self._pool])
+            self._heaviest = max(self.weights)
 
-    def __hash__(self) -> int:
-        return hash((self.__class__.__name__, self.items))
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return hash((self.__class__.__name__, tuple(_key(item, ctx) for item in self.items),
+                     self.weights, self.exclude))
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return self.items
 
     def __repr__(self) -> str:
         return f'Choices({self.items})'
 
+    def _draw(self, rng: Any) -> int:
+        alias = self._alias
+        pool = self._pool
+        column = rng.random() * len(pool)
+        index = int(column)
+        if alias is not None and column - index >= alias[0][index]:
+            index = alias[1][index]
+        return pool[index]
+
+    def _pick(self, rng: Any, said: Callable[[int], bool] = None, unsaid: _Unsaid = None) -> int:
+        '''
+        Position of the item drawn by a weighted or excluding choice. `said`
+        tells whether the item at a position is in the context, and `unsaid`
+        keeps the items not found in it yet.
+        '''
+        if not hasattr(rng, 'random'):
+            # generators that only have `choice`, like the ones going through
+            # the variants, draw among the items that can be drawn
+            return rng.choice(self._left(said))
+
+        if said is None or not self.exclude:
+            return self._draw(rng)
+        if unsaid is None:
+            unsaid = _Unsaid(self)
+        if unsaid.left is None:
+            for _ in range(_TRIES):
+                index = self._draw(rng)
+                if not said(index):
+                    return index
+            # most items were said, draws go through the ones left from now on
+            unsaid.left = list(self._pool)
+        left = unsaid.left
+        weights = self.weights
+        while left:
+            # not `choice`, which batch generators keep the sequences of
+            position = int(rng.random() * len(left))
+            index = left[position]
+            if said(index):
+                left[position] = left[-1]
+                left.pop()
+                unsaid.said.append(index)
+            elif weights is None or rng.random() * self._heaviest < weights[index]:
+                # kept in proportion to its weight
+                return index
+        # when all of them were said, any can be said again
+        return self._draw(rng)
+
+    def _left(self, said: Optional[Callable[[int], bool]]) -> Sequence[int]:
+        if said is None or not self.exclude:
+            return self._pool
+        # when all of them were said, any can be said again
+        return [i for i in self._pool if not said(i)] or self._pool
+
     def render(self, ctx: Ctx) -> ValidType:
-        ret = random.choice(self.items)
+        rng = ctx.rng or self.rng or random
+        if self._alias is None and not self.exclude:
+            ret = rng.choice(self.items)
+        else:
+            ret = self.items[self._pick(rng, *_excluded(ctx, self))]
         return _update_ctx(ctx, self, ret)
+
+
+def _said(ctx: Ctx, items: Sequence[Node]) -> Callable[[int], bool]:
+    has = ctx.store.has
+    key = ctx.key
+    return lambda index: has(key(items[index]))
+
+
+def _excluded(ctx: Ctx, node: Choices) -> Tuple[Optional[Callable[[int], bool]], Optional[_Unsaid]]:
+    '''
+    Arguments of `_pick` for a choice rendered in `ctx`. The items found
+    said are checked again when the context may have forgotten them, through
+    scopes or a window, or when the keys of dynamic items may have changed.
+    '''
+    if not node.exclude:
+        return None, None
+    unsaid = ctx.unsaid.get(id(node))
+    if unsaid is None or unsaid.node is not node:
+        unsaid = ctx.unsaid[id(node)] = _Unsaid(node)
+    store = ctx.store
+    said = _said(ctx, node.items)
+    state = unsaid.state
+    if (state is None or state[0] is not store or state[1] != store._forgotten
+            or unsaid.dynamic and (state[3] != core._version or state[2] != ctx._bound())):
+        if unsaid.said:
+            found = []
+            for index in unsaid.said:
+                (found if said(index) else cast(List[int], unsaid.left)).append(index)
+            unsaid.said = found
+        unsaid.state = (store, store._forgotten, ctx._bound(), core._version)
+    return said, unsaid
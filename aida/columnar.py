@@ -0,0 +1,294 @@
+import operator
+import random
+from typing import Any, Dict, List, Mapping, Sequence, Set, Tuple
+
+from .batch import render_many
+from .branching import Branch, Match
+from .choices import Choices, _Unsaid
+from .compiler import _Queries, _walk, compile
+from .core import Const, Ctx, Node, Operation, ValidType, Var
+from .lang import LangConfig, PhraseElement
+
+__all__ = ['render_columns', 'render_configs']
+
+_BINARY_OPS = ('gt', 'ge', 'lt', 'le', 'eq', 'ne', 'and_', 'add', 'or')
+
+_SUPPORTED = (Node, Const, Var, Operation, Branch, Match, Choices, LangConfig)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class _ColumnRenderer(object):
+    '''
+    Renders a template for every row of a table at once. Each node is
+    evaluated into a list with one value per row that reaches it: branches
+    and choices split the rows into groups that follow the same arm, so the
+    nodes inside an arm are evaluated once per group.
+
+    Each row renders as with a context of its own. Contexts are only kept
+    when the template checks them, and then only for the nodes that may be
+    checked. Rows may also render under language configs of their own.
+    '''
+
+    def __init__(self, template: Node, columns: Dict[str, List[Any]], size: int,
+                 rng: Any, configs: List[LangConfig] = None) -> None:
+        self.columns = columns
+        self.size = size
+        self.rng = rng
+        self.configs = configs
+        for node in _walk(template):
+            if type(node) not in _SUPPORTED and not (
+                    isinstance(node, PhraseElement) and not isinstance(node.value, Node)):
+                raise _Unsupported(node)
+
+        self.queries = _Queries(template)
+        self.stores: List[Set[int]] = [set() for _ in range(size)] if self.queries.queried else []
+        # items of the excluding choices not found said yet, by row and choice id
+        self.unsaid: Dict[Tuple[int, int], _Unsaid] = {}
+
+    def bindings(self, row: int) -> Dict[str, Any]:
+        return {name: column[row] for name, column in self.columns.items()}
+
+    def keys(self, node: Node, rows: List[int]) -> List[int]:
+        if not node._is_dynamic():
+            return [hash(node)] * len(rows)
+        elif type(node) is Var and node.name in self.columns:
+            column = self.columns[node.name]
+            return [hash(('var', node.name, column[row])) for row in rows]
+        return [Ctx(self.bindings(row)).key(node) for row in rows]
+
+    def add(self, node: Node, rows: List[int]) -> None:
+        if self.stores and self.queries.relevant(node):
+            stores = self.stores
+            for row, key in zip(rows, self.keys(node, rows)):
+                stores[row].add(key)
+
+    def add_pending(self, pending: Tuple[Node, ...], rows: List[int]) -> None:
+        for branch in pending:
+            self.add(branch, rows)
+
+    def values(self, var: Var, rows: List[int]) -> List[Any]:
+        column = self.columns.get(var.name)
+        if column is None:
+            return [var.value] * len(rows)
+        return [column[row] for row in rows]
+
+    def eval(self, node: ValidType, rows: List[int], pending: Tuple[Node, ...] = ()) -> List[Any]:
+        '''
+        Values of `node` for the given rows. `pending` holds the enclosing
+        branches, innermost first, that add themselves to the contexts once
+        `node` has been rendered.
+        '''
+        if not isinstance(node, Node):
+            ret = [node] * len(rows)
+        elif type(node) is Const:
+            ret = [str(node.value)] * len(rows)
+            self.add(node, rows)
+        elif type(node) is Var:
+            values = self.values(node, rows)
+            assert None not in values
+            ret = [str(value) for value in values]
+            self.add(node, rows)
+        elif type(node) is Node:
+            if isinstance(node.value, Node):
+                return self.eval(node.value, rows, pending)
+            ret = [node.value] * len(rows)
+        elif type(node) is LangConfig:
+            configs = self.configs
+            self.configs = [node] * self.size
+            try:
+                ret = self.eval(node.value, rows)
+            finally:
+                self.configs = configs
+        elif type(node) is Operation:
+            ret = self.eval_operation(node, rows)
+        elif type(node) is Branch:
+            return self.eval_branch(node, rows, pending)
+        elif type(node) is Match:
+            return self.eval_match(node, rows, pending)
+        elif type(node) is Choices:
+            return self.eval_choices(node, rows, pending)
+        elif self.configs is None:
+            # phrase elements don't depend on the row nor touch the context
+            ret = [node.render(Ctx())] * len(rows)
+        else:
+            configs = self.configs
+            ret = [node._resolve(configs[row].feature_mask) for row in rows]
+
+        self.add_pending(pending, rows)
+        return ret
+
+    def eval_operation(self, node: Operation, rows: List[int]) -> List[Any]:
+        op = node.op
+        required_operands = 2 if op in _BINARY_OPS else 1
+        assert len(node.operands) == required_operands
+
+        if op == 'in_ctx':
+            stores = self.stores
+            keys = self.keys(node.operands[0], rows)
+            return [key in stores[row] for row, key in zip(rows, keys)]
+
+        values = [self.eval(operand, rows) for operand in node.operands]
+        if op == 'not':
+            return [not value for value in values[0]]
+        elif op == 'or':
+            return [left or right if isinstance(left, bool) and isinstance(right, bool)
+                    else left + ' ' + right for left, right in zip(*values)]
+        elif op == 'sentence':
+            ret = [str(value).capitalize() for value in values[0]]
+            return [text if text.endswith('.') else text + '.' for text in ret]
+        elif op == 'noop':
+            return values[0]
+
+        fn = getattr(operator, op)
+        if len(values) == 1:
+            return [fn(value) for value in values[0]]
+        return [fn(left, right) for left, right in zip(*values)]
+
+    def merge(self, groups: List[Tuple[List[int], List[Any]]], rows: List[int]) -> List[Any]:
+        position = {row: i for i, row in enumerate(rows)}
+        ret: List[Any] = [None] * len(rows)
+        for group_rows, values in groups:
+            for row, value in zip(group_rows, values):
+                ret[position[row]] = value
+        return ret
+
+    def eval_branch(self, node: Branch, rows: List[int], pending: Tuple[Node, ...]) -> List[Any]:
+        if isinstance(node.cond.value, Operation):
+            conds = self.eval_operation(node.cond.value, rows)
+        elif isinstance(node.cond, Var):
+            conds = self.values(node.cond, rows)
+        else:
+            conds = [node.cond.value] * len(rows)
+
+        left = [row for row, cond in zip(rows, conds) if cond]
+        if len(left) == len(rows):
+            return self.eval(node.left, rows, (node, ) + pending)
+        right = [row for row, cond in zip(rows, conds) if not cond]
+        if not left:
+            return self.eval(node.right, rows, (node, ) + pending)
+
+        return self.merge([(left, self.eval(node.left, left, (node, ) + pending)),
+                           (right, self.eval(node.right, right, (node, ) + pending))], rows)
+
+    def eval_match(self, node: Match, rows: List[int], pending: Tuple[Node, ...]) -> List[Any]:
+        # rows are grouped by the case they render
+        groups: Dict[int, Tuple[Node, List[int]]] = {}
+        for row, label in zip(rows, self.eval(node.label, rows)):
+            case = node.cases.get(str(label), node.default)
+            groups.setdefault(id(case), (case, []))[1].append(row)
+
+        pending = (node, ) + pending
+        if len(groups) == 1:
+            case, _ = groups.popitem()[1]
+            return self.eval(case, rows, pending)
+        return self.merge([(group, self.eval(case, group, pending)) for case, group in groups.values()], rows)
+
+    def eval_choices(self, node: Choices, rows: List[int], pending: Tuple[Node, ...]) -> List[Any]:
+        if node._alias is None and not node.exclude:
+            picks = self.rng.choices(range(len(node.items)), k=len(rows))
+        elif not (node.exclude and self.stores):
+            picks = [node._pick(self.rng) for _ in rows]
+        else:
+            # each row skips the items in its own context
+            stores = self.stores
+            # keys of the items drawn, for every row
+            keys: Dict[int, List[int]] = {}
+
+            def said(index: int, i: int, row: int) -> bool:
+                if index not in keys:
+                    keys[index] = self.keys(node.items[index], rows)
+                return keys[index][i] in stores[row]
+
+            unsaid = self.unsaid
+            picks = []
+            for i, row in enumerate(rows):
+                pool = unsaid.get((row, id(node)))
+                if pool is None:
+                    pool = unsaid[row, id(node)] = _Unsaid(node)
+                picks.append(node._pick(self.rng, lambda index: said(index, i, row), pool))
+        groups: Dict[int, List[int]] = {}
+        for row, pick in zip(rows, picks):
+            groups.setdefault(pick, []).append(row)
+
+        self.add(node, rows)
+        ret = []
+        for pick, group in sorted(groups.items()):
+            item = node.items[pick]
+            self.add(item, group)
+            for branch in pending:
+                self.add(branch, group)
+                self.add(item, group)
+            ret.append((group, self.eval(item, group)))
+        return self.merge(ret, rows) if len(ret) > 1 else ret[0][1]
+
+
+def _to_columns(data: Any) -> Dict[str, List[Any]]:
+    # pandas data frames and numpy arrays are read through `tolist`, which
+    # also turns their scalars into python values
+    if hasattr(data, 'columns') and hasattr(data, '__getitem__'):
+        data = {name: data[name] for name in data.columns}
+    return {name: column.tolist() if hasattr(column, 'tolist') else list(column)
+            for name, column in data.items()}
+
+
+def render_columns(template: ValidType, data: Any, seed: Any = None) -> List[str]:
+    '''
+    Renders the template for every row of a table given by columns: a
+    mapping of variable names to sequences, NumPy arrays or a pandas data
+    frame. Gives the same texts as rendering each row with its variables
+    bound to the row values, in a context of its own.
+
+    Conditions are evaluated a whole column at a time and the rows are
+    split by the arm of each branch and choice they take, so every arm is
+    evaluated once for its group of rows. Random choices for the table are
+    drawn at once from a generator seeded with `seed`. Templates with nodes
+    that can't be evaluated by columns, like `Injector` or `Repeat`, and
+    templates too deep to evaluate are rendered row by row.
+    '''
+    columns = _to_columns(data)
+    sizes = {len(column) for column in columns.values()}
+    if len(sizes) > 1:
+        raise ValueError('Columns must have the same length.')
+    size = sizes.pop() if sizes else 0
+    if not size:
+        return []
+
+    node = template if isinstance(template, Node) else Const(template)
+    rng = random.Random(seed) if seed is not None else random
+    try:
+        renderer = _ColumnRenderer(node, columns, size, rng)
+        return [str(value) for value in renderer.eval(node, list(range(size)))]
+    except (_Unsupported, RecursionError):
+        # evaluating takes a python frame per level, too many for deep trees
+        records = [{name: column[row] for name, column in columns.items()}
+                   for row in range(size)]
+        return render_many(template, records, seed=seed)
+
+
+def render_configs(template: ValidType, configs: Sequence[LangConfig],
+                   bindings: Mapping[str, Any] = None, seed: Any = None) -> List[str]:
+    '''
+    Renders the template once for each language config, with the variables
+    in `bindings`. Gives the same texts as rendering the template wrapped
+    in each config, in a context of its own, but in a single pass: the parts
+    of the template that don't depend on the language are rendered once.
+    Configs inside the template still take precedence over the given ones.
+    '''
+    configs = list(configs)
+    bindings = bindings or {}
+    if not configs:
+        return []
+
+    node = template if isinstance(template, Node) else Const(template)
+    rng = random.Random(seed) if seed is not None else random
+    columns = {name: [value] * len(configs) for name, value in bindings.items()}
+    try:
+        renderer = _ColumnRenderer(node, columns, len(configs), rng, configs)
+        return [str(value) for value in renderer.eval(node, list(range(len(configs))))]
+    except (_Unsupported, RecursionError):
+        program = compile(template, lean=True)
+        ctx_rng = random.Random(seed) if seed is not None else None
+        return [program.render(Ctx(bindings, ctx_rng, config)) for config in configs]
@@ -0,0 +1,1063 @@
+import io
+import operator
+import random
+from typing import IO, Any, Callable, Dict, Generator, Iterator, List, Mapping, Optional, Tuple, cast
+
+from .branching import Branch, Match
+from .choices import Choices, _excluded
+from .core import (
+    Const, Ctx, Injector, Node, Operation, Repeat, ValidType, Var, _compiled, _render)
+from .lang import LangConfig, PhraseElement
+
+__all__ = ['compile', 'Program']
+
+# opcodes of the flat render program
+PUSH = 0
+CONST = 1
+VAR = 2
+ADD = 3
+OR = 4
+BINOP = 5
+NOT = 6
+SENTENCE = 7
+IN_CTX = 8
+ATTR = 9
+JUMP = 10
+JUMP_IF_FALSE = 11
+CHOOSE = 12
+INJECT = 13
+REPEAT = 14
+REPEAT_NEXT = 15
+CALL = 16
+RESOLVE = 17
+CONFIG = 18
+END_CONFIG = 19
+TEXT = 20
+JOIN = 21
+WRITE = 22
+WTEXT = 23
+LOOP = 24
+LOOP_NEXT = 25
+ENTER = 26
+EXIT = 27
+ARM = 28
+VALUE = 29
+MEMO = 30
+END_MEMO = 31
+MATCH = 32
+
+Instruction = Tuple[int, Any, Any]
+# enclosing branches that add themselves to the context once a node is
+# rendered, linked innermost first as (branch, outer, outermost branch)
+_Pending = Optional[Tuple[Node, Any, Node]]
+# children that a node yields to be compiled, with their pending branches
+# and whether they are written to the output or left on the stack
+_Steps = Iterator[Tuple[ValidType, _Pending, bool]]
+_ChainSteps = Generator[Tuple[ValidType, _Pending, bool], None, bool]
+
+_BINARY_OPS = ('gt', 'ge', 'lt', 'le', 'eq', 'ne', 'and_', 'add', 'or')
+
+# key of the nodes that a lean program doesn't keep: hash() never gives -1,
+# so it matches no node
+_UNRECORDED = -1
+
+
+class _AnyValue(Mapping):
+    '''
+    Bindings that give every variable the same placeholder value, used to
+    compare the shape of nodes that hold variables.
+    '''
+
+    def __getitem__(self, name: str) -> Any:
+        return _AnyValue
+
+    def __contains__(self, name: object) -> bool:
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(())
+
+    def __len__(self) -> int:
+        return 1
+
+
+def _walk(node: Node) -> Iterator[Node]:
+    # shared subtrees are walked once
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            yield node
+            stack.extend(node.child_nodes())
+
+
+class _Queries(object):
+    '''
+    The nodes that a template checks with `in_ctx`, or that its excluding
+    choices skip, to tell which of the nodes it renders the context needs
+    to keep.
+    '''
+
+    def __init__(self, template: ValidType) -> None:
+        self.queried: List[Node] = []
+        if isinstance(template, Node):
+            for node in _walk(template):
+                if isinstance(node, Operation) and node.op == 'in_ctx':
+                    self.queried.append(node.operands[0])
+                elif isinstance(node, Choices) and node.exclude:
+                    # excluding choices check their items
+                    self.queried.extend(node.items)
+        # the keys of dynamic nodes are kept, so nested ones are keyed once
+        self._ctx = Ctx(_AnyValue())
+        self._ids = {id(node) for node in self.queried}
+        self._shapes = {self._shape(node) for node in self.queried}
+        self._relevant: Dict[int, bool] = {}
+
+    def _shape(self, node: Node) -> Tuple[bool, int]:
+        if node._is_dynamic():
+            return True, self._ctx._deep_key(node)
+        return False, hash(node)
+
+    def relevant(self, node: Node) -> bool:
+        '''
+        Whether adding the node to the context can change an `in_ctx` check.
+        '''
+        if not self.queried:
+            return False
+        ret = self._relevant.get(id(node))
+        if ret is None:
+            ret = self._relevant[id(node)] = id(node) in self._ids or self._shape(node) in self._shapes
+        return ret
+
+
+# kinds of nodes that render the same for the same variables and language
+_PURE_KINDS = (Node, Const, Var, Operation, Branch, Match, Repeat, LangConfig)
+_PureInfo = Tuple[Dict[int, Var], Optional[PhraseElement], bool, bool]
+
+
+class _Purity(object):
+    '''
+    Tells which subtrees of a template render the same text, and add the
+    same nodes to the context, whenever the variables they read and the
+    language they render in are the same: those without choices, context
+    checks, injected records or scopes. The ones that branch, repeat or
+    look up phrases are worth keeping the renders of.
+    '''
+
+    def __init__(self) -> None:
+        # for each node by id: None if it is not pure, else the variables
+        # it reads by id, a phrase that reads the language if any, whether
+        # it looks up phrases and whether it is worth keeping
+        self._info: Dict[int, Optional[_PureInfo]] = {}
+
+    def info(self, node: Node) -> Optional[_PureInfo]:
+        if id(node) in self._info:
+            return self._info[id(node)]
+
+        # children first, without a python frame per level
+        stack = [(node, False)]
+        while stack:
+            item, ready = stack.pop()
+            if id(item) in self._info:
+                continue
+            if not ready:
+                stack.append((item, True))
+                stack.extend((child, False) for child in item.child_nodes() if id(child) not in self._info)
+            else:
+                self._info[id(item)] = self._combine(item)
+        return self._info[id(node)]
+
+    def _combine(self, node: Node) -> Optional[_PureInfo]:
+        kind = type(node)
+        if kind not in _PURE_KINDS and not isinstance(node, PhraseElement):
+            return None
+        if (kind is Operation and node.op == 'in_ctx') or (kind is Repeat and node.scoped):
+            return None
+
+        variables: Dict[int, Var] = {}
+        config: Optional[PhraseElement] = None
+        phrases = False
+        worth = kind is Branch or kind is Match or kind is Repeat
+        for child in node.child_nodes():
+            info = self._info[id(child)]
+            if info is None:
+                return None
+            variables.update(info[0])
+            config = config or info[1]
+            phrases = phrases or info[2]
+            worth = worth or info[3]
+
+        if isinstance(node, Var):
+            variables[id(node)] = node
+        if kind is LangConfig:
+            # the phrases below render in this config, whatever the outer one
+            config = None
+        elif isinstance(node, PhraseElement):
+            config = node
+            phrases = worth = True
+        return variables, config, phrases, worth
+
+    def cacheable(self, node: Node, pending: _Pending) -> bool:
+        '''
+        Whether the renders of the node are worth keeping. Phrases add the
+        pending branches themselves and jump past them, so below pending
+        branches only subtrees without phrases are kept.
+        '''
+        info = self.info(node)
+        return info is not None and info[3] and not (pending and info[2])
+
+    def memo(self, node: Node, write: bool) -> '_Memo':
+        info = cast(_PureInfo, self.info(node))
+        return _Memo(node, tuple(info[0].values()), info[1], write)
+
+
+class _Memo(object):
+    '''
+    A pure subtree of a program: its renders are kept in the cache of the
+    context, under the subtree, the values of its variables and the
+    features of the language. Programs of any template that has the
+    subtree find them, so the context keys kept are all of those it adds.
+    '''
+
+    __slots__ = ('node', 'variables', 'phrase', 'write')
+
+    def __init__(self, node: Node, variables: Tuple[Var, ...], phrase: Optional[PhraseElement],
+                 write: bool) -> None:
+        self.node = node
+        self.variables = variables
+        # a phrase of the subtree that renders in the config of the context,
+        # or else in the one above it
+        self.phrase = phrase
+        # whether the subtree is written to the output or left on the stack
+        self.write = write
+
+    def key(self, ctx: Ctx) -> Tuple:
+        bindings = ctx.bindings
+        # the entry holds the node, so a node that took the id of another
+        # doesn't get its renders
+        ret: List[Any] = [id(self.node), self.write]
+        for var in self.variables:
+            value = bindings[var.name] if var.name in bindings else var.value
+            # 1 and True are equal, but render differently
+            ret.append(value.__class__)
+            ret.append(value)
+        if self.phrase is not None:
+            config = ctx.config or self.phrase.get_parent_config()
+            ret.append(config.feature_mask if config is not None else None)
+        return tuple(ret)
+
+
+def _recording(store: Any, keys: List[int]) -> Tuple[Callable[[int], None], Callable[[Any], None]]:
+    '''
+    Makes the store record the keys added to it in `keys`, until it is
+    bound again.
+    '''
+    add = store.add
+    update = store.update
+
+    def record(key: int) -> None:
+        keys.append(key)
+        add(key)
+
+    def record_all(new: Any) -> None:
+        new = tuple(new)
+        keys.extend(new)
+        update(new)
+
+    store.add = record
+    store.update = record_all
+    return record, record_all
+
+
+class Program(object):
+    '''
+    A render tree compiled into a flat list of instructions.
+    Rendering a program gives the same output and context updates as
+    rendering the tree it was compiled from.
+
+    The text is written out as a sequence of fragments instead of being
+    concatenated along the tree, so long documents render in linear time.
+    '''
+
+    def __init__(self, code: List[Instruction], node: ValidType = None, optimize: bool = True,
+                 keys: Dict[int, Node] = None, lean: bool = False, memo: bool = False) -> None:
+        self.code = tuple(code)
+        self.node = node
+        self.optimize = optimize
+        # nodes of the context keys computed ahead of time, by key
+        self.keys = keys or {}
+        # whether the context only gets the nodes the template checks
+        self.lean = lean
+        # whether the renders of pure subtrees go through the cache of the
+        # context
+        self.memo = memo
+        self._profiled: Optional[Program] = None
+        self._private: Optional[Program] = None
+        self._memoized: Optional[Program] = None
+
+    def __repr__(self) -> str:
+        return f'Program(instructions={len(self.code)})'
+
+    def run(self, ctx: Ctx, write: Callable[[str], Any] = None) -> Optional[str]:
+        '''
+        Renders the program, passing each fragment of text to `write`.
+        Without `write`, the fragments are joined and returned.
+        '''
+        out: Optional[List[str]] = None
+        if write is None:
+            out = []
+            write = out.append
+        code = self.code
+        end = len(code)
+        stack: List[Any] = []
+        push = stack.append
+        pop = stack.pop
+        loops: List[list] = []
+        configs: List[Any] = []
+        add = ctx.add
+        store = ctx.store
+        add_key = store.add
+        add_keys = store.update
+        cache = ctx.cache
+        # the subtree being kept, as its key, the write of the output and
+        # the parts and keys it renders
+        memo: Optional[Tuple[_Memo, Tuple, Callable[[str], Any], List[str], List[int]]] = None
+        pc = 0
+
+        try:
+            while pc < end:
+                op, a, b = code[pc]
+                pc += 1
+                if op == WTEXT:
+                    add_keys(b)
+                    write(a)
+                elif op == WRITE:
+                    write(str(pop()))
+                elif op == CONST:
+                    add_key(b)
+                    push(a)
+                elif op == ADD:
+                    if b is None:
+                        add(a)
+                    else:
+                        add_key(b)
+                elif op == OR:
+                    right = pop()
+                    left = stack[-1]
+                    if isinstance(left, bool) and isinstance(right, bool):
+                        stack[-1] = left or right
+                    else:
+                        stack[-1] = left + ' ' + right
+                elif op == TEXT:
+                    add_keys(b)
+                    push(a)
+                elif op == JOIN:
+                    parts = stack[-a:]
+                    del stack[-a:]
+                    push(b.join(parts))
+                elif op == VAR:
+                    bindings = ctx.bindings
+                    value = bindings[a.name] if a.name in bindings else a.value
+                    assert value is not None
+                    add(a)
+                    push(str(value))
+                elif op == VALUE:
+                    bindings = ctx.bindings
+                    value = bindings[a.name] if a.name in bindings else a.value
+                    assert value is not None
+                    push(str(value))
+                elif op == JUMP:
+                    pc = a
+                elif op == JUMP_IF_FALSE:
+                    if not pop():
+                        pc = a
+                elif op == MATCH:
+                    pc = a.get(str(pop()), b)
+                elif op == BINOP:
+                    right = pop()
+                    stack[-1] = a(stack[-1], right)
+                elif op == CHOOSE:
+                    # drawing from a sequence as long as `items` consumes the
+                    # random stream exactly like `Choices.render`
+                    node, key, pending = b
+                    rng = ctx.rng or node.rng or random
+                    if node._alias is None and not node.exclude:
+                        pc, item, item_key = rng.choice(a)
+                    else:
+                        pc, item, item_key = a[node._pick(rng, *_excluded(ctx, node))]
+                    if key is None:
+                        add(node)
+                    else:
+                        add_key(key)
+                    if item_key is None:
+                        add(item)
+                    else:
+                        add_key(item_key)
+                    # the enclosing branches add themselves, and the item,
+                    # before the item renders
+                    while pending:
+                        add(pending[0])
+                        if item_key is None:
+                            add(item)
+                        else:
+                            add_key(item_key)
+                        pending = pending[1]
+                elif op == IN_CTX:
+                    push(ctx.contains(a) if b is None else store.has(b))
+                elif op == ATTR:
+                    push(a.value)
+                elif op == RESOLVE:
+                    push(a.resolve(ctx))
+                elif op == NOT:
+                    stack[-1] = not stack[-1]
+                elif op == SENTENCE:
+                    ret = str(stack[-1]).capitalize()
+                    if not ret.endswith('.'):
+                        ret += '.'
+                    stack[-1] = ret
+                elif op == PUSH:
+                    push(a)
+                elif op == INJECT:
+                    a._next_record(ctx)
+                elif op == REPEAT:
+                    count = a.resolve(ctx)
+                    assert count is not None
+                    count = len(range(count))
+                    if count:
+                        loops.append([count, [], None])
+                        if a.scoped:
+                            loops[-1][-1] = store.mark()
+                            add_key = store.add
+                            add_keys = store.update
+                    else:
+                        push(a.sep.join(()))
+                        pc = b
+                elif op == REPEAT_NEXT:
+                    loop = loops[-1]
+                    loop[1].append(pop())
+                    loop[0] -= 1
+                    if loop[-1] is not None:
+                        # each iteration in a scope of its own
+                        store.restore(loop[-1])
+                        if loop[0]:
+                            loop[-1] = store.mark()
+                        add_key = store.add
+                        add_keys = store.update
+                    if loop[0]:
+                        pc = b
+                    else:
+                        loops.pop()
+                        push(a.sep.join(loop[1]))
+                elif op == LOOP:
+                    count = a.resolve(ctx)
+                    assert count is not None
+                    count = len(range(count))
+                    if count:
+                        loops.append([count, None])
+                        if a.scoped:
+                            loops[-1][-1] = store.mark()
+                            add_key = store.add
+                            add_keys = store.update
+                    else:
+                        pc = b
+                elif op == LOOP_NEXT:
+                    loop = loops[-1]
+                    loop[0] -= 1
+                    if loop[-1] is not None:
+                        store.restore(loop[-1])
+                        if loop[0]:
+                            loop[-1] = store.mark()
+                        add_key = store.add
+                        add_keys = store.update
+                    if loop[0]:
+                        write(a.sep)
+                        pc = b
+                    else:
+                        loops.pop()
+                elif op == CONFIG:
+                    configs.append(ctx.config)
+                    ctx.config = a
+                elif op == END_CONFIG:
+                    ctx.config = configs.pop()
+                elif op == CALL:
+                    ret = a.render(ctx)
+                    pending = b
+                    while pending:
+                        add(pending[0])
+                        if isinstance(ret, Node):
+                            add(ret)
+                        pending = pending[1]
+                    push(_render(ret, ctx))
+                elif op == ENTER:
+                    ctx.profiler.enter(a)
+                elif op == EXIT:
+                    ctx.profiler.exit(a)
+                elif op == ARM:
+                    ctx.profiler.arm(a, b)
+                elif op == MEMO:
+                    key = a.key(ctx)
+                    try:
+                        kept = cache._get(key, a.node)
+                    except TypeError:
+                        # values that can't be keyed render as usual
+                        key = kept = None
+                    if kept is not None:
+                        add_keys(kept[2])
+                        if a.write:
+                            write(kept[1])
+                        else:
+                            push(kept[1])
+                        pc = b
+                    elif key is not None:
+                        memo = (a, key, write, [], [])
+                        if a.write:
+                            write = memo[3].append
+                        add_key, add_keys = _recording(store, memo[4])
+                elif op == END_MEMO:
+                    if memo is not None:
+                        kept, key, write, parts, keys = memo
+                        if a:
+                            value = ''.join(parts)
+                            write(value)
+                        else:
+                            value = stack[-1]
+                        cache._put(key, (kept.node, value, tuple(keys)))
+                        memo = None
+                        store._bind()
+                        add_key = store.add
+                        add_keys = store.update
+                else:
+                    raise ValueError(f'Unknown opcode {op}')
+        finally:
+            # a failed render leaves the context under its original config,
+            # and without the scopes of its loops
+            if configs:
+                ctx.config = configs[0]
+            for loop in reversed(loops):
+                if loop[-1] is not None:
+                    store.restore(loop[-1])
+            if memo is not None:
+                store._bind()
+
+        return ''.join(out) if out is not None else None
+
+    def render(self, ctx: Ctx = None, bindings: Mapping[str, Any] = None) -> str:
+        return cast(str, self._run(ctx, bindings, None))
+
+    def render_to(self, stream: IO, ctx: Ctx = None, bindings: Mapping[str, Any] = None,
+                  encoding: str = 'utf-8') -> None:
+        '''
+        Renders the program straight into a text or binary stream, fragment
+        by fragment, without building the whole text in memory. Text is
+        encoded with `encoding` for binary streams.
+        '''
+        write: Callable[[str], Any] = stream.write
+        if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+            def encode(text: str) -> Any:
+                return stream.write(text.encode(encoding))
+            write = encode
+        self._run(ctx, bindings, write)
+
+    def _run(self, ctx: Optional[Ctx], bindings: Optional[Mapping[str, Any]],
+             write: Optional[Callable[[str], Any]]) -> Optional[str]:
+        if ctx is None:
+            return self.private().run(Ctx(bindings), write)
+        elif ctx.profiler is not None:
+            with ctx.bound(bindings), ctx.profiler.counting(ctx):
+                return self.profiled().run(ctx, write)
+
+        program = self if ctx.cache is None else self.memoized()
+        if bindings is None:
+            return program.run(ctx, write)
+
+        with ctx.bound(bindings):
+            return program.run(ctx, write)
+
+    def profiled(self) -> 'Program':
+        '''
+        The same program, reporting each node it renders to the profiler of
+        the context.
+        '''
+        if self._profiled is None:
+            self._profiled = compile(self.node, self.optimize, profile=True)
+        return self._profiled
+
+    def private(self) -> 'Program':
+        '''
+        The same program, for contexts of its own that nothing else reads:
+        it only adds to them the nodes that the template checks.
+        '''
+        if self._private is None:
+            self._private = self if self.lean or self.node is None else \
+                compile(self.node, self.optimize, lean=True)
+        return self._private
+
+    def memoized(self) -> 'Program':
+        '''
+        The same program, keeping the renders of its pure subtrees in the
+        cache of the context.
+        '''
+        if self._memoized is None:
+            self._memoized = self if self.memo or self.node is None else \
+                compile(self.node, self.optimize, lean=self.lean, memo=True)
+        return self._memoized
+
+
+def _unwrap(node: ValidType) -> ValidType:
+    while type(node) is Node and isinstance(node.value, Node):
+        node = node.value
+    return node
+
+
+def _is_text(node: ValidType) -> bool:
+    '''
+    Whether a node always renders to a string, so that `|` and `+` on it
+    concatenate instead of combining booleans or numbers.
+    '''
+    stack = [node]
+    while stack:
+        node = _unwrap(stack.pop())
+        kind = type(node)
+        if kind is Node:
+            if not isinstance(node.value, str):
+                return False
+        elif kind is Operation:
+            if node.op in ('or', 'add'):
+                stack.extend(node.operands)
+            elif node.op != 'sentence':
+                return False
+        elif kind is Branch:
+            stack.extend((node.left, node.right))
+        elif kind is Match:
+            stack.extend(node.cases.values())
+            stack.append(node.default)
+        elif kind is Choices:
+            stack.extend(node.items)
+        elif not isinstance(node, Node):
+            return False
+    return True
+
+
+def _as_text(instruction: Instruction) -> Optional[Tuple[str, Tuple[int, ...]]]:
+    op, a, b = instruction
+    if op == CONST:
+        return a, (b, )
+    elif op == PUSH and isinstance(a, str):
+        return a, ()
+    elif op == TEXT:
+        return a, b
+    return None
+
+
+class _Compiler(object):
+    def __init__(self, optimize: bool = True, profile: bool = False,
+                 queries: _Queries = None, purity: _Purity = None) -> None:
+        self.code: List[Instruction] = []
+        self.optimize = optimize
+        self.profile = profile
+        # in lean programs, the checks that tell which nodes to keep
+        self.queries = queries
+        # in memoized programs, the subtrees whose renders are kept, and
+        # whether one of them is being compiled
+        self.purity = purity
+        self.memoizing = False
+        self.keys: Dict[int, Node] = {}
+        # jumps out of the outermost pending branch, by its id
+        self.exits: Dict[int, List[int]] = {}
+
+    def recorded(self, node: Node) -> bool:
+        '''
+        Whether the node is added to the context.
+        '''
+        # the renders kept have all the keys, for the programs that need them
+        return self.queries is None or self.memoizing or self.queries.relevant(node)
+
+    def recorded_key(self, node: Node) -> Optional[int]:
+        return self.key(node) if self.recorded(node) else _UNRECORDED
+
+    def recorded_pending(self, pending: _Pending) -> _Pending:
+        '''
+        The pending branches that add themselves to the context.
+        '''
+        if self.queries is None:
+            return pending
+        branches = []
+        while pending:
+            if self.recorded(pending[0]):
+                branches.append(pending[0])
+            pending = pending[1]
+        for branch in reversed(branches):
+            pending = (branch, pending, pending[2] if pending else branch)
+        return pending
+
+    def key(self, node: Node) -> Optional[int]:
+        '''
+        Context key of a node if it can be computed ahead of time.
+        '''
+        if node._is_dynamic():
+            return None
+        ret = hash(node)
+        self.keys[ret] = node
+        return ret
+
+    def emit(self, op: int, a: Any = None, b: Any = None) -> int:
+        self.code.append((op, a, b))
+        return len(self.code) - 1
+
+    def patch(self, index: int, a: Any = None, b: Any = None) -> None:
+        self.code[index] = (self.code[index][0], a, b)
+
+    def compile(self, node: ValidType, pending: _Pending = None, write: bool = False) -> None:
+        '''
+        Emits the code that leaves the fully rendered `node` on the stack,
+        or that writes it to the output with `write`. `pending` links the
+        enclosing branches, innermost first, that add themselves to the
+        context once `node` has been rendered.
+        '''
+        # each node is compiled by a generator that yields its children, to
+        # be compiled in between its own instructions, so deep trees take an
+        # explicit stack instead of one python frame per level
+        stack = [(self.visit(node, pending, write), self.enter(node))]
+        while stack:
+            child = next(stack[-1][0], None)
+            if child is None:
+                entered = stack.pop()[1]
+                if entered is not None:
+                    self.emit(EXIT, entered)
+            else:
+                stack.append((self.visit(*child), self.enter(child[0])))
+
+    def enter(self, node: ValidType) -> Optional[Node]:
+        '''
+        Reports entering the node when profiling, returning it to be left.
+        Nodes that only wrap another one are left out.
+        '''
+        if self.profile and isinstance(node, Node) and not (
+                type(node) is Node and isinstance(node.value, Node)):
+            self.emit(ENTER, node)
+            return node
+        return None
+
+    def visit(self, node: ValidType, pending: _Pending, write: bool) -> _Steps:
+        # nodes that are written to the output pass their own parts on to
+        # it, so their text is never concatenated; the others are rendered
+        # on the stack and written at once
+        if not isinstance(node, Node):
+            self.emit(PUSH, node)
+            if write:
+                self.emit(WRITE)
+            return
+
+        if self.purity is not None and not self.memoizing and self.purity.cacheable(node, pending):
+            # the subtree is compiled as usual, between the lookup of its
+            # render and the keeping of it
+            memo = self.purity.memo(node, write)
+            start = self.emit(MEMO)
+            self.memoizing = True
+            yield node, pending, write
+            self.memoizing = False
+            self.emit(END_MEMO, write)
+            self.patch(start, memo, len(self.code))
+            return
+
+        kind = type(node)
+        if kind is Const:
+            if write:
+                self.emit(WTEXT, str(node.value), (self.key(node), ) if self.recorded(node) else ())
+            elif self.recorded(node):
+                self.emit(CONST, str(node.value), self.key(node))
+            else:
+                self.emit(PUSH, str(node.value))
+        elif kind is Var:
+            self.emit(VAR if self.recorded(node) else VALUE, node)
+            if write:
+                self.emit(WRITE)
+        elif kind is Node:
+            if isinstance(node.value, Node):
+                yield node.value, pending, write
+                return
+            self.emit(PUSH, node.value)
+            if write:
+                self.emit(WRITE)
+        elif kind is Operation:
+            yield from self.compile_operation(node, write)
+        elif kind is Branch:
+            yield from self.compile_branch(node, pending, write)
+            return
+        elif kind is Match:
+            yield from self.compile_match(node, pending, write)
+            return
+        elif kind is Choices:
+            yield from self.compile_choices(node, pending, write)
+            return
+        elif kind is Injector:
+            self.emit(INJECT, node)
+            yield node.node, None, write
+        elif kind is Repeat:
+            start = self.emit(LOOP if write else REPEAT, node)
+            yield node.node, None, write
+            self.emit(LOOP_NEXT if write else REPEAT_NEXT, node, start + 1)
+            self.patch(start, node, len(self.code))
+        elif kind is LangConfig:
+            self.emit(CONFIG, node)
+            yield node.value, None, write
+            self.emit(END_CONFIG)
+        else:
+            self.emit(CALL, node, self.recorded_pending(pending))
+            if write:
+                self.emit(WRITE)
+            self.exit_pending(pending)
+
+    def exit_pending(self, pending: _Pending) -> None:
+        '''
+        Jumps past the pending branches, for nodes that already added them.
+        '''
+        if pending:
+            self.exits.setdefault(id(pending[2]), []).append(self.emit(JUMP))
+
+    def compile_operation(self, node: Operation, write: bool = False) -> _Steps:
+        op = node.op
+        required_operands = 2 if op in _BINARY_OPS else 1
+        assert len(node.operands) == required_operands
+
+        if op in ('or', 'add') and (write or self.optimize):
+            if (yield from self.compile_chain(node, write)):
+                return
+
+        if op == 'in_ctx':
+            # profiled checks go through the context, which counts them
+            operand = node.operands[0]
+            self.emit(IN_CTX, operand, None if self.profile else self.key(operand))
+            if write:
+                self.emit(WRITE)
+            return
+
+        start = len(self.code)
+        for operand in node.operands:
+            yield operand, None, False
+
+        folded = self.constant(start) if self.optimize else None
+        if folded is not None and op in ('sentence', 'noop'):
+            text, keys = folded
+            if op == 'sentence':
+                text = text.capitalize()
+                text = text if text.endswith('.') else text + '.'
+            self.code[start:] = [(WTEXT if write else TEXT, text, keys)]
+            return
+        elif op == 'not':
+            self.emit(NOT)
+        elif op == 'or':
+            self.emit(OR)
+        elif op == 'sentence':
+            self.emit(SENTENCE)
+        elif op == 'noop':
+            pass
+        else:
+            self.emit(BINOP, getattr(operator, op))
+        if write:
+            self.emit(WRITE)
+
+    def compile_chain(self, node: Operation, write: bool = False) -> _ChainSteps:
+        '''
+        Compiles a chain of `|` and `+` on text into a single join of its
+        parts, with the constant runs between them folded into one string,
+        or into writes of its parts in order with `write`. Returns False,
+        emitting nothing, if some part may not be text.
+        '''
+        parts: List[ValidType] = []
+        stack: List[ValidType] = [node]
+        while stack:
+            item = _unwrap(stack.pop())
+            if type(item) is Operation and item.op in ('or', 'add'):
+                left, right = item.operands
+                stack.extend((right, ' ', left) if item.op == 'or' else (right, left))
+            elif isinstance(item, str) or _is_text(item):
+                parts.append(item)
+            else:
+                return False
+
+        if not self.optimize:
+            # only the concatenations go, the parts are compiled as they are
+            for part in parts:
+                if isinstance(part, str):
+                    self.emit(WTEXT, part, ())
+                else:
+                    yield part, None, True
+            return True
+
+        # runs of constants and separators render, and add their keys,
+        # together: between two other parts they become the separator of
+        # the join, at the ends of the chain they are parts of their own
+        runs: List[Any] = []
+        for part in parts:
+            if isinstance(part, str) or type(part) is Const:
+                if not runs or not isinstance(runs[-1], tuple):
+                    runs.append(([], []))
+                texts, keys = runs[-1]
+                if isinstance(part, str):
+                    texts.append(part)
+                else:
+                    texts.append(str(cast(Const, part).value))
+                    if self.recorded(cast(Const, part)):
+                        keys.append(self.key(cast(Const, part)))
+            else:
+                runs.append(part)
+        runs = [(''.join(run[0]), tuple(run[1])) if isinstance(run, tuple) else run
+                for run in runs]
+        if write:
+            for run in runs:
+                if not isinstance(run, tuple):
+                    yield run, None, True
+                elif run[0]:
+                    self.emit(WTEXT, *run)
+                else:
+                    for key in run[1]:
+                        self.emit(ADD, None, key)
+            return True
+
+        nodes = [i for i, run in enumerate(runs) if not isinstance(run, tuple)]
+        if not nodes:
+            self.emit(TEXT, *runs[0])
+            return True
+
+        first, last = nodes[0], nodes[-1]
+        gaps = {runs[i + 1][0] if j > i + 1 else '' for i, j in zip(nodes, nodes[1:])}
+        ends = runs[:first] + runs[last + 1:]
+        sep = gaps.pop() if len(gaps) == 1 else None
+        if sep and any(text for text, _ in ends):
+            sep = None
+
+        count = 0
+        for i, run in enumerate(runs):
+            if not isinstance(run, tuple):
+                yield run, None, False
+                count += 1
+            elif run[0] and (sep is None or i < first or i > last):
+                self.emit(TEXT, *run)
+                count += 1
+            else:
+                for key in run[1]:
+                    self.emit(ADD, None, key)
+
+        if count > 1:
+            self.emit(JOIN, count, sep or '')
+        return True
+
+    def constant(self, start: int) -> Optional[Tuple[str, Tuple[int, ...]]]:
+        '''
+        Text and context keys of the code emitted since `start`, if it is a
+        single constant.
+        '''
+        return _as_text(self.code[start]) if len(self.code) == start + 1 else None
+
+    def compile_branch(self, node: Branch, pending: _Pending, write: bool = False) -> _Steps:
+        pending = (node, pending, pending[2] if pending else node)
+        if isinstance(node.cond.value, Operation):
+            yield from self.compile_operation(node.cond.value)
+        elif isinstance(node.cond, Var):
+            self.emit(RESOLVE, node.cond)
+        else:
+            self.emit(ATTR, node.cond)
+
+        jump_right = self.emit(JUMP_IF_FALSE)
+        if self.profile:
+            self.emit(ARM, node, 'left')
+        yield node.left, pending, write
+        jump_end = self.emit(JUMP)
+        self.patch(jump_right, len(self.code))
+        if self.profile:
+            self.emit(ARM, node, 'right')
+        yield node.right, pending, write
+        self.patch(jump_end, len(self.code))
+
+        # arms that rendered fully get here, the inner branches added
+        # themselves just before, in the same order as the nested renders
+        if self.recorded(node):
+            self.emit(ADD, node, self.key(node))
+        for jump in self.exits.pop(id(node), ()):
+            self.patch(jump, len(self.code))
+
+    def compile_match(self, node: Match, pending: _Pending, write: bool = False) -> _Steps:
+        pending = (node, pending, pending[2] if pending else node)
+        yield node.label, None, False
+        match = self.emit(MATCH)
+
+        # where each case starts, cases shared by many names compiled once
+        starts: Dict[int, int] = {}
+        targets: Dict[str, int] = {}
+        jumps = []
+        arms = [*node.cases.items(), (None, node.default)]
+        for name, case in arms:
+            if id(case) not in starts:
+                starts[id(case)] = len(self.code)
+                if self.profile:
+                    self.emit(ARM, node, 'default' if name is None else name)
+                yield case, pending, write
+                jumps.append(self.emit(JUMP))
+            if name is not None:
+                targets[name] = starts[id(case)]
+        for jump in jumps:
+            self.patch(jump, len(self.code))
+        self.patch(match, targets, starts[id(node.default)])
+
+        if self.recorded(node):
+            self.emit(ADD, node, self.key(node))
+        for jump in self.exits.pop(id(node), ()):
+            self.patch(jump, len(self.code))
+
+    def compile_choices(self, node: Choices, pending: _Pending, write: bool = False) -> _Steps:
+        choose = self.emit(CHOOSE)
+
+        # each target holds where the item starts and its context key, the
+        # item is added before it renders along with the pending branches
+        targets = []
+        jumps = []
+        for item in node.items:
+            targets.append((len(self.code), item, self.recorded_key(item)))
+            yield item, None, write
+            if pending:
+                self.exit_pending(pending)
+            else:
+                jumps.append(self.emit(JUMP))
+        for jump in jumps:
+            self.patch(jump, len(self.code))
+        self.patch(choose, tuple(targets), (node, self.recorded_key(node), self.recorded_pending(pending)))
+
+
+def compile(node: ValidType, optimize: bool = True, profile: bool = False,
+            lean: bool = False, memo: bool = False) -> Program:
+    '''
+    Compiles a render tree into a `Program` that renders it without
+    re-dispatching through every node. With `optimize`, subtrees made only
+    of constants are rendered ahead of time and chains of `|` and `+` are
+    joined in one step. The context still gets the keys of every constant,
+    so `in_ctx` checks see the same nodes. With `profile`, the program
+    reports the nodes it renders to the profiler of the context.
+
+    With `lean`, the context only gets the nodes that the template may
+    check in it, which spares hashing the others. The texts are the same,
+    but the context is of no use afterwards, so lean programs are meant
+    for contexts of their own, like the ones of `render_many`.
+
+    With `memo`, the subtrees that render the same for the same variables
+    and language, and that branch, repeat or look up phrases, are looked up
+    in the `RenderCache` of the context before rendering, and kept in it
+    after.
+    '''
+    compiler = _Compiler(optimize, profile, _Queries(node) if lean else None,
+                         _Purity() if memo else None)
+    compiler.compile(node, write=True)
+    return Program(compiler.code, node, optimize, compiler.keys, lean, memo)
+
+
+def _program(template: ValidType, lean: bool = False) -> Program:
+    '''
+    The program of a template, compiled on first use and kept in its root
+    like `render` does, or its lean variant for contexts of their own.
+    '''
+    if not isinstance(template, Node):
+        return compile(template, lean=lean)
+    program = _compiled(template)
+    return program.private() if lean else program
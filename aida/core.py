@@ -1,52 +1,381 @@
 import operator
-from typing import List, Union, cast, Dict
+import random
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import IO, Any, Deque, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union, cast
 
-__all__ = ['Ctx', 'render', 'Const', 'Var',
+__all__ = ['Ctx', 'render', 'render_to', 'Const', 'Var',
            'Empty', 'Injector', 'Repeat', 'Injector']
 
 BasicTypes = (str, int, float, bool)
 PrimaryType = Union[str, int, float, bool]
 ValidType = Union['Node', PrimaryType]
+# version of the variables a hash was computed for, None if it never changes
+HashMemo = Tuple[Optional[int], int]
 
 
 def to_node(obj: ValidType) -> 'Node':
     if isinstance(obj, Node):
         return obj
     elif isinstance(obj, BasicTypes):
-        return Const(obj)
+        return _const(obj)
     else:
         raise Exception(f'Impossible to cast {obj} to Node')
 
 
+# constants, and the operations of operators between them, shared by every
+# template that has them; each lives as long as some template uses it
+_interned: 'weakref.WeakValueDictionary[Tuple, Node]' = weakref.WeakValueDictionary()
+# floats are left out: 0.0 and -0.0 are equal, but render differently
+_INTERNED_TYPES = (str, int, bool)
+
+
+def _const(value: PrimaryType) -> 'Node':
+    if type(value) not in _INTERNED_TYPES:
+        return Const(value)
+    key = (type(value), value)
+    node = _interned.get(key)
+    if node is None:
+        node = _interned[key] = Const(value)
+    return node
+
+
+def _interned_key(node: 'Node') -> Optional[Tuple]:
+    '''
+    Key of `node` among the interned nodes, if it is one of them.
+    '''
+    kind = type(node)
+    if kind is Const:
+        if type(node.value) not in _INTERNED_TYPES:
+            return None
+        key: Tuple = (type(node.value), node.value)
+    elif kind is Node and type(node.value) is Operation:
+        operation = cast(Operation, node.value)
+        key = (operation.op, ) + tuple(id(operand) for operand in operation.operands)
+    else:
+        return None
+    return key if _interned.get(key) is node else None
+
+
+def _operation(op: str, *operands: 'Node') -> 'Node':
+    '''
+    Node of an operation, shared with other templates if its operands are.
+    '''
+    shared = []
+    for operand in operands:
+        kind = type(operand)
+        if kind is Const and type(operand.value) in _INTERNED_TYPES:
+            # constants built by hand are as good as the interned ones
+            operand = _const(operand.value)
+        elif kind is not Node or _interned_key(operand) is None:
+            return Node(Operation(op, *operands))
+        shared.append(operand)
+
+    key = (op, ) + tuple(map(id, shared))
+    node = _interned.get(key)
+    if node is None:
+        node = _interned[key] = Node(Operation(op, *shared))
+    return node
+
+
+class Store(object):
+    '''
+    Keys of the nodes rendered in a context, or of the last `window` nodes
+    rendered if a window is given, so that long documents don't keep all
+    they mention.
+
+    A `mark` is a snapshot of the store: what is added after it is recorded,
+    so `restore` takes the store back to the mark without copying it, and
+    `release` keeps it. Marks are closed in the reverse order they were
+    taken.
+    '''
+
+    def __init__(self, window: int = None) -> None:
+        assert window is None or window > 0
+        self.window = window
+        # keys in the store, with the times they are in the window if any
+        self._keys: Union[Set[int], Dict[int, int]] = set() if window is None else {}
+        self._recent: Deque[int] = deque()
+        # keys added since the first open mark, or without a set, the
+        # keys each addition pushed out of the window
+        self._log: List[Optional[int]] = []
+        self._marks: List[int] = []
+        # times keys left the store, through restores or the window
+        self._forgotten = 0
+        self.has = self._keys.__contains__
+        self._bind()
+
+    def _bind(self) -> None:
+        # a plain store adds straight to its set
+        if self.window is None and not self._marks:
+            self.add = cast(Set[int], self._keys).add
+            self.update = cast(Set[int], self._keys).update
+        else:
+            self.add = self._add
+            self.update = self._update
+
+    def __repr__(self) -> str:
+        return f'Store(items={len(self)})'
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._keys)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._keys
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Store):
+            return set(self._keys) == set(other._keys)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def _add(self, key: int) -> None:
+        if self.window is None:
+            keys = cast(Set[int], self._keys)
+            if key not in keys:
+                keys.add(key)
+                self._log.append(key)
+            return
+
+        counts = cast(Dict[int, int], self._keys)
+        recent = self._recent
+        counts[key] = counts.get(key, 0) + 1
+        recent.append(key)
+        evicted = None
+        if len(recent) > self.window:
+            evicted = recent.popleft()
+            count = counts[evicted] - 1
+            if count:
+                counts[evicted] = count
+            else:
+                del counts[evicted]
+                self._forgotten += 1
+        if self._marks:
+            self._log.append(evicted)
+
+    def _update(self, keys: Iterable[int]) -> None:
+        for key in keys:
+            self._add(key)
+
+    def mark(self) -> int:
+        mark = len(self._log)
+        self._marks.append(mark)
+        self._bind()
+        return mark
+
+    def restore(self, mark: int) -> None:
+        '''
+        Removes what was added since `mark`, and closes it.
+        '''
+        log = self._log
+        if len(log) > mark:
+            self._forgotten += 1
+        if self.window is None:
+            keys = cast(Set[int], self._keys)
+            while len(log) > mark:
+                keys.discard(cast(int, log.pop()))
+        else:
+            counts = cast(Dict[int, int], self._keys)
+            recent = self._recent
+            while len(log) > mark:
+                evicted = log.pop()
+                key = recent.pop()
+                count = counts[key] - 1
+                if count:
+                    counts[key] = count
+                else:
+                    del counts[key]
+                if evicted is not None:
+                    recent.appendleft(evicted)
+                    counts[evicted] = counts.get(evicted, 0) + 1
+        self.release(mark)
+
+    def release(self, mark: int) -> None:
+        '''
+        Keeps what was added since `mark`, and closes it.
+        '''
+        assert self._marks and self._marks[-1] == mark, 'Marks are closed in reverse order.'
+        self._marks.pop()
+        if not self._marks:
+            self._log.clear()
+            self._bind()
+
+
 class Ctx(object):
     '''
     Context is used to store items that have been rendered.
     One common application is checking if something is in context.
+
+    With a `window`, only the last nodes rendered are in context. With a
+    `cache`, the renders of the subtrees that don't depend on anything else
+    than their variables are kept in it and reused.
     '''
 
-    def __init__(self) -> None:
-        self.store = set()
+    def __init__(self, bindings: Mapping[str, Any] = None, rng: random.Random = None,
+                 config: 'Node' = None, profiler: Any = None, window: int = None,
+                 cache: Any = None) -> None:
+        self.store = Store(window)
+        self.bindings = bindings or {}
+        self.cursors: Dict[int, Iterator] = {}
+        # items of the excluding choices not found said yet, by choice id
+        self.unsaid: Dict[int, Any] = {}
+        # random generator used by this render, the global one if not set
+        self.rng = rng
+        # language config of the innermost `LangConfig` being rendered
+        self.config = config
+        # `Profiler` that records the renders in this context, if any
+        self.profiler = profiler
+        # `RenderCache` that keeps the renders of pure subtrees, if any
+        self.cache = cache
+        # keys of the dynamic nodes, for some bound values and `_version`
+        self._keys: Optional[Tuple[Tuple[Tuple[str, Any], ...], int, Dict[int, Tuple['Node', int]]]] = None
 
     def __repr__(self) -> str:
         return f'Ctx(items={len(self.store)})'
 
+    @contextmanager
+    def bound(self, bindings: Optional[Mapping[str, Any]]) -> Iterator['Ctx']:
+        '''
+        Binds more variables while the block runs.
+        '''
+        if not bindings:
+            yield self
+            return
+
+        previous = self.bindings
+        self.bindings = {**previous, **bindings}
+        try:
+            yield self
+        finally:
+            self.bindings = previous
+
+    @contextmanager
+    def scope(self) -> Iterator['Ctx']:
+        '''
+        Forgets the nodes rendered while the block runs, once it ends, like
+        a paragraph whose mentions don't carry over to the next one.
+        '''
+        mark = self.store.mark()
+        try:
+            yield self
+        finally:
+            self.store.restore(mark)
+
+    def key(self, obj: 'Node') -> int:
+        '''
+        Key of a node in the store, taking the bound variables into account.
+        '''
+        if not self.bindings or not obj._is_dynamic():
+            return hash(obj)
+
+        keys = self._memo()
+        if keys is None:
+            keys = {}
+            self._keys = (self._bound(), _version, keys)
+        else:
+            entry = keys.get(id(obj))
+            if entry is not None and entry[0] is obj:
+                return entry[1]
+
+        try:
+            ret = obj._compute_hash(self)
+        except RecursionError:
+            return self._deep_key(obj)
+        keys[id(obj)] = (obj, ret)
+        return ret
+
+    def _memo(self) -> Optional[Dict[int, Tuple['Node', int]]]:
+        memo = self._keys
+        if memo is not None and memo[1] == _version and memo[0] == self._bound():
+            return memo[2]
+        return None
+
+    def _bound(self) -> Tuple[Tuple[str, Any], ...]:
+        # the bound values rather than the mapping, which may change in place
+        return tuple(self.bindings.items())
+
+    def _deep_key(self, obj: 'Node') -> int:
+        '''
+        Keys the dynamic part of a deep subtree bottom-up. The keys are kept
+        while the bindings and the assigned values don't change, so keying
+        the nodes above doesn't walk the subtree again.
+        '''
+        keys = self._memo()
+        if keys is None:
+            keys = {}
+            self._keys = (self._bound(), _version, keys)
+
+        stack = [(obj, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                keys[id(node)] = (node, node._compute_hash(self))
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.child_nodes()
+                             if child._is_dynamic() and id(child) not in keys)
+        return keys[id(obj)][1]
+
     def contains(self, obj: 'Node') -> bool:
-        return hash(obj) in self.store
+        return self.store.has(self.key(obj))
 
     def add(self, obj: 'Node') -> 'Ctx':
-        self.store.add(hash(obj))
+        self.store.add(self.key(obj))
         return self
 
 
+# bumped whenever a variable changes, so memoized hashes of the nodes above
+# it know they are stale
+_version = 0
+
+
 def _render(obj: ValidType, ctx: Ctx) -> ValidType:
-    if isinstance(obj, Node):
-        return _render(obj.render(ctx), ctx)
-    else:
-        return obj
+    while isinstance(obj, Node):
+        obj = obj.render(ctx)
+    return obj
+
+
+def render(obj: ValidType, ctx: Ctx = None, bindings: Mapping[str, Any] = None) -> str:
+    '''
+    Renders a node. Variables named in `bindings` take the given values for
+    this call only, instead of the values assigned to them.
+
+    The tree is compiled on its first render and the program is kept in its
+    root, so rendering takes no python frame per level of the tree.
+    '''
+    if not isinstance(obj, Node):
+        return str(obj)
+    return _compiled(obj).render(ctx, bindings)
+
+
+def render_to(obj: ValidType, stream: IO, ctx: Ctx = None, bindings: Mapping[str, Any] = None,
+              encoding: str = 'utf-8') -> None:
+    '''
+    Renders a node straight into a text or binary stream. The text is
+    written fragment by fragment as it renders, so long documents are never
+    held in memory as a whole. Binary streams get it encoded with `encoding`.
+    '''
+    if not isinstance(obj, Node):
+        obj = Node(obj)
+    _compiled(obj).render_to(stream, ctx, bindings, encoding)
+
 
+def _compiled(obj: 'Node') -> Any:
+    program = obj._program
+    if program is None:
+        # the compiler is built on top of this module
+        from .compiler import compile
+        program = obj._program = compile(obj)
+    return program
 
-def render(obj: ValidType, ctx: Ctx = None) -> str:
-    return str(_render(obj, ctx or Ctx()))
+
+def _key(node: 'Node', ctx: Optional[Ctx]) -> int:
+    return hash(node) if ctx is None else ctx.key(node)
 
 
 def _update_ctx(ctx: Ctx, *items: ValidType) -> ValidType:
@@ -56,20 +385,99 @@ def _update_ctx(ctx: Ctx, *items: ValidType) -> ValidType:
     return items[-1]
 
 
+# slots of a node left out when it is pickled
+_UNPICKLED = frozenset(('_hash_memo', '_dynamic', '_program', '__weakref__'))
+
+
 class Node(object):
     '''
     Basic building block for the render tree.
+
+    Nodes have no `__dict__`: every subclass lists its attributes in
+    `__slots__`.
     '''
 
+    __slots__ = ('value', 'parent', '_hash_memo', '_dynamic', '_program', '__weakref__')
+
     def __init__(self, value: ValidType) -> None:
         self.value = value
         self.parent = None
+        self._clear_caches()
 
         if isinstance(value, Node):
             value.parent = self
 
+    def _clear_caches(self) -> None:
+        self._hash_memo: Optional[HashMemo] = None
+        self._dynamic: Optional[bool] = None
+        # compiled program used by `render`
+        self._program: Any = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the caches hold hashes of strings, which change from one process
+        # to the next, so they are built again after loading
+        state = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name not in _UNPICKLED and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self._clear_caches()
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __hash__(self) -> int:
-        return hash(self.value)
+        # static subtrees keep their hash forever, dynamic ones (that hold a
+        # variable) until some variable changes
+        memo = self._hash_memo
+        if memo is not None and (memo[0] is None or memo[0] == _version):
+            return memo[1]
+
+        # hash the stale part of the subtree bottom-up, so that deep trees
+        # don't recurse once per level
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                node._store_hash()
+            elif not node._has_fresh_hash():
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.child_nodes())
+        return cast(HashMemo, self._hash_memo)[1]
+
+    def _has_fresh_hash(self) -> bool:
+        memo = self._hash_memo
+        return memo is not None and (memo[0] is None or memo[0] == _version)
+
+    def _store_hash(self) -> None:
+        version = _version
+        ret = self._compute_hash()
+        self._hash_memo = (version if self._is_dynamic() else None, ret)
+
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return _key(self.value, ctx) if isinstance(self.value, Node) else hash(self.value)
+
+    def _is_dynamic(self) -> bool:
+        dynamic = self._dynamic
+        if dynamic is None:
+            # settle the inner nodes bottom-up, like the hash
+            stack = [(self, False)]
+            while stack:
+                node, ready = stack.pop()
+                children = node.child_nodes()
+                if ready:
+                    node._dynamic = any(child._is_dynamic() for child in children)
+                elif node._dynamic is None and children:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in children)
+            # a leaf never got pushed
+            dynamic = self._dynamic = bool(self._dynamic)
+        return dynamic
+
+    def child_nodes(self) -> Tuple['Node', ...]:
+        return (self.value, ) if isinstance(self.value, Node) else ()
 
     def __repr__(self) -> str:
         return f'Node[{self.value}]'
@@ -81,40 +489,40 @@ class Node(object):
             return self.value
 
     def __and__(self, other: ValidType) -> 'Node':
-        return Node(Operation('and_', self, to_node(other)))
+        return _operation('and_', self, to_node(other))
 
     def __gt__(self, other: ValidType) -> 'Node':
-        return Node(Operation('gt', self, to_node(other)))
+        return _operation('gt', self, to_node(other))
 
     def __ge__(self, other: ValidType) -> 'Node':
-        return Node(Operation('ge', self, to_node(other)))
+        return _operation('ge', self, to_node(other))
 
     def __lt__(self, other: ValidType) -> 'Node':
-        return Node(Operation('lt', self, to_node(other)))
+        return _operation('lt', self, to_node(other))
 
     def __le__(self, other: ValidType) -> 'Node':
-        return Node(Operation('le', self, to_node(other)))
+        return _operation('le', self, to_node(other))
 
     def __eq__(self, other: ValidType) -> 'Node':
-        return Node(Operation('eq', self, to_node(other)))
+        return _operation('eq', self, to_node(other))
 
     def __ne__(self, other: ValidType) -> 'Node':
-        return Node(Operation('ne', self, to_node(other)))
+        return _operation('ne', self, to_node(other))
 
     def __invert__(self) -> 'Node':
-        return Node(Operation('not', self))
+        return _operation('not', self)
 
     def __add__(self, other: ValidType) -> 'Node':
-        return Node(Operation('add', self, to_node(other)))
+        return _operation('add', self, to_node(other))
 
     def __or__(self, other: ValidType) -> 'Node':
-        return Node(Operation('or', self, to_node(other)))
+        return _operation('or', self, to_node(other))
 
     def in_ctx(self) -> 'Node':
-        return Node(Operation('in_ctx', self))
+        return _operation('in_ctx', self)
 
     def sentence(self) -> 'Node':
-        return Node(Operation('sentence', self))
+        return _operation('sentence', self)
 
 
 class Operation(Node):
@@ -122,6 +530,8 @@ class Operation(Node):
     Special kind of node that represents an operation applied to its children.
     '''
 
+    __slots__ = ('op', 'operands')
+
     def __init__(self, op: str, *operands: ValidType) -> None:
         super().__init__(Empty)
         self.op = op
@@ -130,8 +540,11 @@ class Operation(Node):
         for operand in self.operands:
             operand.parent = self
 
-    def __hash__(self) -> int:
-        return hash((self.op, self.operands))
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return hash((self.op, tuple(_key(operand, ctx) for operand in self.operands)))
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return self.operands
 
     def __repr__(self) -> str:
         return (f'{self.op} {self.operands[0]}' if len(self.operands) == 1
@@ -171,6 +584,8 @@ class Const(Node):
     A constant value, like 3 or 'hi'.
     '''
 
+    __slots__ = ()
+
     def __init__(self, value: PrimaryType) -> None:
         super().__init__(value)
 
@@ -181,7 +596,7 @@ class Const(Node):
         return cast(str, _update_ctx(ctx, self, str(self.value)))
 
 
-Empty = Const('')
+Empty = _const('')
 
 
 class Var(Node):
@@ -189,12 +604,36 @@ class Var(Node):
     A variable that can be assigned a value.
     '''
 
+    __slots__ = ('_value', 'name')
+
     def __init__(self, name: str = None) -> None:
         super().__init__(Empty)
         self.name = name
 
+    @property
+    def value(self) -> ValidType:
+        return self._value
+
+    @value.setter
+    def value(self, value: ValidType) -> None:
+        global _version
+        self._value = value
+        _version += 1
+
     def __hash__(self) -> int:
-        return hash(('var', self.name, self.value))
+        return self._compute_hash()
+
+    def _has_fresh_hash(self) -> bool:
+        return True
+
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return hash(('var', self.name, self.value if ctx is None else self.resolve(ctx)))
+
+    def _is_dynamic(self) -> bool:
+        return True
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return ()
 
     def __repr__(self) -> str:
         return f'Var({self.name}={self.value})'
@@ -203,48 +642,114 @@ class Var(Node):
         self.value = value
         return self
 
+    def resolve(self, ctx: Ctx) -> Any:
+        '''
+        Value of the variable in a render: bound in the context or assigned.
+        '''
+        bindings = ctx.bindings
+        return bindings[self.name] if self.name in bindings else self.value
+
     def render(self, ctx: Ctx) -> str:
-        assert self.value is not None
-        return cast(str, _update_ctx(ctx, self, str(self.value)))
+        value = self.resolve(ctx)
+        assert value is not None
+        return cast(str, _update_ctx(ctx, self, str(value)))
 
 
 class Injector(Var):
+    __slots__ = ('children', 'node', '_cursor')
+
     def __init__(self, children: List[Var], node: Node, name: str = None) -> None:
         super().__init__(name)
         self.children = {child.name: child for child in children}
         self.node = node
+        self._cursor = 0
 
-    def __hash__(self) -> int:
-        return hash(self.node)
+    __hash__ = Node.__hash__
+    _has_fresh_hash = Node._has_fresh_hash
+    _is_dynamic = Node._is_dynamic
+
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return _key(self.node, ctx)
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return (self.node, )
 
     def _inject(self, d: Dict[str, PrimaryType]):
         for var_name, value in d.items():
             self.children[var_name].assign(value)
 
+    def _bind(self, ctx: Ctx, d: Dict[str, PrimaryType]):
+        bindings = dict(ctx.bindings)
+        for var_name, value in d.items():
+            bindings[self.children[var_name].name] = value
+        ctx.bindings = bindings
+
     def assign(self, value: List[Dict[str, PrimaryType]]) -> 'Injector':
         self.value = value
+        self._cursor = 0
         self._inject(value[0])
         return self
 
+    def _next_record(self, ctx: Ctx) -> None:
+        '''
+        Fills the variables with the next record. Records bound to the name
+        of the injector are read through a cursor kept in the context and
+        become bindings, assigned records are injected into the variables.
+        '''
+        if self.name in ctx.bindings:
+            records = ctx.cursors.get(id(self))
+            if records is None:
+                records = ctx.cursors[id(self)] = iter(ctx.bindings[self.name])
+            record = next(records, None)
+            assert record is not None
+            self._bind(ctx, record)
+        else:
+            assert self.value and self._cursor < len(self.value)
+            self._cursor += 1
+            self._inject(self.value[self._cursor - 1])
+
     def render(self, ctx: Ctx) -> ValidType:
-        assert self.value
-        self._inject(self.value.pop(0))
+        self._next_record(ctx)
         return _render(self.node, ctx)
 
 
 class Repeat(Var):
-    def __init__(self, node: ValidType, name: str = None, sep=' ') -> None:
+    '''
+    Renders a node a number of times, joined by `sep`. A `scoped` repeat
+    renders each iteration in a scope of its own, so what one iteration
+    mentions is not in context in the next.
+    '''
+
+    __slots__ = ('node', 'sep', 'scoped')
+
+    def __init__(self, node: ValidType, name: str = None, sep=' ', scoped: bool = False) -> None:
         super().__init__(name)
         self.node = to_node(node)
         self.sep = sep
+        self.scoped = scoped
 
-    def __hash__(self) -> int:
-        return hash(self.node)
+    __hash__ = Node.__hash__
+    _has_fresh_hash = Node._has_fresh_hash
+    _is_dynamic = Node._is_dynamic
+
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        return _key(self.node, ctx)
+
+    def child_nodes(self) -> Tuple[Node, ...]:
+        return (self.node, )
 
     def assign(self, value: int) -> 'Repeat':
         self.value = value
         return self
 
     def render(self, ctx: Ctx) -> str:
-        assert self.value is not None
-        return self.sep.join(_render(self.node, ctx) for _ in range(self.value))
+        count = self.resolve(ctx)
+        assert count is not None
+        if not self.scoped:
+            return self.sep.join(_render(self.node, ctx) for _ in range(count))
+
+        parts = []
+        for _ in range(count):
+            with ctx.scope():
+                parts.append(_render(self.node, ctx))
+        return self.sep.join(parts)
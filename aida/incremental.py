@@ -0,0 +1,352 @@
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+
+from .branching import Branch, Match
+from .choices import Choices
+from .compiler import Program, _Compiler, _is_text, _Queries, _unwrap, _walk
+from .core import Const, Ctx, Injector, Node, Operation, Repeat, ValidType, Var
+from .lang import LangConfig
+
+__all__ = ['LiveRender']
+
+# segments nested deeper than this render as a whole, so deep trees don't
+# take a python frame per level
+_MAX_DEPTH = 64
+
+# kinds of nodes that don't add the enclosing branches to the context
+# themselves, so an arm made of them renders the same on its own
+_PENDING_FREE = (Node, Const, Var, Operation, Repeat, LangConfig)
+
+
+class _Segment(object):
+    '''
+    A part of the template that renders to a part of the text: its last
+    text and the context keys it added, in order. A dirty segment has
+    variables that changed, a stale one has segments below that did.
+    '''
+
+    __slots__ = ('node', 'parent', 'text', 'keys', 'checks', 'dirty', 'stale')
+
+    def __init__(self, node: ValidType, parent: Optional['_Segment']) -> None:
+        self.node = node
+        self.parent = parent
+        self.text = ''
+        self.keys: tuple = ()
+        # whether it checks the context, so it may change with the segments
+        # rendered before it
+        self.checks = False
+        self.dirty = True
+        self.stale = True
+
+
+class _Leaf(_Segment):
+    __slots__ = ('program', )
+
+    def render(self, live: 'LiveRender', ctx: Ctx) -> None:
+        self.text = live._program(self).run(ctx)
+
+
+class _Chain(_Segment):
+    __slots__ = ('parts', )
+
+    def render(self, live: 'LiveRender', ctx: Ctx) -> None:
+        for part in self.parts:
+            if not isinstance(part, str):
+                live._visit(part, ctx)
+        self.text = ''.join(part if isinstance(part, str) else part.text for part in self.parts)
+
+
+class _Sentence(_Segment):
+    __slots__ = ('child', )
+
+    def render(self, live: 'LiveRender', ctx: Ctx) -> None:
+        live._visit(self.child, ctx)
+        text = self.child.text.capitalize()
+        self.text = text if text.endswith('.') else text + '.'
+
+
+class _Config(_Segment):
+    __slots__ = ('child', )
+
+    def render(self, live: 'LiveRender', ctx: Ctx) -> None:
+        previous = ctx.config
+        ctx.config = self.node
+        try:
+            live._visit(self.child, ctx)
+        finally:
+            ctx.config = previous
+        self.text = self.child.text
+
+
+class _Branch(_Segment):
+    __slots__ = ('arm', 'arms')
+
+    def render(self, live: 'LiveRender', ctx: Ctx) -> None:
+        node = self.node
+        arm = node._arm(ctx)
+        segment = self.arms.get(id(arm))
+        if segment is None:
+            segment = self.arms[id(arm)] = live._segment(arm, self)
+        elif segment is not self.arm:
+            # an arm taken again may have missed changes while it wasn't
+            segment.dirty = True
+        self.arm = segment
+        live._visit(segment, ctx)
+        if live._queries.relevant(node):
+            ctx.add(node)
+        self.text = segment.text
+
+
+# the segments that render, one kind per kind of node
+_AnySegment = Union[_Leaf, _Chain, _Sentence, _Config, _Branch]
+
+
+def _arms(node: Union[Branch, Match]) -> List[Node]:
+    if type(node) is Branch:
+        return [node.left, node.right]
+    return [*node.cases.values(), node.default]
+
+
+def _pending_free(branch: Union[Branch, Match]) -> bool:
+    '''
+    Whether the arms of the branch, and of the branches in them, render the
+    same on their own as inside it.
+    '''
+    stack = _arms(branch)
+    while stack:
+        arm = _unwrap(stack.pop())
+        if type(arm) is Branch or type(arm) is Match:
+            stack.extend(_arms(arm))
+        elif isinstance(arm, Node) and type(arm) not in _PENDING_FREE:
+            return False
+    return True
+
+
+def _chain_parts(node: Operation) -> Optional[List[ValidType]]:
+    '''
+    Parts of a chain of `|` and `+` on text, with the spaces of `|`, or None
+    if some part may not be text.
+    '''
+    parts: List[ValidType] = []
+    stack: List[ValidType] = [node]
+    while stack:
+        item = _unwrap(stack.pop())
+        if type(item) is Operation and item.op in ('or', 'add'):
+            left, right = item.operands
+            stack.extend((right, ' ', left) if item.op == 'or' else (right, left))
+        elif isinstance(item, str) or _is_text(item):
+            parts.append(item)
+        else:
+            return None
+    return parts
+
+
+class LiveRender(object):
+    '''
+    A render of a template that stays up to date as its variables change,
+    like a forecast whose readings come in one at a time. `update` binds
+    new values, `refresh` picks up the values assigned to the variables,
+    and both re-render only the parts of the template that read a variable
+    that changed, splicing them into the previous text.
+
+    The template is cut into segments along its chains of `|` and `+`, its
+    sentences, language configs and branches. Each variable leads to the
+    segments that read it, a branch to the ones of its condition, which
+    pick the arm again. Segments that check the context also render again
+    when a segment before them added other nodes to it.
+
+    Parts of the template that didn't change keep their random choices.
+    Injectors are not supported: bind their records instead.
+    '''
+
+    def __init__(self, template: ValidType, bindings: Mapping[str, Any] = None, rng: Any = None) -> None:
+        assert not (isinstance(template, Node) and any(
+            isinstance(node, Injector) for node in _walk(template))), 'Injectors are not supported.'
+        self.template = template
+        self.bindings: Dict[str, Any] = dict(bindings or {})
+        self.rng = rng
+        self._queries = _Queries(template)
+        self._checks = bool(self._queries.queried)
+        # the segments that read each variable, by the id of the variable
+        self._readers: Dict[int, List[_AnySegment]] = {}
+        self._vars: Dict[int, Var] = {}
+        self._names: Dict[Optional[str], List[int]] = {}
+        self._values: Dict[int, Any] = {}
+        # variables of the segments cut since the last render
+        self._new: List[int] = []
+        # whether a segment rendered in this pass added other nodes
+        self._moved = False
+        self._log: List[int] = []
+        # scopes take back what they add, which the segments can't record
+        whole = self._checks and any(isinstance(node, Repeat) and node.scoped for node in _walk(template))
+        self._root = self._segment(template, None, _MAX_DEPTH if whole else 0)
+        self.text = ''
+        self.refresh()
+
+    def __repr__(self) -> str:
+        return f'LiveRender({self.text!r})'
+
+    def update(self, bindings: Mapping[str, Any] = None, **values: Any) -> str:
+        '''
+        Binds the variables to new values and gives the new text.
+        '''
+        values.update(bindings or {})
+        self.bindings.update(values)
+        return self._refresh([key for name in values for key in self._names.get(name, ())])
+
+    def refresh(self) -> str:
+        '''
+        Renders again the segments whose variables changed, bound or
+        assigned, since the last render, and gives the new text.
+        '''
+        return self._refresh(self._vars)
+
+    def _refresh(self, keys: Iterable[int]) -> str:
+        ctx = Ctx(self.bindings, self.rng)
+        changed = False
+        for key in keys:
+            value = self._vars[key].resolve(ctx)
+            if key in self._values and _same(self._values[key], value):
+                continue
+            self._values[key] = value
+            changed = True
+            for segment in self._readers[key]:
+                segment.dirty = True
+                self._stale(segment)
+
+        if changed or self._root.dirty or self._root.stale:
+            self._moved = False
+            if self._checks:
+                self._record(ctx)
+            self._visit(self._root, ctx)
+            self.text = self._root.text
+
+        # arms taken for the first time rendered with the current values
+        for key in self._new:
+            self._values[key] = self._vars[key].resolve(ctx)
+        self._new.clear()
+        return self.text
+
+    def _record(self, ctx: Ctx) -> None:
+        # the keys added go to the log too, so each segment knows its own
+        store = ctx.store
+        add = store.add
+        update = store.update
+        log: List[int] = []
+
+        def record(key: int) -> None:
+            log.append(key)
+            add(key)
+
+        def record_all(keys: Any) -> None:
+            keys = tuple(keys)
+            log.extend(keys)
+            update(keys)
+
+        store.add = record
+        store.update = record_all
+        self._log = log
+
+    def _stale(self, segment: _Segment) -> None:
+        parent = segment.parent
+        while parent is not None and not parent.stale:
+            parent.stale = True
+            parent = parent.parent
+
+    def _visit(self, segment: _AnySegment, ctx: Ctx) -> None:
+        if not (segment.dirty or segment.stale or (segment.checks and self._moved)):
+            # the same text, and the same nodes in the context
+            if self._checks:
+                ctx.store.update(segment.keys)
+            return
+
+        start = len(self._log) if self._checks else 0
+        previous = segment.keys
+        segment.render(self, ctx)
+        segment.dirty = segment.stale = False
+        if self._checks:
+            segment.keys = tuple(self._log[start:])
+            if segment.keys != previous:
+                self._moved = True
+
+    def _segment(self, node: ValidType, parent: Optional[_Segment], depth: int = 0) -> _AnySegment:
+        '''
+        Cuts a node into segments, registering the variables they read.
+        '''
+        node = _unwrap(node)
+        segment: _AnySegment
+        kind = type(node)
+        parts = _chain_parts(node) if kind is Operation and node.op in ('or', 'add') else None
+        if depth >= _MAX_DEPTH or not isinstance(node, Node):
+            segment = _Leaf(node, parent)
+        elif parts is not None:
+            segment = _Chain(node, parent)
+            chain: List[Union[str, _AnySegment]] = []
+            for part in parts:
+                if isinstance(part, str):
+                    chain.append(part)
+                elif type(part) is Const and not self._queries.relevant(part):
+                    chain.append(str(part.value))
+                else:
+                    chain.append(self._segment(part, segment, depth + 1))
+            segment.parts = chain
+        elif kind is Operation and node.op == 'sentence':
+            segment = _Sentence(node, parent)
+            segment.child = self._segment(node.operands[0], segment, depth + 1)
+        elif kind is LangConfig:
+            segment = _Config(node, parent)
+            segment.child = self._segment(node.value, segment, depth + 1)
+        elif (kind is Branch or kind is Match) and _pending_free(node):
+            segment = _Branch(node, parent)
+            segment.arm = None
+            segment.arms = {}
+            # the key it adds to the context hashes the variables of its arms
+            self._read(segment, node if self._queries.relevant(node) else
+                       node.cond if kind is Branch else node.label)
+            segment.checks = self._checks and _checks(node)
+            # the arms are cut when they are first taken
+            return segment
+        else:
+            segment = _Leaf(node, parent)
+
+        if isinstance(segment, _Leaf):
+            segment.program = None
+            if isinstance(node, Node):
+                self._read(segment, node)
+                segment.checks = self._checks and _checks(node)
+        else:
+            segment.checks = any(child.checks for child in _children(segment))
+        return segment
+
+    def _read(self, segment: _AnySegment, node: Node) -> None:
+        for var in _walk(node):
+            if isinstance(var, Var):
+                if id(var) not in self._vars:
+                    self._vars[id(var)] = var
+                    self._readers[id(var)] = []
+                    self._names.setdefault(var.name, []).append(id(var))
+                    self._new.append(id(var))
+                self._readers[id(var)].append(segment)
+
+    def _program(self, segment: _Leaf) -> Program:
+        if segment.program is None:
+            # the context only gets the nodes the whole template checks
+            compiler = _Compiler(queries=self._queries)
+            compiler.compile(segment.node, write=True)
+            segment.program = Program(compiler.code, segment.node, keys=compiler.keys, lean=True)
+        return segment.program
+
+
+def _children(segment: _AnySegment) -> List[_AnySegment]:
+    if isinstance(segment, _Chain):
+        return [part for part in segment.parts if not isinstance(part, str)]
+    return [segment.child]
+
+
+def _same(old: Any, new: Any) -> bool:
+    # 1 and True are equal, but render differently
+    return old is new or (type(old) is type(new) and not isinstance(old, Node) and old == new)
+
+
+def _checks(node: Node) -> bool:
+    return any((isinstance(child, Operation) and child.op == 'in_ctx') or (
+        isinstance(child, Choices) and child.exclude) for child in _walk(node))
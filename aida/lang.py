@@ -1,7 +1,8 @@
 from enum import Enum
-from typing import Dict, FrozenSet, Optional, List, cast
+from itertools import chain
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple, cast
 
-from .core import Ctx, Empty, Node, Node, ValidType, _render, to_node
+from .core import Ctx, Empty, Node, Node, ValidType, _key, _render, to_node
 
 __all__ = ['Gender', 'Lang', 'GNumber', 'GPerson',
            'create_enumeration', 'NP', 'VP', 'LangConfig']
@@ -37,14 +38,46 @@ class GPerson(LangFeature):
     THIRD = 'third'
 
 
+# every feature gets one bit, so a set of features is an int mask and
+# intersections are a single `&`
+_feature_bits: Dict[LangFeature, int] = {}
+
+
+def _feature_mask(feats: Iterable[Optional[LangFeature]]) -> int:
+    mask = 0
+    for feat in feats:
+        if feat is not None:
+            bit = _feature_bits.get(feat)
+            if bit is None:
+                bit = _feature_bits[feat] = 1 << len(_feature_bits)
+            mask |= bit
+    return mask
+
+
+_feature_mask(chain(Gender, Lang, GNumber, GPerson))
+
+
+def _count_bits(mask: int) -> int:
+    return bin(mask).count('1')
+
+
 class LangElement(Node):
+    __slots__ = ('_parent_config_cache', )
+
     def __init__(self, value: ValidType) -> None:
         super().__init__(value)
         self._parent_config_cache = None
 
-    def __hash__(self) -> int:
+    def _compute_hash(self, ctx: Ctx = None) -> int:
+        # the config is identified by the object itself: hashing it would
+        # hash its subtree, which contains this element
         config = self.get_parent_config()
-        return hash((config, self.value))
+        value = _key(self.value, ctx) if isinstance(self.value, Node) else self.value
+        return hash((id(config) if config else None, value))
+
+    def _is_dynamic(self) -> bool:
+        # until a config is found, wrapping the tree may still change the hash
+        return not self.get_parent_config() or super()._is_dynamic()
 
     def get_parent_config(self):
         if not self._parent_config_cache:
@@ -60,57 +93,102 @@ class LangElement(Node):
 
 
 class PhraseElement(LangElement):
-    def __init__(self, value) -> None:
+    __slots__ = ('mappings', '_stack', '_resolved', '_masks', '_lexicon')
+
+    def __init__(self, value, lexicon: Any = None) -> None:
         super().__init__(value)
         self.mappings: LangMapping = {}
-        self._stack: List[LangFeature] = []
+        # features pushed for the next mappings, empty for most phrases
+        self._stack: Tuple[LangFeature, ...] = ()
+        # best mapping for each feature mask seen so far
+        self._resolved: Dict[int, ValidType] = {}
+        self._masks: Tuple[Tuple[int, str], ...] = ()
+        # `Lexicon` that holds the mappings of the value, until they are
+        # loaded on first use
+        self._lexicon = lexicon
 
     def __repr__(self) -> str:
         return f'{self.__class__.__name__}[{self.value}]'
 
-    def _render(self, ctx: Ctx, feat: LangFeatureSet) -> ValidType:
-        greatest_subset = frozenset()
-        best_key = None
-        for fs_key in self.mappings:
-            subset = fs_key.intersection(feat)
-            if len(subset) > len(greatest_subset):
-                greatest_subset = subset
-                best_key = fs_key
+    def _resolve(self, mask: int) -> ValidType:
+        '''
+        Value of the first mapping that shares the most features with `mask`.
+        '''
+        try:
+            return self._resolved[mask]
+        except KeyError:
+            pass
+
+        if self._lexicon is not None:
+            self._load()
+        greatest = 0
+        ret = self.value
+        for key_mask, value in self._masks:
+            shared = _count_bits(key_mask & mask)
+            if shared > greatest:
+                greatest = shared
+                ret = value
+
+        self._resolved[mask] = ret
+        return ret
 
-        return self.mappings[best_key] if best_key else self.value
+    def _render(self, ctx: Ctx, feat: LangFeatureSet) -> ValidType:
+        return self._resolve(_feature_mask(feat))
 
     def render(self, ctx: Ctx) -> ValidType:
-        config = self.get_parent_config()
+        config = ctx.config or self.get_parent_config()
         assert config
-        return self._render(ctx, cast(LangConfig, config).features)
+        return self._resolve(cast(LangConfig, config).feature_mask)
+
+    def _load(self) -> None:
+        '''
+        Adds the mappings of the value in the lexicon, if it has one.
+        '''
+        lexicon = self._lexicon
+        if lexicon is None:
+            return
+        self._lexicon = None
+        for feats, value in lexicon.mappings(type(self).__name__, self.value):
+            self.mappings.setdefault(feats, value)
+        self._masks = tuple((_feature_mask(key), value) for key, value in self.mappings.items())
+        self._resolved.clear()
 
     def add_mapping(self, value: str, *feat: LangFeature) -> 'PhraseElement':
+        self._load()
         self.mappings[frozenset(feat).union(frozenset(self._stack))] = value
+        self._masks = tuple((_feature_mask(key), value) for key, value in self.mappings.items())
+        self._resolved.clear()
         return self
 
     def push(self, *feats: LangFeature) -> 'PhraseElement':
-        self._stack.extend(feats)
+        self._stack += feats
         return self
 
     def pop(self) -> 'PhraseElement':
-        self._stack.pop()
+        self._stack = self._stack[:-1]
         return self
 
     def clear(self) -> 'PhraseElement':
-        self._stack.clear()
+        self._stack = ()
         return self
 
 
 class NP(PhraseElement):
-    pass
+    __slots__ = ()
 
 
 class VP(PhraseElement):
-    pass
+    __slots__ = ()
+
+
+_config_masks: Dict[Tuple[Optional[LangFeature], ...], int] = {}
 
 
 class LangConfig(LangElement):
-    def __init__(self, value: ValidType, lang=None, number=None, person=None, gender=None) -> None:
+    __slots__ = ('lang', 'number', 'person', 'gender')
+
+    def __init__(self, value: ValidType = Empty, lang=None, number=None, person=None,
+                 gender=None) -> None:
         super().__init__(value)
         self.lang = lang or Lang.ENGLISH
         self.number = number or GNumber.SINGULAR
@@ -121,8 +199,23 @@ class LangConfig(LangElement):
     def features(self) -> FrozenSet:
         return frozenset((self.lang, self.number, self.person, self.gender)) - frozenset((None, ))
 
+    @property
+    def feature_mask(self) -> int:
+        feats = (self.lang, self.number, self.person, self.gender)
+        mask = _config_masks.get(feats)
+        if mask is None:
+            mask = _config_masks[feats] = _feature_mask(feats)
+        return mask
+
     def render(self, ctx: Ctx) -> ValidType:
-        return _render(self.value, ctx)
+        # the config flows down through the context, so phrases render
+        # under it even if they belong to a tree shared by other configs
+        previous = ctx.config
+        ctx.config = self
+        try:
+            return _render(self.value, ctx)
+        finally:
+            ctx.config = previous
 
 
 def create_enumeration(config: LangConfig, *nodes: ValidType) -> Node:
@@ -0,0 +1,190 @@
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .lang import NP, VP, Gender, GNumber, GPerson, Lang, LangFeature, PhraseElement
+
+__all__ = ['Lexicon', 'load_lexicon', 'write_lexicon']
+
+_MAGIC = b'AIDALEX\x01'
+
+# magic, number of features, entries and mappings, and size of the strings
+_HEADER = struct.Struct('<8sIIII')
+# offset and length of a string
+_STRING = struct.Struct('<II')
+# key string, first mapping and number of mappings, sorted by key
+_ENTRY = struct.Struct('<IIII')
+# features as a mask of the features of the file, and value string
+_MAPPING = struct.Struct('<III')
+
+_FEATURE_CLASSES = {cls.__name__: cls for cls in (Gender, Lang, GNumber, GPerson)}
+
+
+def _key(kind: str, lemma: str) -> bytes:
+    # entries of each kind of phrase are apart, ordered by lemma
+    return f'{kind}\0{lemma}'.encode('utf-8')
+
+
+def write_lexicon(path: str, phrases: Iterable[PhraseElement]) -> int:
+    '''
+    Writes the mappings of `NP` and `VP` phrases to a lexicon file, under
+    the kind of each phrase and its value, its lemma. The features are
+    written once, and each mapping keeps them as a bit mask; the strings
+    are written once too, however many mappings share them. The file is
+    replaced at once, so processes that have it open keep reading the old
+    one. Returns the number of entries.
+    '''
+    entries: Dict[bytes, List[Tuple[FrozenSet[LangFeature], str]]] = {}
+    for phrase in phrases:
+        assert isinstance(phrase.value, str), 'Phrases are written under a string value.'
+        key = _key(type(phrase).__name__, phrase.value)
+        if key in entries:
+            raise ValueError(f'{phrase!r} is written twice.')
+        phrase._load()
+        entries[key] = list(phrase.mappings.items())
+
+    strings = bytearray()
+    offsets: Dict[bytes, Tuple[int, int]] = {}
+
+    def string(data: bytes) -> Tuple[int, int]:
+        ret = offsets.get(data)
+        if ret is None:
+            ret = offsets[data] = (len(strings), len(data))
+            strings.extend(data)
+        return ret
+
+    features: Dict[LangFeature, int] = {}
+    feature_records = []
+    entry_records = []
+    mapping_records = []
+    for key in sorted(entries):
+        entry_records.append(_ENTRY.pack(*string(key), len(mapping_records), len(entries[key])))
+        for feats, value in entries[key]:
+            mask = 0
+            for feat in feats:
+                if feat not in features:
+                    features[feat] = len(features)
+                    feature_records.append(_STRING.pack(*string(f'{type(feat).__name__}.{feat.name}'.encode())))
+                mask |= 1 << features[feat]
+            mapping_records.append(_MAPPING.pack(mask, *string(value.encode('utf-8'))))
+    assert len(features) <= 32, 'Too many features for a lexicon.'
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(features), len(entry_records), len(mapping_records), len(strings)))
+            for records in (feature_records, entry_records, mapping_records):
+                f.write(b''.join(records))
+            f.write(strings)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return len(entry_records)
+
+
+class Lexicon(object):
+    '''
+    The mappings of many phrases in a file written by `write_lexicon`,
+    mapped into memory: nothing is read until a phrase looks its lemma up,
+    and processes that open the same file share its pages.
+
+    `np` and `vp` give phrases that load their mappings from the lexicon
+    the first time they render. Lemmas that aren't in it render as they
+    are. Use `load_lexicon` to open each file once per process.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, features, self._count, mappings, _ = _HEADER.unpack_from(self._data, 0)
+        if magic != _MAGIC:
+            raise ValueError('Not a lexicon, or from another version.')
+        self._entries = _HEADER.size + features * _STRING.size
+        self._mappings = self._entries + self._count * _ENTRY.size
+        self._strings = self._mappings + mappings * _MAPPING.size
+        self._features = [self._feature(self._string(*_STRING.unpack_from(self._data, _HEADER.size + i * _STRING.size)))
+                          for i in range(features)]
+
+    def __repr__(self) -> str:
+        return f'Lexicon({self.path!r}, entries={len(self)})'
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __reduce__(self) -> tuple:
+        # pickled templates open the file again, in the process that loads them
+        return load_lexicon, (self.path, )
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings + offset
+        return self._data[start:start + length].decode('utf-8')
+
+    def _feature(self, name: str) -> LangFeature:
+        cls, _, feat = name.partition('.')
+        if cls not in _FEATURE_CLASSES:
+            raise ValueError(f'Unknown feature {name!r}')
+        return _FEATURE_CLASSES[cls][feat]
+
+    def _find(self, key: bytes) -> Optional[int]:
+        '''
+        Position of the entry with `key`, by bisecting the sorted entries.
+        '''
+        data = self._data
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, _, _ = _ENTRY.unpack_from(data, self._entries + middle * _ENTRY.size)
+            start = self._strings + offset
+            found = data[start:start + length]
+            if found == key:
+                return middle
+            elif found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def mappings(self, kind: str, lemma: str) -> List[Tuple[FrozenSet[LangFeature], str]]:
+        '''
+        Features and value of each mapping of the `kind` phrase (`NP` or
+        `VP`) with `lemma`, none if it isn't in the lexicon.
+        '''
+        index = self._find(_key(kind, lemma))
+        if index is None:
+            return []
+        _, _, first, count = _ENTRY.unpack_from(self._data, self._entries + index * _ENTRY.size)
+        ret = []
+        for i in range(first, first + count):
+            mask, offset, length = _MAPPING.unpack_from(self._data, self._mappings + i * _MAPPING.size)
+            feats = frozenset(feat for bit, feat in enumerate(self._features) if mask >> bit & 1)
+            ret.append((feats, self._string(offset, length)))
+        return ret
+
+    def np(self, lemma: str) -> NP:
+        return NP(lemma, lexicon=self)
+
+    def vp(self, lemma: str) -> VP:
+        return VP(lemma, lexicon=self)
+
+    def close(self) -> None:
+        self._data.close()
+
+
+# lexicons opened in this process, by path
+_lexicons: Dict[str, Lexicon] = {}
+
+
+def load_lexicon(path: str) -> Lexicon:
+    '''
+    The lexicon of the file at `path`, opened once per process.
+    '''
+    path = os.path.abspath(path)
+    ret = _lexicons.get(path)
+    if ret is None:
+        ret = _lexicons[path] = Lexicon(path)
+    return ret
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+__all__ = ['RenderCache']
+
+# the subtree of each render, its text or value, and the context keys it
+# added
+_Entry = Tuple[Any, Any, Tuple[int, ...]]
+
+
+class RenderCache(object):
+    '''
+    Keeps the renders of the pure subtrees of templates: those that render
+    the same whenever their variables have the same values and the language
+    the same features, like a `create_match` on a label. Rendering with
+    `Ctx(cache=cache)`, or `render_many(..., cache=cache)`, looks each of
+    them up before rendering it, so a label renders its arm once per
+    distinct value, and the context still gets the nodes it rendered.
+
+    At most `maxsize` renders are kept, the least recently used going first.
+    `hits`, `misses` and `evictions` count the lookups that found a render,
+    those that didn't, and the renders dropped to make room.
+    '''
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Tuple, _Entry]' = OrderedDict()
+
+    def __repr__(self) -> str:
+        return (f'RenderCache(size={len(self)}, hits={self.hits}, misses={self.misses}, '
+                f'evictions={self.evictions})')
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        '''
+        Drops the renders kept and resets the counts.
+        '''
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def _get(self, key: Tuple, node: Any) -> Optional[_Entry]:
+        entries = self._entries
+        ret = entries.get(key)
+        if ret is None or ret[0] is not node:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entries.move_to_end(key)
+        return ret
+
+    def _put(self, key: Tuple, entry: _Entry) -> None:
+        entries = self._entries
+        entries[key] = entry
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,73 @@
+import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from .compiler import Program, _program, compile
+from .core import Ctx, ValidType
+
+__all__ = ['render_parallel', 'record_rng']
+
+Record = Mapping[str, Any]
+
+# template last shipped to this worker process, and the program compiled
+# from it
+_worker_template: Optional[bytes] = None
+_worker_program: Optional[Program] = None
+
+
+def record_rng(seed: Any, index: int) -> random.Random:
+    '''
+    Random generator of the record at `index` in a batch seeded with `seed`.
+    Seeding from a string gives the same stream in every process.
+    '''
+    return random.Random(f'{seed}:{index}')
+
+
+def _worker(template: bytes) -> Program:
+    global _worker_template, _worker_program
+    if _worker_program is None or template != _worker_template:
+        # pickled templates leave their programs behind
+        _worker_program = compile(pickle.loads(template), lean=True)
+        _worker_template = template
+    return _worker_program
+
+
+def _render_chunk(seed: Any, start: int, records: List[Record], program: Union[Program, bytes]) -> List[str]:
+    if isinstance(program, bytes):
+        program = _worker(program)
+    return [program.render(Ctx(record, rng=record_rng(seed, index)))
+            for index, record in enumerate(records, start)]
+
+
+def _chunks(records: Iterable[Record], chunksize: int) -> Iterator[Tuple[int, List[Record]]]:
+    records = iter(records)
+    start = 0
+    chunk = list(islice(records, chunksize))
+    while chunk:
+        yield start, chunk
+        start += len(chunk)
+        chunk = list(islice(records, chunksize))
+
+
+def render_parallel(template: ValidType, records: Iterable[Record], workers: int = None,
+                    chunksize: int = 512, seed: Any = 0) -> List[str]:
+    '''
+    Renders the template once per record, like `render_many`, sharding the
+    records across a pool of processes. The template is pickled once and
+    sent with each chunk, each worker compiling it once, and the random choices of every record are drawn from a generator
+    seeded with `seed` and the position of the record, so the texts are the
+    same whatever the number of workers or the chunk size.
+    '''
+    if workers == 1:
+        program = _program(template, lean=True)
+        return [text for start, chunk in _chunks(records, chunksize)
+                for text in _render_chunk(seed, start, chunk, program)]
+
+    # not a pool initializer, which Python 3.6 doesn't have
+    shipped = pickle.dumps(template)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_chunk, seed, start, chunk, shipped)
+                   for start, chunk in _chunks(records, chunksize)]
+        return [text for future in futures for text in future.result()]
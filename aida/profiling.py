@@ -0,0 +1,169 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import IO, Any, Callable, Dict, Iterator, List, Tuple
+
+from .core import Ctx, Node
+
+__all__ = ['Profiler']
+
+
+class NodeStats(object):
+    '''
+    What the profiler saw of one node: how many times it rendered, the time
+    spent in it with and without its children, the context keys computed and
+    checked while it was the innermost node, and the arms taken if it is a
+    branch.
+    '''
+
+    def __init__(self, node: Node) -> None:
+        self.node = node
+        self.renders = 0
+        self.total = 0.0
+        self.self = 0.0
+        self.hashes = 0
+        self.lookups = 0
+        self.arms: Dict[str, int] = {}
+
+    def __repr__(self) -> str:
+        return f'NodeStats({_label(self.node)}, renders={self.renders})'
+
+
+def _label(node: Node, width: int = 80) -> str:
+    try:
+        text = repr(node)
+    except RecursionError:
+        text = type(node).__name__
+    text = ' '.join(text.split())
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+class Profiler(object):
+    '''
+    Records where the time of a render goes. Rendering with a context that
+    has a profiler, like `render(node, Ctx(profiler=profiler))`, runs a
+    version of the program that reports each node it enters and leaves;
+    contexts without one render as usual, with no cost at all.
+
+    Constants that the compiler folds into their chain are accounted for in
+    the node they were folded into.
+    '''
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self.stats: Dict[int, NodeStats] = {}
+        # open nodes as [stats, path, start, time spent in children]
+        self._frames: List[list] = []
+        # paths of nested nodes, numbered by (parent path, node id), with
+        # their parent, node and self time
+        self._paths: Dict[Tuple[int, int], int] = {}
+        self._path_nodes: List[Tuple[int, Node]] = []
+        self._path_times: List[float] = []
+
+    def __repr__(self) -> str:
+        return f'Profiler(nodes={len(self.stats)})'
+
+    def enter(self, node: Node) -> None:
+        stats = self.stats.get(id(node))
+        if stats is None:
+            stats = self.stats[id(node)] = NodeStats(node)
+        stats.renders += 1
+
+        parent = self._frames[-1][1] if self._frames else -1
+        path = self._paths.get((parent, id(node)))
+        if path is None:
+            path = self._paths[(parent, id(node))] = len(self._path_nodes)
+            self._path_nodes.append((parent, node))
+            self._path_times.append(0.0)
+        self._frames.append([stats, path, self.clock(), 0.0])
+
+    def exit(self, node: Node) -> None:
+        '''
+        Leaves `node`, and the nodes inside it that were left early by a jump.
+        '''
+        now = self.clock()
+        frames = self._frames
+        while frames:
+            stats, path, start, children = frames.pop()
+            elapsed = now - start
+            stats.total += elapsed
+            stats.self += elapsed - children
+            self._path_times[path] += elapsed - children
+            if frames:
+                frames[-1][3] += elapsed
+            if stats.node is node:
+                break
+
+    def arm(self, branch: Node, arm: str) -> None:
+        arms = self.stats[id(branch)].arms
+        arms[arm] = arms.get(arm, 0) + 1
+
+    @contextmanager
+    def counting(self, ctx: Ctx) -> Iterator[Ctx]:
+        '''
+        Counts the keys computed and checked in `ctx` while the block runs.
+        '''
+        key = ctx.key
+        contains = ctx.contains
+        frames = self._frames
+
+        def counted_key(obj: Node) -> int:
+            if frames:
+                frames[-1][0].hashes += 1
+            return key(obj)
+
+        def counted_contains(obj: Node) -> bool:
+            if frames:
+                frames[-1][0].lookups += 1
+            return contains(obj)
+
+        ctx.key = counted_key  # type: ignore
+        ctx.contains = counted_contains  # type: ignore
+        try:
+            yield ctx
+        finally:
+            del ctx.key
+            del ctx.contains
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''
+        Stats of every node, slowest first, with times in seconds.
+        '''
+        nodes = []
+        for stats in sorted(self.stats.values(), key=lambda stats: -stats.total):
+            entry = {
+                'node': _label(stats.node),
+                'type': type(stats.node).__name__,
+                'renders': stats.renders,
+                'total': stats.total,
+                'self': stats.self,
+                'hashes': stats.hashes,
+                'lookups': stats.lookups,
+            }
+            if stats.arms:
+                entry['arms'] = dict(stats.arms)
+            nodes.append(entry)
+        return {'nodes': nodes}
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def collapsed(self) -> List[str]:
+        '''
+        Self time of every path of nested nodes, in microseconds, as the
+        lines of a collapsed stack file that flame graph tools read.
+        '''
+        labels: Dict[int, str] = {}
+        names: List[str] = []
+        for parent, node in self._path_nodes:
+            label = labels.get(id(node))
+            if label is None:
+                label = labels[id(node)] = _label(node).replace(';', ',')
+            names.append(label if parent < 0 else f'{names[parent]};{label}')
+
+        return [f'{name} {round(time * 1e6)}'
+                for name, time in zip(names, self._path_times) if round(time * 1e6) > 0]
+
+    def write_collapsed(self, file: IO[str]) -> None:
+        for line in self.collapsed():
+            file.write(line + '\n')
@@ -0,0 +1,406 @@
+import hashlib
+import importlib
+import marshal
+import operator
+import os
+import random
+import tempfile
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .compiler import (
+    _UNRECORDED, ADD, BINOP, CALL, CHOOSE, CONST, IN_CTX, TEXT, WTEXT, Program)
+from .core import Const, Node, ValidType, _compiled, _const, _interned_key, to_node
+from .lexicon import Lexicon, load_lexicon
+
+__all__ = ['serialize', 'deserialize', 'TemplateCache']
+
+_MAGIC = b'AIDA\x02'
+
+# the attributes of a node, split in plain values, nodes and tuples of nodes
+# by their position in the table, and other values, encoded; their names
+# are kept once for all the nodes of the same shape
+_Shape = Tuple[int, Tuple[str, ...], Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+_Record = Tuple[int, List[Any], List[int], List[List[int]], List[Any]]
+# whether a program is optimized and lean, and its instructions
+_Code = Tuple[bool, bool, List[Tuple[int, Any, Any]]]
+
+# caches are rebuilt after loading, some of them hold hashes of strings,
+# which change from one process to the next
+_DROPPED = frozenset(('_hash_memo', '_dynamic', '_program'))
+_CLEARED = {'_parent_config_cache': None, '_resolved': {}}
+
+# slot descriptors of each class of node, by name
+_slots: Dict[type, List[Tuple[str, Any]]] = {}
+
+
+def _attributes(node: Node) -> Iterator[Tuple[str, Any]]:
+    '''
+    Attributes of `node` that are set, in its slots or its `__dict__`.
+    '''
+    cls = type(node)
+    slots = _slots.get(cls)
+    if slots is None:
+        slots = _slots[cls] = [
+            (name, base.__dict__[name]) for base in reversed(cls.__mro__)
+            for name in base.__dict__.get('__slots__', ()) if name not in ('__dict__', '__weakref__')]
+    for name, slot in slots:
+        try:
+            yield name, slot.__get__(node, cls)
+        except AttributeError:
+            # a slot that is never set, like the value of a variable
+            pass
+    yield from getattr(node, '__dict__', {}).items()
+
+
+# instruction operands that aren't plain values: context keys, tuples of
+# keys, operator functions, choice targets and pending branches
+_OPERANDS = {
+    CONST: (None, 'key'),
+    ADD: (None, 'key'),
+    IN_CTX: (None, 'key'),
+    TEXT: (None, 'keys'),
+    WTEXT: (None, 'keys'),
+    BINOP: ('operator', None),
+    CHOOSE: ('targets', 'choose'),
+    CALL: (None, 'pending'),
+}
+
+
+class _Encoder(object):
+    '''
+    Turns a tree into a table of nodes, with the nodes they refer to given
+    by their position, so that sharing is kept and deep trees don't recurse.
+    Values are encoded to what `marshal` takes: python primitives as they
+    are and everything else as a tuple tagged by its kind.
+    '''
+
+    def __init__(self) -> None:
+        self.classes: List[Tuple[str, str]] = []
+        self.class_index: Dict[type, int] = {}
+        self.nodes: List[Node] = []
+        self.index: Dict[int, int] = {}
+        self.shapes: List[_Shape] = []
+        self.shape_index: Dict[_Shape, int] = {}
+        self.records: List[_Record] = []
+        self.parents: List[Tuple[List[int], Any]] = []
+
+    def cls(self, cls: type) -> int:
+        ret = self.class_index.get(cls)
+        if ret is None:
+            ret = self.class_index[cls] = len(self.classes)
+            self.classes.append((cls.__module__, cls.__qualname__))
+        return ret
+
+    def node(self, node: Node) -> int:
+        ret = self.index.get(id(node))
+        if ret is None:
+            ret = self.index[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+        return ret
+
+    def value(self, value: Any) -> Any:
+        if value is None or type(value) in (str, int, float, bool):
+            return value
+        elif isinstance(value, Node):
+            return ('n', self.node(value))
+        elif type(value) is tuple:
+            return ('t', [self.value(item) for item in value])
+        elif type(value) is list:
+            return ('l', [self.value(item) for item in value])
+        elif type(value) is dict:
+            return ('d', [(self.value(key), self.value(item)) for key, item in value.items()])
+        elif type(value) is frozenset:
+            return ('f', [self.value(item) for item in value])
+        elif isinstance(value, Enum):
+            return ('e', self.cls(type(value)), value.name)
+        elif type(value) is random.Random:
+            return ('r', value.getstate())
+        elif isinstance(value, Lexicon):
+            return ('x', value.path)
+        raise TypeError(f'Cannot serialize {value!r}')
+
+    def encode_nodes(self) -> None:
+        '''
+        Encodes the nodes found so far, and the ones they refer to.
+        '''
+        # the table grows while it is encoded, as new nodes are found
+        while len(self.records) < len(self.nodes):
+            node = self.nodes[len(self.records)]
+            names: Tuple[List[str], ...] = ([], [], [], [])
+            values: Tuple[List[Any], ...] = ([], [], [], [])
+            parent = self
+            for name, value in _attributes(node):
+                if name in _DROPPED:
+                    continue
+                elif name == 'parent':
+                    # shared nodes point to whichever tree used them last
+                    if _interned_key(node) is None:
+                        parent = value
+                    continue
+                elif name in _CLEARED:
+                    kind, value = 3, self.value(_CLEARED[name])
+                elif isinstance(value, Node):
+                    kind, value = 1, self.node(value)
+                elif type(value) is tuple and all(isinstance(item, Node) for item in value):
+                    kind, value = 2, [self.node(item) for item in value]
+                else:
+                    value = self.value(value)
+                    kind = 3 if type(value) is tuple else 0
+                names[kind].append(name)
+                values[kind].append(value)
+            if parent is not self:
+                # the parent goes last, once the whole table is known
+                names[1].append('parent')
+                values[1].append(-1)
+                self.parents.append((values[1], parent))
+
+            shape = (self.cls(type(node)), ) + tuple(map(tuple, names))
+            index = self.shape_index.get(shape)
+            if index is None:
+                index = self.shape_index[shape] = len(self.shapes)
+                self.shapes.append(shape)  # type: ignore
+            self.records.append((index, ) + values)  # type: ignore
+
+    def finish(self) -> Tuple[List[_Shape], List[_Record]]:
+        # parents outside of the table are left out
+        for nodes, parent in self.parents:
+            nodes[-1] = self.index.get(id(parent), -1)
+        return self.shapes, self.records
+
+    def key(self, program: Program, key: Optional[int]) -> Any:
+        if key is None or key == _UNRECORDED:
+            return key
+        return self.node(program.keys[key])
+
+    def pending(self, pending: Any) -> List[int]:
+        ret = []
+        while pending:
+            ret.append(self.node(pending[0]))
+            pending = pending[1]
+        return ret
+
+    def operand(self, program: Program, kind: Optional[str], value: Any) -> Any:
+        if kind is None:
+            return self.value(value)
+        elif kind == 'key':
+            return self.key(program, value)
+        elif kind == 'keys':
+            return [self.key(program, key) for key in value]
+        elif kind == 'operator':
+            return value.__name__
+        elif kind == 'targets':
+            return [(pc, self.value(item), self.key(program, key)) for pc, item, key in value]
+        elif kind == 'choose':
+            node, key, pending = value
+            return (self.node(node), self.key(program, key), self.pending(pending))
+        return self.pending(value)
+
+    def program(self, program: Program) -> _Code:
+        code = []
+        for op, a, b in program.code:
+            kinds = _OPERANDS.get(op, (None, None))
+            code.append((op, self.operand(program, kinds[0], a), self.operand(program, kinds[1], b)))
+        return program.optimize, program.lean, code
+
+
+class _Decoder(object):
+    def __init__(self, classes: List[type], nodes: List[Node]) -> None:
+        self.classes = classes
+        self.nodes = nodes
+        self.keys: Dict[int, Node] = {}
+
+    def value(self, value: Any) -> Any:
+        if type(value) is not tuple:
+            return value
+        kind = value[0]
+        if kind == 'n':
+            return self.nodes[value[1]]
+        elif kind == 't':
+            return tuple(self.value(item) for item in value[1])
+        elif kind == 'l':
+            return [self.value(item) for item in value[1]]
+        elif kind == 'd':
+            return {self.value(key): self.value(item) for key, item in value[1]}
+        elif kind == 'f':
+            return frozenset(self.value(item) for item in value[1])
+        elif kind == 'e':
+            return self.classes[value[1]][value[2]]
+        elif kind == 'r':
+            ret = random.Random()
+            ret.setstate(value[1])
+            return ret
+        elif kind == 'x':
+            return load_lexicon(value[1])
+        raise ValueError(f'Unknown value kind {kind!r}')
+
+    def key(self, index: Optional[int]) -> Optional[int]:
+        if index is None or index == _UNRECORDED:
+            return index
+        node = self.nodes[index]
+        ret = hash(node)
+        self.keys[ret] = node
+        return ret
+
+    def pending(self, indexes: List[int]) -> Any:
+        ret = None
+        for index in reversed(indexes):
+            node = self.nodes[index]
+            ret = (node, ret, ret[2] if ret else node)
+        return ret
+
+    def operand(self, kind: Optional[str], value: Any) -> Any:
+        if kind is None:
+            return self.value(value)
+        elif kind == 'key':
+            return self.key(value)
+        elif kind == 'keys':
+            return tuple(self.key(index) for index in value)
+        elif kind == 'operator':
+            return getattr(operator, value)
+        elif kind == 'targets':
+            return tuple((pc, self.value(item), self.key(key)) for pc, item, key in value)
+        elif kind == 'choose':
+            node, key, pending = value
+            return (self.nodes[node], self.key(key), self.pending(pending))
+        return self.pending(value)
+
+    def program(self, root: Node, encoded: _Code) -> Program:
+        optimize, lean, code = encoded
+        instructions = []
+        for op, a, b in code:
+            kinds = _OPERANDS.get(op, (None, None))
+            instructions.append((op, self.operand(kinds[0], a), self.operand(kinds[1], b)))
+        return Program(instructions, root, optimize, self.keys, lean)
+
+
+def _import(module: str, name: str) -> type:
+    ret: Any = importlib.import_module(module)
+    for part in name.split('.'):
+        ret = getattr(ret, part)
+    if not (isinstance(ret, type) and issubclass(ret, (Node, Enum))):
+        raise ValueError(f'{module}.{name} is not a node nor a feature')
+    return ret
+
+
+def serialize(node: ValidType, program: bool = True) -> bytes:
+    '''
+    Serializes a tree, with the values assigned to its variables and the
+    mappings of its phrases, into bytes that `deserialize` loads much faster
+    than the tree is built. With `program`, the compiled programs of the
+    tree go along, the lean one of batches too, so the loaded tree renders
+    without compiling.
+
+    The data is only meant to be loaded by the same versions of aida and
+    python, and only from trusted sources.
+    '''
+    root = to_node(node)
+    encoder = _Encoder()
+    encoder.node(root)
+    encoder.encode_nodes()
+    code = None
+    if program:
+        code = [encoder.program(_compiled(root)), encoder.program(_compiled(root).private())]
+    encoder.encode_nodes()
+    shapes, records = encoder.finish()
+    return _MAGIC + marshal.dumps((encoder.classes, shapes, records, code))
+
+
+def deserialize(data: bytes) -> Node:
+    '''
+    Loads a tree serialized by `serialize`.
+    '''
+    if not data.startswith(_MAGIC):
+        raise ValueError('Not a serialized template, or from another version.')
+    classes, shapes, records, code = marshal.loads(data[len(_MAGIC):])
+    classes = [_import(module, name) for module, name in classes]
+    shapes = [(classes[shape[0]], ) + tuple(shape[1:]) for shape in shapes]
+
+    new = object.__new__
+    nodes = [new(shapes[record[0]][0]) for record in records]
+    # constants are shared with the templates already built
+    for index, record in enumerate(records):
+        if shapes[record[0]][0] is Const and shapes[record[0]][1] == ('value', ):
+            nodes[index] = _const(record[1][0])
+    decoder = _Decoder(classes, nodes)
+    # parents outside of the table are at -1, which gives None
+    get = (nodes + [None]).__getitem__
+    for node, (shape, plain, refs, tuples, others) in zip(nodes, records):
+        node.parent = None
+        node._clear_caches()
+        _, plain_names, ref_names, tuple_names, other_names = shapes[shape]
+        for name, value in zip(plain_names, plain):
+            setattr(node, name, value)
+        for name, index in zip(ref_names, refs):
+            setattr(node, name, get(index))
+        for name, indexes in zip(tuple_names, tuples):
+            setattr(node, name, tuple(map(get, indexes)))
+        for name, value in zip(other_names, others):
+            setattr(node, name, decoder.value(value))
+
+    root = nodes[0]
+    if code is not None:
+        root._program = decoder.program(root, code[0])
+        root._program._private = decoder.program(root, code[1])
+    return root
+
+
+class TemplateCache(object):
+    '''
+    Keeps serialized templates, along with their compiled programs, in a
+    directory. Templates are stored under the digest of their content, and
+    `get` finds them by a name given to them, so a process that starts with
+    a warm cache skips both building and compiling them.
+    '''
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'refs'), exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f'TemplateCache({self.directory!r})'
+
+    def _write(self, path: str, data: bytes) -> None:
+        # written aside and moved in place, so other processes never read
+        # half of a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def store(self, node: ValidType) -> str:
+        '''
+        Stores a template and returns its digest.
+        '''
+        data = serialize(node)
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, digest + '.aida')
+        if not os.path.exists(path):
+            self._write(path, data)
+        return digest
+
+    def load(self, digest: str) -> Node:
+        with open(os.path.join(self.directory, digest + '.aida'), 'rb') as f:
+            return deserialize(f.read())
+
+    def get(self, name: str, build: Callable[[], ValidType]) -> Node:
+        '''
+        The template stored under `name`, or the one that `build` returns,
+        which is then stored. Change the name when the code that builds the
+        template changes, for instance with a version in it.
+        '''
+        ref = os.path.join(self.directory, 'refs', name)
+        try:
+            with open(ref) as f:
+                return self.load(f.read().strip())
+        except (OSError, ValueError, EOFError, TypeError, ImportError, AttributeError):
+            # missing, or stored by another version
+            pass
+
+        node = to_node(build())
+        self._write(ref, self.store(node).encode())
+        return node
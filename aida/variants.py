@@ -0,0 +1,311 @@
+import random
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Mapping, Optional, Set, Tuple
+
+from .branching import Branch, Match
+from .choices import Choices
+from .compiler import _Queries, _walk
+from .core import (
+    Const, Ctx, Injector, Node, Operation, Repeat, ValidType, Var, _compiled, _render)
+from .lang import LangConfig
+
+__all__ = ['count_variants', 'iter_variants', 'sample_variants']
+
+
+class _Script(object):
+    '''
+    Stands for the random generator of a render, drawing the items at the
+    given positions in turn, and the first item once they run out. Records
+    the items drawn and how many there were to draw from. Weighted and
+    excluding choices draw with it among the items they can draw.
+    '''
+
+    def __init__(self, path: List[int]) -> None:
+        self.path = path
+        self.drawn: List[int] = []
+        self.sizes: List[int] = []
+
+    def choice(self, seq: Any) -> Any:
+        index = self.path[len(self.drawn)] if len(self.drawn) < len(self.path) else 0
+        self.drawn.append(index)
+        self.sizes.append(len(seq))
+        return seq[index]
+
+
+class _Sum(object):
+    '''
+    The variants of a choice: those of each of its items, in turn. An item
+    has the variants of the choices it renders, one after the other.
+    '''
+
+    __slots__ = ('items', 'counts', 'count')
+
+    def __init__(self, items: List[List['_Sum']]) -> None:
+        self.items = items
+        self.counts = [_product(item) for item in items]
+        self.count = sum(self.counts)
+
+
+def _product(sums: List[_Sum]) -> int:
+    ret = 1
+    for choice in sums:
+        ret *= choice.count
+    return ret
+
+
+def _unrank(sums: List[_Sum], index: int) -> List[int]:
+    '''
+    Items drawn by the variant at `index`, in the order of the render.
+    Variants are numbered in the order of the items of each choice, the
+    first choice rendered changing the slowest.
+    '''
+    path = []
+    stack: List[Tuple[_Sum, int]] = []
+    tasks = [(sums, index)]
+    while tasks or stack:
+        if tasks:
+            # the choices of a sequence are drawn first to last
+            sequence, index = tasks.pop()
+            digits = []
+            for choice in reversed(sequence):
+                index, digit = divmod(index, choice.count)
+                digits.append((choice, digit))
+            stack.extend(digits)
+            continue
+
+        choice, index = stack.pop()
+        for item, (sequence, count) in enumerate(zip(choice.items, choice.counts)):
+            if index < count:
+                path.append(item)
+                tasks.append((sequence, index))
+                break
+            index -= count
+    return path
+
+
+class _Counter(object):
+    '''
+    Goes through a template like a render does, but through every item of
+    each choice, keeping the variants of each choice it finds. Branches
+    take the arm the render would take, so the context must be the same
+    whatever the choices draw.
+    '''
+
+    def __init__(self, bindings: Optional[Mapping[str, Any]]) -> None:
+        self.ctx = Ctx(bindings)
+        self.sums: List[_Sum] = []
+
+    def count(self, node: ValidType) -> List[_Sum]:
+        stack = [self.visit(node)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            else:
+                stack.append(self.visit(child))
+        return self.sums
+
+    def visit(self, node: ValidType) -> Iterator[ValidType]:
+        if not isinstance(node, Node):
+            return
+        ctx = self.ctx
+        kind = type(node)
+        if kind is Const or kind is Var:
+            ctx.add(node)
+        elif kind is Node:
+            if isinstance(node.value, Node):
+                yield node.value
+        elif kind is Operation:
+            if node.op != 'in_ctx':
+                yield from node.operands
+        elif kind is Branch or kind is Match:
+            yield node._arm(ctx)
+            ctx.add(node)
+        elif kind is Choices:
+            ctx.add(node)
+            outer = self.sums
+            items = []
+            for index in node._pool:
+                self.sums = []
+                yield node.items[index]
+                items.append(self.sums)
+            self.sums = outer
+            outer.append(_Sum(items))
+        elif kind is Injector:
+            node._next_record(ctx)
+            yield node.node
+        elif kind is Repeat:
+            for _ in range(node.resolve(ctx)):
+                mark = ctx.store.mark() if node.scoped else None
+                yield node.node
+                if mark is not None:
+                    ctx.store.restore(mark)
+        elif kind is LangConfig:
+            previous = ctx.config
+            ctx.config = node
+            yield node.value
+            ctx.config = previous
+        else:
+            # other nodes render as one variant
+            _render(node, ctx)
+
+
+def _countable(template: Node) -> bool:
+    '''
+    Whether the choices can't change what the rest of the template sees:
+    no item of a choice checks the context, adds a node that is checked,
+    or reads the records of an injector.
+    '''
+    queries = _Queries(template)
+    seen: Set[Tuple[int, bool]] = set()
+    stack = [(template, False)]
+    while stack:
+        node, inside = stack.pop()
+        if (id(node), inside) in seen:
+            continue
+        seen.add((id(node), inside))
+        if inside and (isinstance(node, Injector) or queries.relevant(node) or (
+                isinstance(node, Operation) and node.op == 'in_ctx')):
+            return False
+        inside = inside or type(node) is Choices
+        stack.extend((child, inside) for child in node.child_nodes())
+    return True
+
+
+@contextmanager
+def _kept(template: Node) -> Iterator[None]:
+    '''
+    Puts the injectors of the template back as they were after the block,
+    so that it can render many times.
+    '''
+    injectors = [node for node in _walk(template) if isinstance(node, Injector)]
+    states = [(node._cursor, [(var, var.value) for var in node.children.values()])
+              for node in injectors]
+    try:
+        yield
+    finally:
+        for node, (cursor, values) in zip(injectors, states):
+            node._cursor = cursor
+            for var, value in values:
+                var.value = value
+
+
+def _renderer(template: Node, bindings: Optional[Mapping[str, Any]]) -> Callable[[List[int]], Tuple[str, _Script]]:
+    program = _compiled(template).private()
+
+    def render(path: List[int]) -> Tuple[str, _Script]:
+        script = _Script(path)
+        with _kept(template):
+            text = program.render(Ctx(bindings, rng=script))  # type: ignore
+        return text, script
+    return render
+
+
+def _explore(template: Node, bindings: Optional[Mapping[str, Any]]) -> Iterator[str]:
+    '''
+    Renders every combination of items, in order, by drawing the next item
+    of the last choice that has some left after each render.
+    '''
+    render = _renderer(template, bindings)
+    path: List[int] = []
+    while True:
+        text, script = render(path)
+        yield text
+        for i in reversed(range(len(script.drawn))):
+            if script.drawn[i] + 1 < script.sizes[i]:
+                path = script.drawn[:i] + [script.drawn[i] + 1]
+                break
+        else:
+            return
+
+
+def count_variants(template: ValidType, bindings: Mapping[str, Any] = None) -> int:
+    '''
+    Number of ways the template can render with `bindings`: the different
+    combinations of items its choices can draw. Distinct combinations may
+    still give the same text, so it bounds the number of distinct texts.
+
+    The variants of each choice are added up, and multiplied along the
+    template, without rendering them, unless an item of a choice checks
+    the context or adds a node that is checked: then the count depends on
+    the order of the items, and every combination is rendered.
+    '''
+    if not isinstance(template, Node):
+        return 1
+    if not _countable(template):
+        return sum(1 for _ in _explore(template, bindings))
+    with _kept(template):
+        return _product(_Counter(bindings).count(template))
+
+
+def iter_variants(template: ValidType, bindings: Mapping[str, Any] = None) -> Iterator[str]:
+    '''
+    Lazily yields every distinct text the template can render with
+    `bindings`, going through the combinations of items of its choices
+    in order.
+    '''
+    if not isinstance(template, Node):
+        yield str(template)
+        return
+    seen: Set[str] = set()
+    for text in _explore(template, bindings):
+        if text not in seen:
+            seen.add(text)
+            yield text
+
+
+# draws in a row that give no new text before sampling gives up
+_PATIENCE = 1000
+
+
+def sample_variants(template: ValidType, n: int, bindings: Mapping[str, Any] = None,
+                    seed: Any = None) -> List[str]:
+    '''
+    Draws `n` distinct texts of the template with `bindings`, or all of
+    them if there are fewer. Combinations of items are drawn uniformly and
+    without replacement, and rendered straight from their number, so only
+    the texts drawn are rendered, even among billions of combinations.
+
+    When many combinations give the same texts, drawing stops after a
+    thousand draws in a row without a new one, so texts given by a tiny
+    share of the combinations may be missed.
+    '''
+    rng = random.Random(seed)
+    if not isinstance(template, Node) or not _countable(template):
+        texts = list(iter_variants(template, bindings))
+        return rng.sample(texts, min(n, len(texts)))
+
+    with _kept(template):
+        sums = _Counter(bindings).count(template)
+    total = _product(sums)
+    render = _renderer(template, bindings)
+
+    if total <= 2 * n:
+        indexes: Iterator[int] = iter(rng.sample(range(total), total))
+    else:
+        def draw() -> Iterator[int]:
+            drawn: Set[int] = set()
+            while len(drawn) < total:
+                index = rng.randrange(total)
+                if index not in drawn:
+                    drawn.add(index)
+                    yield index
+        indexes = draw()
+
+    ret: List[str] = []
+    seen: Set[str] = set()
+    misses = 0
+    for index in indexes:
+        text = render(_unrank(sums, index))[0]
+        if text not in seen:
+            seen.add(text)
+            ret.append(text)
+            misses = 0
+            if len(ret) == n:
+                break
+        else:
+            misses += 1
+            if misses == _PATIENCE:
+                # most combinations give texts already drawn
+                break
+    return ret
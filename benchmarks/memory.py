@@ -0,0 +1,110 @@
+'''
+Memory held by a library of templates once they are built: the bytes
+allocated while building them, and still alive afterwards, and the number
+of distinct nodes they are made of. Each case is built twice, with its
+constants and operations shared between templates and without, as they
+were before.
+
+    python -m benchmarks.memory [case ...]
+'''
+import argparse
+import gc
+import sys
+import tracemalloc
+from contextlib import contextmanager
+
+from aida import Choices, LangConfig, Var, core, create_alt, create_enumeration
+from examples.weather import create_forecast
+
+
+def forecasts():
+    '''
+    A forecast template per station, a thousand of them.
+    '''
+    return [create_forecast(Var('time'), Var('cond'), Var('temp'), Var('tod')) for _ in range(1000)]
+
+
+def enumerations():
+    '''
+    Lists of the same few names, in many orders.
+    '''
+    names = [f'name{i}' for i in range(20)]
+    return [create_enumeration(LangConfig(), *(names[i:] + names[:i])) for i in range(500)]
+
+
+def alternatives():
+    '''
+    Mentions of people that check the context, with choices of greetings.
+    '''
+    greetings = ('hi', 'hello', 'good morning')
+    ret = []
+    for i in range(2000):
+        name = Var(f'name{i % 50}')
+        ret.append(create_alt(name, 'someone') | 'said' | Choices(*greetings) | (name + '!'))
+    return ret
+
+
+CASES = [forecasts, enumerations, alternatives]
+
+
+@contextmanager
+def unshared():
+    '''
+    Builds a new constant or operation for every use, instead of sharing
+    the interned ones.
+    '''
+    const, operation = core._const, core._operation
+    core._const = core.Const
+    core._operation = lambda op, *operands: core.Node(core.Operation(op, *operands))
+    try:
+        yield
+    finally:
+        core._const, core._operation = const, operation
+
+
+def count_nodes(templates):
+    seen = set()
+    stack = list(templates)
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            stack.extend(node.child_nodes())
+    return len(seen)
+
+
+def measure(case, shared=True):
+    if not shared:
+        with unshared():
+            return measure(case)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        templates = case()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return {'bytes': size, 'nodes': count_nodes(templates)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cases', nargs='*', help='cases to run, all of them by default')
+    args = parser.parse_args(argv)
+
+    print(f'{"case":<14} {"unshared":>10} {"nodes":>8} {"shared":>10} {"nodes":>8} {"ratio":>6}')
+    for case in CASES:
+        if args.cases and case.__name__ not in args.cases:
+            continue
+        before = measure(case, shared=False)
+        after = measure(case)
+        print(f'{case.__name__:<14} {before["bytes"] / 1024:>7.0f}KiB {before["nodes"]:>8} '
+              f'{after["bytes"] / 1024:>7.0f}KiB {after["nodes"]:>8} '
+              f'{after["bytes"] / before["bytes"]:>6.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+'''
+Size and render time of the example templates compiled with and without
+the optimizer, next to the number of nodes in their trees.
+
+    python -m benchmarks.optimizer
+'''
+import timeit
+
+from aida import LangConfig, Var, compile, create_enumeration, render
+from examples.cake import conf as cake
+from examples.weather import create_forecast
+
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.child_nodes())
+    return count
+
+
+def create_templates():
+    weather = create_forecast(Var('time'), Var('cond'), Var('temp'), Var('tod'))
+    bindings = {'time': 'evening', 'cond': 'clear', 'temp': 12, 'tod': 'in the night'}
+    names = [f'name{i}' for i in range(30)]
+    return [
+        ('weather', weather, bindings),
+        ('cake', cake, None),
+        ('enumeration', create_enumeration(LangConfig(), *names), None),
+    ]
+
+
+def best(fn, number=2000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f'{"template":<12} {"nodes":>6} {"code":>5} {"opt":>5} '
+          f'{"render":>9} {"compiled":>9} {"optimized":>9}')
+    for name, template, bindings in create_templates():
+        plain = compile(template, optimize=False)
+        optimized = compile(template)
+        assert optimized.render(bindings=bindings) == plain.render(bindings=bindings)
+
+        print(f'{name:<12} {count_nodes(template):>6} {len(plain.code):>5} '
+              f'{len(optimized.code):>5} '
+              f'{best(lambda: render(template, bindings=bindings)):>7.1f}us '
+              f'{best(lambda: plain.render(bindings=bindings)):>7.1f}us '
+              f'{best(lambda: optimized.render(bindings=bindings)):>7.1f}us')
+
+
+if __name__ == '__main__':
+    main()
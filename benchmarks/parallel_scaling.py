@@ -0,0 +1,40 @@
+'''
+Throughput of `render_parallel` on the weather forecast template as the
+number of worker processes grows.
+
+    python -m benchmarks.parallel_scaling [records]
+'''
+import os
+import sys
+import time
+
+from aida import Var, render_parallel
+from examples.weather import create_forecast
+
+CONDITIONS = ('rainy', 'clear', 'cloudy', 'windy', 'snowy')
+LABELS = ('now', 'morning', 'afternoon', 'evening')
+
+
+def create_records(count):
+    return [{'time': LABELS[i % 4], 'cond': CONDITIONS[i % 5], 'temp': i % 35,
+             'tod': f'in the {LABELS[i % 4]}'} for i in range(count)]
+
+
+def main(count=200000):
+    template = create_forecast(Var('time'), Var('cond'), Var('temp'), Var('tod'))
+    records = create_records(count)
+    expected = None
+
+    print(f'{count} records, {os.cpu_count()} cpus')
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        texts = render_parallel(template, records, workers=workers, chunksize=2048, seed=42)
+        elapsed = time.perf_counter() - start
+
+        expected = expected or texts
+        assert texts == expected, 'output depends on the number of workers'
+        print(f'workers={workers:<3} {count / elapsed:>10.0f} records/s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
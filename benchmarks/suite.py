@@ -0,0 +1,205 @@
+'''
+Throughput, latency and peak memory of rendering the usual kinds of
+templates: the weather feed of `Repeat` over `Injector`, the multilingual
+cake phrases, long enumerations, large choices and templates full of
+`in_ctx` checks.
+
+    python -m benchmarks.suite [--quick] [--save | --check] [case ...]
+
+Baselines are specific to the machine, so they are not kept in the
+repository: save them with `--save` before a change (or an upgrade), and
+`--check` afterwards fails if some case got slower, or took more memory,
+by more than the threshold.
+'''
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from itertools import product
+
+from aida import (
+    Choices, Ctx, GNumber, GPerson, Injector, Lang, LangConfig, Repeat, Var, create_alt,
+    create_enumeration, render, write_render)
+from examples.cake import node as cake
+from examples.weather import create_forecast
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+CONDITIONS = ('rainy', 'clear', 'cloudy', 'windy', 'snowy')
+LABELS = ('now', 'morning', 'afternoon', 'evening')
+
+
+def create_records(count):
+    return [{'time': LABELS[i % 4], 'cond': CONDITIONS[i % 5], 'temp': i % 35,
+             'tod': f'in the {LABELS[i % 4]}'} for i in range(count)]
+
+
+def weather_feed(scale):
+    '''
+    The whole weather feed, one record after the other in a shared context.
+    '''
+    variables = [Var('time'), Var('cond'), Var('temp'), Var('tod')]
+    repeat = Repeat(Injector(variables, create_forecast(*variables)))
+    records = create_records(100000 // scale)
+
+    def run():
+        write_render(repeat, records, io.StringIO(), Ctx(rng=random.Random(42)))
+    return run, 3
+
+
+def weather_record(scale):
+    '''
+    A single forecast, rendered with its variables bound.
+    '''
+    template = create_forecast(Var('time'), Var('cond'), Var('temp'), Var('tod'))
+    records = iter(create_records(100000) * 2)
+    rng = random.Random(42)
+
+    def run():
+        render(template, Ctx(rng=rng), bindings=next(records))
+    return run, 100000 // scale
+
+
+def cake_matrix(scale):
+    '''
+    The cake phrase in every combination of language, number and person.
+    '''
+    configs = [LangConfig(lang=lang, number=number, person=person) for lang, number, person in product(
+        (Lang.ENGLISH, Lang.PORTUGUESE), (GNumber.SINGULAR, GNumber.PLURAL), (GPerson.FIRST, GPerson.THIRD))]
+
+    def run():
+        for config in configs:
+            render(cake, Ctx(config=config))
+    return run, 2000 // scale
+
+
+def enumeration(scale):
+    '''
+    A comma separated list of many names, built from deeply nested chains.
+    '''
+    node = create_enumeration(LangConfig(), *[f'name{i}' for i in range(10000 // scale)])
+    render(node)
+
+    def run():
+        render(node)
+    return run, 100
+
+
+def large_choices(scale):
+    '''
+    Draws from choices between many items.
+    '''
+    node = Choices(*[f'item{i}' for i in range(10000)]) | Choices(*[f'other{i}' for i in range(100)])
+    ctx = Ctx(rng=random.Random(42))
+
+    def run():
+        for _ in range(100):
+            render(node, ctx)
+    return run, 200 // scale
+
+
+def context_checks(scale):
+    '''
+    Alternatives that check the context before every mention.
+    '''
+    names = [Var(f'name{i}') for i in range(50)]
+    node = create_alt(names[0], 'someone')
+    for name in names[1:] * 4:
+        node = node | 'met' | create_alt(name, 'someone')
+    bindings = {name.name: name.name for name in names}
+
+    def run():
+        render(node, bindings=bindings)
+    return run, 1000 // scale
+
+
+CASES = [weather_feed, weather_record, cake_matrix, enumeration, large_choices, context_checks]
+
+
+def measure(case, scale):
+    run, iterations = case(scale)
+    run()
+
+    times = []
+    for _ in range(max(iterations, 1)):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # throughput from the median, so a few stalls of the machine don't
+    # count as regressions
+    return {
+        'ops': 1 / times[len(times) // 2],
+        'p50': times[len(times) // 2],
+        'p99': times[min(len(times) - 1, int(len(times) * 0.99))],
+        'peak': peak,
+    }
+
+
+def regressions(results, baselines, threshold):
+    '''
+    Cases that got slower, or took more memory, than their baseline by
+    more than `threshold`, as a fraction of the baseline.
+    '''
+    ret = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        if result['ops'] < baseline['ops'] * (1 - threshold):
+            ret.append(f'{name}: {result["ops"]:.1f} ops/s, baseline {baseline["ops"]:.1f} ops/s')
+        if result['peak'] > baseline['peak'] * (1 + threshold):
+            ret.append(f'{name}: peak {result["peak"] / 1024:.0f}KiB, baseline {baseline["peak"] / 1024:.0f}KiB')
+    return ret
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cases', nargs='*', help='cases to run, all of them by default')
+    parser.add_argument('--quick', action='store_true', help='smaller inputs and fewer iterations')
+    parser.add_argument('--save', action='store_true', help='save the results as the baselines')
+    parser.add_argument('--check', action='store_true', help='fail on regressions from the baselines')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='regression that fails a check, as a fraction of the baseline')
+    parser.add_argument('--baselines', default=BASELINES, help='baselines file')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.cases or case.__name__ in args.cases]
+    scale = 10 if args.quick else 1
+
+    print(f'{"case":<16} {"ops/s":>9} {"p50":>10} {"p99":>10} {"peak":>10}')
+    results = {}
+    for case in cases:
+        result = results[case.__name__] = measure(case, scale)
+        print(f'{case.__name__:<16} {result["ops"]:>9.1f} {result["p50"] * 1e3:>8.2f}ms '
+              f'{result["p99"] * 1e3:>8.2f}ms {result["peak"] / 1024:>7.0f}KiB')
+
+    if args.save:
+        with open(args.baselines, 'w') as f:
+            json.dump({'scale': scale, 'cases': results}, f, indent=2, sort_keys=True)
+        print(f'saved baselines to {args.baselines}')
+    elif args.check:
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+        if baselines['scale'] != scale:
+            parser.error('the baselines were saved with a different --quick')
+        failed = regressions(results, baselines['cases'], args.threshold)
+        for line in failed:
+            print(f'regression in {line}')
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
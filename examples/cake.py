@@ -1,5 +1,5 @@
 from itertools import product
-from aida import render, LangConfig, Lang, NP, GNumber, Gender, VP, GPerson
+from aida import render_configs, LangConfig, Lang, NP, GNumber, Gender, VP, GPerson
 
 # words
 subj = (NP('I')
@@ -34,9 +34,10 @@ cake = (NP('a cake')
 node = (subj | verb | cake).sentence()
 conf = LangConfig(node)
 
-for lang, person, number in product((Lang.ENGLISH, Lang.PORTUGUESE), (GNumber.SINGULAR, GNumber.PLURAL), (GPerson.FIRST, GPerson.THIRD)):
-    conf.lang = lang
-    conf.person = person
-    conf.number = number
-    print(f'lang={lang.value} person={person.value} number={number.value}:')
-    print('\t', render(conf))
+if __name__ == '__main__':
+    # one pass renders the same tree under every combination of features
+    configs = [LangConfig(lang=lang, number=number, person=person)
+               for lang, number, person in product((Lang.ENGLISH, Lang.PORTUGUESE), (GNumber.SINGULAR, GNumber.PLURAL), (GPerson.FIRST, GPerson.THIRD))]
+    for config, text in zip(configs, render_configs(node, configs)):
+        print(f'lang={config.lang.value} person={config.person.value} number={config.number.value}:')
+        print('\t', text)
@@ -0,0 +1,81 @@
+import asyncio
+import random
+
+import aida
+from examples.weather import create_forecast
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class Lookups(object):
+    '''
+    Stands for a slow store, counting the lookups and how many of them
+    were waiting at the same time.
+    '''
+
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+        self.waiting = 0
+        self.most_waiting = 0
+
+    def source(self, name):
+        async def lookup():
+            self.calls.append(name)
+            self.waiting += 1
+            self.most_waiting = max(self.most_waiting, self.waiting)
+            await asyncio.sleep(0.01)
+            self.waiting -= 1
+            return self.values[name]
+        return lookup
+
+    def bindings(self):
+        return {name: self.source(name) for name in self.values}
+
+
+def test_render_async():
+    variables = [aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod')]
+    forecast = create_forecast(*variables)
+    record = {'time': 'now', 'cond': 'rainy', 'temp': 20, 'tod': 'in the morning'}
+    lookups = Lookups(record)
+
+    text = run(aida.render_async(forecast, aida.Ctx(rng=random.Random(1)), lookups.bindings()))
+    assert text == aida.render(forecast, aida.Ctx(rng=random.Random(1)), bindings=record)
+    # the time of day is only said of later forecasts
+    assert sorted(lookups.calls) == ['cond', 'temp', 'time']
+    assert lookups.most_waiting == 3
+
+
+def test_render_async_only_fetches_needed():
+    label = aida.Var('label')
+    node = aida.create_match(label, default=aida.Var('other'), a=aida.Var('x') | 'and' | aida.Var('y'), b=aida.Var('z'))
+    lookups = Lookups({'label': 'a', 'x': 1, 'y': 2, 'z': 3, 'other': 4})
+
+    assert run(aida.render_async(node, bindings=lookups.bindings())) == '1 and 2'
+    # the label first, then the variables of its arm together
+    assert lookups.calls[0] == 'label' and sorted(lookups.calls[1:]) == ['x', 'y']
+    assert lookups.most_waiting == 2
+
+    # plain values and awaitables mix, unused coroutines are closed
+    unused = lookups.source('z')()
+    text = run(aida.render_async(node, bindings={'label': 'b', 'z': lookups.source('z'), 'x': unused}))
+    assert text == '3'
+
+
+def test_render_async_random_conditions():
+    coin = aida.Choices('heads', 'tails')
+    node = aida.Branch(coin == 'heads', aida.Var('x'), aida.Var('y')) | aida.Choices('a', 'b', 'c')
+    for seed in range(10):
+        lookups = Lookups({'x': 1, 'y': 2})
+        random.seed(seed)
+        text = run(aida.render_async(node, bindings=lookups.bindings()))
+        random.seed(seed)
+        assert text == aida.render(node, bindings={'x': 1, 'y': 2})
+        # the arm isn't known before the render, so both are fetched
+        assert sorted(lookups.calls) == ['x', 'y']
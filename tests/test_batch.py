@@ -0,0 +1,165 @@
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+
+import aida
+from examples.weather import create_forecast
+
+
+def create_template():
+    label = aida.Var('label')
+    temp = aida.Var('temp')
+    node = aida.create_match(label, hot='scorching', cold='freezing', default='mild')
+    return label, temp, (node | 'with' | temp | 'degrees').sentence()
+
+
+def test_render_bindings():
+    label, temp, template = create_template()
+    temp.assign(30)
+
+    assert aida.render(template, bindings={'label': 'hot'}) == 'Scorching with 30 degrees.'
+    assert aida.render(template, bindings={'label': 'cold', 'temp': -5}) == 'Freezing with -5 degrees.'
+    assert temp.value == 30
+    assert label.value is aida.Empty
+
+
+def test_render_bindings_keep_ctx():
+    x = aida.Var('x')
+    alt = aida.create_alt(x, 'the same')
+    ctx = aida.Ctx()
+
+    assert aida.render(alt, ctx, bindings={'x': 'rain'}) == 'rain'
+    assert aida.render(alt, ctx, bindings={'x': 'sun'}) == 'sun'
+    assert aida.render(alt, ctx, bindings={'x': 'sun'}) == 'the same'
+    assert ctx.bindings == {}
+
+
+def test_bound_keys_kept():
+    keyed = []
+
+    class CountedVar(aida.Var):
+        __slots__ = ()
+
+        def _compute_hash(self, ctx=None):
+            keyed.append(self.name)
+            return super()._compute_hash(ctx)
+
+    label = CountedVar('label')
+    match = aida.create_match(label, default='none', **{f'k{i}': f'v{i}' for i in range(100)})
+    node = match | aida.Branch(match.in_ctx(), 'again')
+    ctx = aida.Ctx({'label': 'k3'})
+    aida.render(node)
+    keyed.clear()
+
+    # the match is keyed once, for the check and both renders
+    assert aida.render(node, ctx) == 'v3 again'
+    assert aida.render(node, ctx) == 'v3 again'
+    assert keyed == ['label']
+
+    # other bindings key it again
+    ctx.bindings = {'label': 'k4'}
+    assert aida.render(node, ctx) == 'v4 again'
+    assert keyed == ['label', 'label']
+
+
+def test_render_many():
+    _, _, template = create_template()
+    records = [{'label': 'hot', 'temp': 35}, {'label': 'cold', 'temp': 2},
+               {'label': 'other', 'temp': 18}]
+
+    assert aida.render_many(template, records) == [
+        'Scorching with 35 degrees.',
+        'Freezing with 2 degrees.',
+        'Mild with 18 degrees.',
+    ]
+
+
+def test_render_many_threads():
+    _, _, template = create_template()
+    records = [{'label': ('hot', 'cold')[i % 2], 'temp': i} for i in range(200)]
+    expected = [aida.render(template, bindings=record) for record in records]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        chunks = [records[i:i + 20] for i in range(0, len(records), 20)]
+        results = executor.map(lambda chunk: aida.render_many(template, chunk), chunks)
+
+    assert [text for chunk in results for text in chunk] == expected
+
+
+def test_bound_injector():
+    a = aida.Var('a')
+    b = aida.Var('b')
+    inj = aida.Injector([a, b], a | b, name='rows')
+    repeat = aida.Repeat(inj, name='count', sep=', ')
+    records = [{'a': 'a1', 'b': 'b1'}, {'a': 'a2', 'b': 'b2'}]
+    bindings = {'rows': records, 'count': len(records)}
+
+    assert aida.render(repeat, bindings=bindings) == 'a1 b1, a2 b2'
+    assert aida.render_many(repeat, [bindings]) == ['a1 b1, a2 b2']
+    assert a.value is aida.Empty
+
+
+def create_weather_feed():
+    weather_label = aida.Var('time')
+    condition = aida.Var('cond')
+    temp = aida.Var('temp')
+    tod = aida.Var('tod')
+    forecast = create_forecast(weather_label, condition, temp, tod)
+    return aida.Repeat(aida.Injector([weather_label, condition, temp, tod], forecast))
+
+
+WEATHER_DATA = [
+    {'time': 'now', 'cond': 'rainy', 'temp': 20, 'tod': None},
+    {'time': 'afternoon', 'cond': 'clear', 'temp': 15, 'tod': 'in the afternoon'},
+    {'time': 'evening', 'cond': 'clear', 'temp': 12, 'tod': 'in the night'},
+]
+
+
+def test_iter_render_matches_repeat():
+    random.seed(7)
+    repeat = create_weather_feed()
+    repeat.node.assign(list(WEATHER_DATA))
+    repeat.assign(len(WEATHER_DATA))
+    expected = aida.render(repeat)
+
+    random.seed(7)
+    texts = aida.iter_render(create_weather_feed(), iter(WEATHER_DATA))
+    assert ' '.join(texts) == expected
+    assert 'remain the same' in expected
+
+
+def test_iter_render_is_lazy():
+    x = aida.Var('x')
+    records = ({'x': i} for i in count())
+
+    texts = aida.iter_render(x | 'sheep', records)
+    assert list(islice(texts, 3)) == ['0 sheep', '1 sheep', '2 sheep']
+
+
+def test_write_render():
+    random.seed(7)
+    repeat = create_weather_feed()
+    repeat.node.assign(list(WEATHER_DATA))
+    repeat.assign(len(WEATHER_DATA))
+    expected = aida.render(repeat)
+
+    random.seed(7)
+    out = io.StringIO()
+    assert aida.write_render(create_weather_feed(), iter(WEATHER_DATA), out) == 3
+    assert out.getvalue() == expected
+
+
+def test_render_many_seed():
+    name = aida.Var('name')
+    template = aida.Choices('hi', 'hello', 'hey') | name
+    records = [{'name': str(i)} for i in range(300)]
+
+    seeded = aida.render_many(template, records, seed=11)
+    assert aida.render_many(template, records, seed=11) == seeded
+    assert aida.render_many(template, records, seed=12) != seeded
+
+    predrawn = aida.render_many(template, records, seed=11, predraw=True)
+    assert aida.render_many(template, records, seed=11, predraw=True) == predrawn
+    assert [text.split()[1] for text in predrawn] == [str(i) for i in range(300)]
+    assert {text.split()[0] for text in predrawn} == {'hi', 'hello', 'hey'}
@@ -0,0 +1,66 @@
+import random
+
+import aida
+from examples.weather import create_forecast
+
+
+def create_weather():
+    return create_forecast(aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod'))
+
+
+def test_render_columns_matches_rows():
+    rng = random.Random(0)
+    size = 200
+    columns = {
+        'time': [rng.choice(('afternoon', 'evening', 'tomorrow')) for _ in range(size)],
+        'cond': [rng.choice(('rainy', 'clear', 'windy')) for _ in range(size)],
+        'temp': list(range(size)),
+        'tod': [rng.choice(('later', 'in the night')) for _ in range(size)],
+    }
+    records = [{name: column[i] for name, column in columns.items()} for i in range(size)]
+    template = create_weather()
+
+    assert aida.render_columns(template, columns) == aida.render_many(template, records)
+
+
+def test_render_columns_ctx_per_row():
+    x = aida.Var('x')
+    template = aida.create_alt(x, 'the same') | 'and' | aida.create_alt(x, 'the same')
+
+    assert aida.render_columns(template, {'x': ('rain', 'sun')}) == [
+        'rain and the same', 'sun and the same']
+
+
+def test_render_columns_choices_seed():
+    template = create_weather()
+    columns = {'time': ['now'] * 50, 'cond': ['rainy'] * 50, 'temp': [1] * 50, 'tod': [''] * 50}
+    texts = aida.render_columns(template, columns, seed=1)
+
+    assert texts == aida.render_columns(template, columns, seed=1)
+    assert set(texts) == {'Right now the weather is rainy with a temperature of 1 degrees.',
+                          'Now the weather is rainy with a temperature of 1 degrees.'}
+
+
+def test_render_columns_fallback():
+    x = aida.Var('x')
+    template = aida.Repeat(x, name='n')
+
+    assert aida.render_columns(template, {'x': ['a', 'b'], 'n': [1, 3]}) == ['a', 'b b b']
+    assert aida.render_columns(template, {}) == []
+
+
+def test_render_columns_excluding_choices():
+    choices = aida.Choices('good', 'fine', 'nice', exclude=True)
+    template = aida.Var('x') | choices | choices | choices
+    texts = aida.render_columns(template, {'x': list(range(20))}, seed=3)
+
+    assert [sorted(text.split()[1:]) for text in texts] == [['fine', 'good', 'nice']] * 20
+
+
+def test_render_columns_deep_template():
+    conf = aida.LangConfig(aida.Empty, lang=aida.Lang.ENGLISH)
+    node = aida.Var('x') | aida.create_enumeration(conf, *[f'name{i}' for i in range(3000)])
+    columns = {'x': [1, 2]}
+
+    assert aida.render_columns(node, columns) == aida.render_many(node, [{'x': 1}, {'x': 2}])
+    assert aida.render_configs(node, [conf], {'x': 1}) == aida.render_many(node, [{'x': 1}])
@@ -0,0 +1,170 @@
+import random
+from itertools import product
+
+import aida
+from aida.compiler import ADD, CONST, VAR, WTEXT
+from aida.core import _render
+from examples.cake import conf as cake_conf
+from examples.weather import create_forecast
+
+WEATHER_DATA = [
+    {'time': 'now', 'cond': 'rainy', 'temp': 20, 'tod': None},
+    {'time': 'afternoon', 'cond': 'clear', 'temp': 15, 'tod': 'in the afternoon'},
+    {'time': 'evening', 'cond': 'clear', 'temp': 12, 'tod': 'in the night'},
+    {'time': 'now', 'cond': 'windy', 'temp': 9, 'tod': None},
+]
+
+
+def create_weather_report():
+    weather_label = aida.Var('time')
+    condition = aida.Var('cond')
+    temp = aida.Var('temp')
+    tod = aida.Var('tod')
+    forecast = create_forecast(weather_label, condition, temp, tod)
+    inj = aida.Injector([weather_label, condition, temp, tod], forecast)
+    repeat = aida.Repeat(inj)
+
+    inj.assign(list(WEATHER_DATA))
+    repeat.assign(len(WEATHER_DATA))
+    return repeat
+
+
+def render_tree(node, ctx=None):
+    # the node by node renderer, that compiled programs must match
+    return str(_render(node, ctx or aida.Ctx()))
+
+
+def test_weather_equivalence():
+    for seed in range(20):
+        random.seed(seed)
+        ctx = aida.Ctx()
+        expected = render_tree(create_weather_report(), ctx)
+
+        random.seed(seed)
+        compiled_ctx = aida.Ctx()
+        program = aida.compile(create_weather_report())
+        assert program.render(compiled_ctx) == expected
+        assert compiled_ctx.store == ctx.store
+
+
+def test_cake_equivalence():
+    program = aida.compile(cake_conf)
+
+    for lang, person, number in product(
+            (aida.Lang.ENGLISH, aida.Lang.PORTUGUESE),
+            (aida.GPerson.FIRST, aida.GPerson.THIRD),
+            (aida.GNumber.SINGULAR, aida.GNumber.PLURAL)):
+        cake_conf.lang = lang
+        cake_conf.person = person
+        cake_conf.number = number
+        assert program.render() == render_tree(cake_conf)
+
+
+def test_choices_in_branch_ctx():
+    x = aida.Var('x')
+    items = aida.Choices(aida.Const('a') | 'b', 'c', seed=0)
+    branch = aida.Branch(x == 'yes', items, 'no')
+    node = branch | aida.Branch(items.in_ctx(), 'seen', 'unseen')
+    program = aida.compile(node)
+
+    for value in ('yes', 'no'):
+        x.assign(value)
+        random.seed(3)
+        ctx = aida.Ctx()
+        expected = render_tree(node, ctx)
+
+        random.seed(3)
+        compiled_ctx = aida.Ctx()
+        assert program.render(compiled_ctx) == expected
+        assert compiled_ctx.store == ctx.store
+
+
+def test_choices_item_ctx():
+    # the item drawn is in the context, inside a branch or not
+    item = aida.Const('a') | 'b'
+    node = aida.Choices(item) | aida.Branch(item.in_ctx(), 'seen', 'unseen')
+    ctx = aida.Ctx()
+    assert render_tree(node, ctx) == 'a b seen'
+
+    for program in (aida.compile(node), aida.compile(node, optimize=False)):
+        compiled_ctx = aida.Ctx()
+        assert program.render(compiled_ctx) == 'a b seen'
+        assert compiled_ctx.store == ctx.store
+    assert aida.compile(node, lean=True).render(aida.Ctx()) == 'a b seen'
+    assert aida.render(node) == 'a b seen'
+    assert aida.render_columns(node, {'x': [1, 2]}) == ['a b seen'] * 2
+
+
+def test_compile_deep_enumeration():
+    conf = aida.LangConfig(aida.Empty)
+    names = [f'name{i}' for i in range(50)]
+    node = aida.create_enumeration(conf, *names)
+
+    assert aida.compile(node).render() == render_tree(node)
+
+
+def test_optimized_chains():
+    name = aida.Const('Bob')
+    x = aida.Var('x')
+    node = (aida.Empty + name | 'and' | x | 'are here').sentence() | aida.Branch(
+        name.in_ctx() | (x == 'no'), 'seen', 'unseen')
+    program = aida.compile(node)
+
+    assert len(program.code) < len(aida.compile(node, optimize=False).code)
+    for value in ('Alice', 'no'):
+        x.assign(value)
+        ctx = aida.Ctx()
+        expected = render_tree(node, ctx)
+
+        compiled_ctx = aida.Ctx()
+        assert program.render(compiled_ctx) == expected
+        assert compiled_ctx.store == ctx.store
+    assert expected == 'Bob and no are here. seen'
+
+
+def test_nested_branch_choices():
+    label = aida.Var('label')
+    match = aida.create_match(label, **{f'k{i}': aida.Choices(f'a{i}', f'b{i}') for i in range(30)})
+    node = match | aida.Branch(match.in_ctx(), 'seen', 'unseen')
+    program = aida.compile(node)
+
+    for value in ('k0', 'k15', 'k29', 'other'):
+        label.assign(value)
+        random.seed(1)
+        ctx = aida.Ctx()
+        expected = render_tree(node, ctx)
+
+        random.seed(1)
+        compiled_ctx = aida.Ctx()
+        assert program.render(compiled_ctx) == expected
+        assert compiled_ctx.store == ctx.store
+
+
+def test_lean_programs():
+    x = aida.Var('x')
+    items = aida.Choices(aida.Const('a') | 'b', 'c', x)
+    name = aida.Var('name')
+    templates = [
+        create_weather_report,
+        lambda: aida.Branch(x == 'yes', items, 'no') | aida.Branch(items.in_ctx(), 'seen', 'unseen'),
+        lambda: aida.create_ref(name, 'she') | 'met' | x | 'and' | aida.create_ref(name, 'her') | items,
+        lambda: aida.create_enumeration(aida.LangConfig(), x, 'b', aida.create_once(x), items).sentence(),
+    ]
+    for template, value, seed in product(templates, ('yes', 'no'), range(5)):
+        bindings = {'x': value, 'name': 'Alice'}
+        random.seed(seed)
+        ctx = aida.Ctx(bindings)
+        expected = aida.compile(template()).render(ctx)
+
+        random.seed(seed)
+        lean_ctx = aida.Ctx(bindings)
+        assert aida.compile(template(), lean=True).render(lean_ctx) == expected
+        # choices that aren't checked add a key that matches nothing
+        assert set(lean_ctx.store) - {-1} < set(ctx.store)
+
+    # contexts that nothing else reads get what the template checks only
+    text = aida.render(templates[2](), bindings={'x': 'Bob', 'name': 'Alice'})
+    assert text.startswith('Alice met Bob and her')
+    code = aida.compile(create_weather_report()).private().code
+    recorded = [a for op, a, keys in code if op in (ADD, CONST, VAR) or (op == WTEXT and keys)]
+    assert [var.name for var in recorded] == ['cond']
@@ -1,7 +1,10 @@
+import io
+import pickle
+import random
 from typing import cast
 
 import aida
-from aida.core import Operation
+from aida.core import Operation, _render
 
 
 def test_render_simple_choice():
@@ -107,3 +110,270 @@ def test_injector():
     inj.assign([{'a': 'a1', 'b': 'b1'}, {'a': 'a2', 'b': 'b2'}])
     assert aida.render(inj) == 'a1 b1'
     assert aida.render(inj) == 'a2 b2'
+
+
+def test_hash_follows_assignments():
+    x = aida.Var('x')
+    branch = aida.Branch(x == 'a', 'yes', 'no')
+    ctx = aida.Ctx()
+
+    x.assign('a')
+    ctx.add(branch)
+    assert ctx.contains(branch)
+
+    x.assign('b')
+    assert not ctx.contains(branch)
+
+    x.assign('a')
+    assert ctx.contains(branch)
+
+
+def test_keys_follow_bindings_changed_in_place():
+    x = aida.Var('x')
+    alt = aida.create_alt(x, 'other')
+    bindings = {'x': 1}
+    ctx = aida.Ctx(bindings)
+    assert aida.render(alt, ctx) == '1'
+
+    bindings['x'] = 2
+    assert aida.render(alt, ctx) == '2'
+    ctx.bindings['x'] = 3
+    assert aida.compile(alt).render(ctx) == '3'
+    assert ctx.contains(x)
+
+
+def test_static_hash_is_memoized():
+    node = aida.Const('a') | 'b' | 'c'
+    value = hash(node)
+
+    assert node._hash_memo == (None, value)
+    assert hash(node) == value
+
+
+def test_choices_seed_keeps_global_random():
+    random.seed(1)
+    expected = random.random()
+
+    random.seed(1)
+    aida.Choices('a', 'b', seed=5)
+    assert random.random() == expected
+
+
+def test_ctx_rng():
+    choices = aida.Choices(*'abcdefgh')
+    other = aida.Choices(*'12345678')
+
+    def draw(ctx, node):
+        return [aida.render(node, ctx) for _ in range(20)]
+
+    expected = draw(aida.Ctx(rng=random.Random(3)), choices)
+
+    # interleaving renders of another template doesn't change the stream
+    ctx = aida.Ctx(rng=random.Random(3))
+    other_ctx = aida.Ctx(rng=random.Random(3))
+    texts = []
+    for _ in range(20):
+        texts.append(aida.render(choices, ctx))
+        aida.render(other, other_ctx)
+    assert texts == expected
+
+
+def test_render_deep_trees():
+    names = [f'name{i}' for i in range(10000)]
+    text = aida.render(aida.create_enumeration(aida.LangConfig(), *names))
+    assert text.startswith('name0, name1, ') and text.endswith('name9998, and name9999')
+
+    label = aida.Var('label')
+    match = aida.create_match(label, **{f'k{i}': f'v{i}' for i in range(3000)})
+    node = match | aida.Branch(match.in_ctx(), 'seen', 'unseen')
+    assert aida.render(node, bindings={'label': 'k3'}) == 'v3 seen'
+
+    chain = aida.Empty
+    for i in range(3000):
+        chain = aida.Branch(label == f'k{i}', f'v{i}', chain)
+    assert aida.render(chain | aida.Branch(chain.in_ctx(), 'seen'), bindings={'label': 'k3'}) == 'v3 seen'
+
+
+def test_weighted_choices():
+    choices = aida.Choices('a', 'b', 'c', 'd', weights=[1, 0, 3, 6])
+    ctx = aida.Ctx(rng=random.Random(2))
+    texts = [aida.render(choices, ctx) for _ in range(10000)]
+
+    assert 'b' not in texts
+    assert 0.55 < texts.count('d') / len(texts) < 0.65
+    assert 0.08 < texts.count('a') / len(texts) < 0.12
+
+    # compiled programs draw the same as the tree
+    template = choices | aida.Choices('x', 'y', weights=[3, 1])
+    assert [aida.compile(template).render(aida.Ctx(rng=random.Random(i))) for i in range(30)] == [
+        _render(template, aida.Ctx(rng=random.Random(i))) for i in range(30)]
+
+
+def test_excluding_choices():
+    choices = aida.Choices('good', 'fine', 'nice', exclude=True)
+    template = choices | choices | choices
+    for i in range(20):
+        text = aida.render(template, aida.Ctx(rng=random.Random(i)))
+        assert sorted(text.split()) == ['fine', 'good', 'nice']
+        assert aida.compile(template).render(aida.Ctx(rng=random.Random(i))) == text
+
+    # once all were said, any can be said again
+    assert len(aida.render(template | choices).split()) == 4
+    assert aida.count_variants(template) == 6
+
+
+def test_excluding_choices_left():
+    items = [aida.Const(str(i)) for i in range(100)]
+    choices = aida.Choices(*items, weights=[1 + i % 2 for i in range(100)], exclude=True)
+    ctx = aida.Ctx(rng=random.Random(3))
+    with ctx.scope():
+        for item in items[4:]:
+            ctx.add(item)
+        # the items left are drawn by weight, and only once each
+        texts = []
+        for _ in range(3000):
+            with ctx.scope():
+                texts.append(aida.render(choices, ctx))
+        assert set(texts) == {'0', '1', '2', '3'}
+        assert 1.8 < (texts.count('1') + texts.count('3')) / (texts.count('0') + texts.count('2')) < 2.2
+        assert sorted(aida.render(choices, ctx) for _ in range(4)) == ['0', '1', '2', '3']
+
+    # the items forgotten can be drawn again
+    program = aida.compile(choices)
+    assert len({program.render(ctx) for _ in range(20)}) == 20
+
+
+def test_match():
+    label = aida.Var('label')
+    shared = aida.Const('cold') | label
+    cases = {'1': 'one', 'a': shared, 'b': shared}
+    match = aida.create_match(label, default='other', **cases)
+    assert isinstance(match, aida.Match)
+    chain = aida.Const('other')
+    for name, case in cases.items():
+        chain = aida.Branch(label == name, case, chain)
+
+    for value in (1, 'a', 'b', 'c'):
+        ctx = aida.Ctx({'label': value})
+        expected = aida.render(chain, bindings={'label': value})
+        assert aida.render(match, ctx) == _render(match, aida.Ctx({'label': value})) == expected
+        # the label and the match are in context, like with branches
+        assert ctx.contains(label) and ctx.contains(match)
+        assert aida.render(aida.Branch(match.in_ctx(), 'seen'), ctx) == 'seen'
+
+    # without cases, the default is rendered as is
+    default = aida.Const('other')
+    assert aida.create_match(label, default=default) is default
+    assert aida.create_match(label) is aida.Empty
+    once = aida.create_once(aida.create_match(label, default=default))
+    ctx = aida.Ctx({'label': 'a'})
+    assert aida.render(once, ctx) == 'other'
+    assert aida.render(once, ctx) == ''
+    assert not ctx.contains(label)
+
+
+def test_render_to():
+    name = aida.Const('Alice')
+    ref = aida.Branch(~name.in_ctx(), name, 'she')
+    count = aida.Var('count')
+    line = ref | 'likes' | aida.Branch(count > 1, count | 'cakes', 'a cake')
+    node = aida.Repeat(line.sentence(), sep=' ').assign(3)
+
+    text = io.StringIO()
+    aida.render_to(node, text, bindings={'count': 2})
+    assert text.getvalue() == aida.render(node, bindings={'count': 2}) == \
+        'Alice likes 2 cakes. She likes 2 cakes. She likes 2 cakes.'
+
+    data = io.BytesIO()
+    aida.render_to(aida.Const('olá') | node, data, bindings={'count': 1})
+    assert data.getvalue().decode() == 'olá ' + aida.render(node, bindings={'count': 1})
+
+    aida.render_to(True, text)
+    assert text.getvalue().endswith('cakes.True')
+
+    # unoptimized programs write the parts of chains too
+    program = aida.compile(aida.Const('a') + 'b' | name, optimize=False)
+    assert program.render() == 'ab Alice'
+
+
+def test_constants_are_shared():
+    greeting = aida.Const('hello') | 'world'
+    assert greeting is aida.Const('hello') | aida.Const('world')
+    assert greeting.value.operands[1] is aida.Choices('world').items[0]
+    assert aida.render(greeting | greeting) == 'hello world hello world'
+    assert not hasattr(greeting, '__dict__')
+
+    # variables and other nodes are never shared
+    name = aida.Var('name').assign('Alice')
+    assert greeting | name is not greeting | name
+    assert aida.Const(0.0) | 'a' is not aida.Const(0.0) | 'a'
+    assert aida.render(aida.Const(-0.0) | aida.Const(0.0)) == '-0.0 0.0'
+
+
+def test_ctx_scopes_and_window():
+    alice, bob = aida.Const('Alice'), aida.Const('Bob')
+    ctx = aida.Ctx()
+    ctx.add(alice)
+    with ctx.scope():
+        ctx.add(bob)
+        assert ctx.contains(alice) and ctx.contains(bob)
+    assert ctx.contains(alice) and not ctx.contains(bob)
+
+    mark = ctx.store.mark()
+    aida.render(bob, ctx)
+    assert ctx.contains(bob)
+    ctx.store.restore(mark)
+    assert not ctx.contains(bob) and len(ctx.store) == 1
+    mark = ctx.store.mark()
+    aida.render(bob, ctx)
+    ctx.store.release(mark)
+    assert ctx.contains(bob)
+
+    # only the last two nodes rendered are in context
+    ctx = aida.Ctx(window=2)
+    nodes = [aida.Const(name) for name in 'abcd']
+    for node in nodes[:3]:
+        ctx.add(node)
+    assert [ctx.contains(node) for node in nodes] == [False, True, True, False]
+    mark = ctx.store.mark()
+    ctx.add(nodes[3])
+    assert [ctx.contains(node) for node in nodes] == [False, False, True, True]
+    ctx.store.restore(mark)
+    assert [ctx.contains(node) for node in nodes] == [False, True, True, False]
+
+
+def test_scoped_repeat():
+    name = aida.Var('name')
+    injector = aida.Injector([name], aida.create_alt(name, 'she') | 'ate a cake.')
+    records = [{'name': 'Alice'}] * 3
+
+    def render(scoped, compiled=True, sentence=False):
+        injector.assign(records)
+        repeat = aida.Repeat(injector, scoped=scoped).assign(3)
+        if sentence:
+            return aida.render(repeat.sentence())
+        return aida.render(repeat) if compiled else repeat.render(aida.Ctx())
+
+    assert render(False) == 'Alice ate a cake. she ate a cake. she ate a cake.'
+    assert render(True) == render(True, compiled=False) == \
+        'Alice ate a cake. Alice ate a cake. Alice ate a cake.'
+    # the loop joins its iterations when it is an operand
+    assert render(False, sentence=True) == 'Alice ate a cake. she ate a cake. she ate a cake.'
+    assert render(True, sentence=True) == 'Alice ate a cake. alice ate a cake. alice ate a cake.'
+
+    assert list(aida.iter_render(aida.Repeat(injector, scoped=True), records)) == ['Alice ate a cake.'] * 3
+    text = io.StringIO()
+    aida.write_render(injector, records, text, scoped=False)
+    assert text.getvalue() == 'Alice ate a cake.\nshe ate a cake.\nshe ate a cake.'
+
+
+def test_pickle_drops_caches():
+    # the caches hold hashes of strings, which differ in other processes
+    node = aida.Branch(aida.Const('x').in_ctx(), 'seen', 'unseen') | aida.Var('y').assign(1)
+    assert aida.render(node) == 'unseen 1'
+    loaded = pickle.loads(pickle.dumps(node))
+
+    assert loaded._program is None and loaded._hash_memo is None
+    ctx = aida.Ctx()
+    ctx.add(aida.Const('x'))
+    assert aida.render(loaded, ctx) == 'seen 1'
@@ -0,0 +1,49 @@
+import random
+
+import aida
+
+
+def test_live_render():
+    temp = aida.Var('temp')
+    label = aida.Var('label')
+    greeting = aida.Choices(*[f'greeting{i}' for i in range(20)])
+    match = aida.create_match(label, now='is', default='will be')
+    template = (greeting + ',' | 'it' | match | temp | 'degrees').sentence()
+
+    live = aida.LiveRender(template, {'temp': 10, 'label': 'now'}, rng=random.Random(1))
+    first = live.text
+    assert first.endswith(', it is 10 degrees.')
+    assert live.update(temp=12) == first.replace('10', '12')
+    assert live.update({'label': 'later'}) == first.replace('is 10', 'will be 12')
+    # nothing changed, nothing renders
+    assert live.update(label='later') is live.text
+    assert repr(live) == f'LiveRender({live.text!r})'
+
+    # assigned values are picked up too
+    repeat = aida.Repeat('b').assign(1)
+    repeated = aida.LiveRender(aida.Empty + 'a' | repeat)
+    assert repeated.text == 'a b'
+    repeat.assign(3)
+    assert repeated.refresh() == 'a b b b'
+
+
+def test_live_render_with_checks():
+    x = aida.Var('x')
+    y = aida.Var('y')
+    template = (x | aida.create_alt(y, 'it') | 'and' | aida.create_alt(x, 'that') | aida.Repeat(y, 'n', sep=',')).sentence()
+    bindings = {'x': 'a', 'y': 'b', 'n': 2}
+    live = aida.LiveRender(template, bindings)
+
+    rng = random.Random(2)
+    for _ in range(100):
+        name = rng.choice('xyn')
+        bindings[name] = rng.randrange(3) if name == 'n' else rng.choice('ab')
+        # a change of x changes what the checks after it see
+        assert live.update({name: bindings[name]}) == aida.render(template, bindings=bindings)
+
+    # the key of a branch hashes the arm it didn't take
+    v = aida.Var('v')
+    branch = aida.Branch(v == '1', 'yes', aida.Var('u'))
+    template = branch | aida.create_alt(branch, 'again')
+    live = aida.LiveRender(template, {'v': '1', 'u': 'a'})
+    assert live.update(u='b') == aida.render(template, bindings={'v': '1', 'u': 'b'}) == 'yes again'
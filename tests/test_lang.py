@@ -1,3 +1,5 @@
+from itertools import product
+
 import aida
 
 
@@ -17,3 +19,59 @@ def test_enumerate():
         conf, 'Alice', 'Bob')) == 'Alice e Bob'
     assert aida.render(aida.create_enumeration(
         conf, 'Alice', 'Bob', 'Chris')) == 'Alice, Bob e Chris'
+
+
+def test_hash_under_config():
+    subj = aida.NP('the dog')
+    node = subj | aida.VP('barked')
+    conf = aida.LangConfig(node)
+    ctx = aida.Ctx()
+
+    assert aida.render(conf, ctx) == 'the dog barked'
+    ctx.add(node)
+    assert ctx.contains(node)
+    assert hash(subj) != hash(aida.NP('the dog'))
+
+
+def test_mapping_resolution():
+    verb = aida.VP('drive').add_mapping('drive', aida.GPerson.FIRST)
+    conf = aida.LangConfig(verb, person=aida.GPerson.THIRD)
+    assert aida.render(conf) == 'drive'
+
+    # ties keep the mapping added first, and new mappings drop cached results
+    verb.add_mapping('drives', aida.GPerson.THIRD)
+    verb.add_mapping('goes', aida.GPerson.THIRD, aida.Lang.PORTUGUESE)
+    assert aida.render(conf) == 'drives'
+
+    conf.lang = aida.Lang.PORTUGUESE
+    assert aida.render(conf) == 'goes'
+
+
+def test_shared_tree_under_configs():
+    verb = (aida.VP('drive')
+            .add_mapping('drive', aida.GPerson.FIRST)
+            .add_mapping('drives', aida.GPerson.THIRD))
+    node = aida.Const('she') | verb
+    first = aida.LangConfig(node, person=aida.GPerson.FIRST)
+    third = aida.LangConfig(node, person=aida.GPerson.THIRD)
+
+    assert aida.render(first) == 'she drive'
+    assert aida.render(third) == 'she drives'
+    assert aida.compile(first).render() == 'she drive'
+    assert aida.render(node, aida.Ctx(config=third)) == 'she drives'
+
+
+def test_render_configs():
+    from examples.cake import node
+
+    configs = [aida.LangConfig(lang=lang, person=person, number=number)
+               for lang, person, number in product(
+                   (aida.Lang.ENGLISH, aida.Lang.PORTUGUESE),
+                   (aida.GPerson.FIRST, aida.GPerson.THIRD),
+                   (aida.GNumber.SINGULAR, aida.GNumber.PLURAL))]
+    expected = [aida.render(node, aida.Ctx(config=config)) for config in configs]
+
+    assert aida.render_configs(node, configs) == expected
+    assert expected[:2] == ['I make a cake.', 'We make a cake.']
+    assert aida.render_configs(aida.Repeat(node, name='n'), configs[:1], {'n': 2}) == [
+        'I make a cake. I make a cake.']
@@ -0,0 +1,35 @@
+import pickle
+
+import aida
+from aida import NP, VP, GNumber, GPerson, Lang, LangConfig
+
+
+def test_lexicon(tmp_path):
+    path = str(tmp_path / 'lexicon.bin')
+    phrases = [
+        NP('dog').add_mapping('dogs', GNumber.PLURAL).add_mapping('cachorro', Lang.PORTUGUESE)
+        .add_mapping('cachorros', Lang.PORTUGUESE, GNumber.PLURAL),
+        VP('run').add_mapping('runs', GPerson.THIRD).add_mapping('corre', Lang.PORTUGUESE, GPerson.THIRD),
+        NP('run').add_mapping('runs', GNumber.PLURAL),
+    ]
+    assert aida.write_lexicon(path, phrases) == 3
+
+    lexicon = aida.load_lexicon(path)
+    assert aida.load_lexicon(path) is lexicon
+    assert len(lexicon) == 3
+    assert lexicon.mappings('NP', 'run') == [(frozenset({GNumber.PLURAL}), 'runs')]
+    assert lexicon.mappings('VP', 'walk') == []
+
+    # phrases load their mappings when they first render
+    dog = lexicon.np('dog')
+    assert dog.mappings == {}
+    sentence = dog | lexicon.vp('run') | lexicon.np('cat')
+    configs = [LangConfig(number=GNumber.PLURAL), LangConfig(lang=Lang.PORTUGUESE, person=GPerson.THIRD)]
+    texts = [aida.render(sentence, aida.Ctx(config=config)) for config in configs]
+    assert texts == ['dogs run cat', 'cachorro corre cat']
+    assert dog.mappings == phrases[0].mappings
+
+    # templates pickled or serialized open the lexicon again
+    template = LangConfig(lexicon.np('dog') | lexicon.vp('run'), person=GPerson.THIRD)
+    assert aida.render(pickle.loads(pickle.dumps(template))) == 'dog runs'
+    assert aida.render(aida.deserialize(aida.serialize(template))) == 'dog runs'
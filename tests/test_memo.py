@@ -0,0 +1,61 @@
+import random
+
+import aida
+from aida.compiler import MEMO, compile
+
+
+def test_render_cache():
+    label = aida.Var('label')
+    arms = {f'l{i}': (aida.Const(f'case {i}') | aida.Repeat('very', 'count', sep=', ')).sentence() for i in range(5)}
+    match = aida.create_match(label, default='none', **arms)
+    # the label rendered is still checked afterwards, and the choices are
+    # rendered every time
+    template = match | aida.Branch(label.in_ctx(), 'again') | aida.Choices('a', 'b')
+    records = [{'label': f'l{i % 7}', 'count': i % 2} for i in range(40)]
+
+    cache = aida.RenderCache()
+    assert aida.render_many(template, records, seed=1, cache=cache) == aida.render_many(template, records, seed=1)
+    # one render per distinct label and count
+    assert (cache.misses, cache.hits, cache.evictions) == (14, 26, 0)
+    assert len(cache) == 14
+
+    # the renders are shared by later batches, and by single renders that
+    # keep their whole context
+    aida.render_many(template, records, cache=cache)
+    assert (cache.misses, cache.hits) == (14, 66)
+    for record in records[:10]:
+        ctx = aida.Ctx(rng=random.Random(1), cache=cache)
+        expected = aida.Ctx(rng=random.Random(1))
+        assert aida.render(template, ctx, record) == aida.render(template, expected, record)
+        assert ctx.store == expected.store
+    assert (cache.misses, cache.hits, len(cache)) == (14, 76, 14)
+
+    small = aida.RenderCache(maxsize=2)
+    aida.render_many(template, records[:4], cache=small)
+    assert (len(small), small.evictions) == (2, 2)
+    small.clear()
+    assert (len(small), small.hits, small.misses) == (0, 0, 0)
+
+
+def test_pure_subtrees():
+    x = aida.Var('x')
+    match = aida.create_match(x, a='one', b='two')
+    program = compile(match | aida.Choices('c', 'd') | aida.Branch(x.in_ctx(), 'e'), memo=True)
+    # only the match can be kept
+    assert [instruction[1].variables for instruction in program.code if instruction[0] == MEMO] == [(x, )]
+
+    # phrases are kept per language features
+    verb = aida.VP('drive').add_mapping('drives', aida.GPerson.THIRD)
+    phrase = aida.create_match(x, a=verb)
+    cache = aida.RenderCache()
+    configs = [aida.LangConfig(person=person) for person in (aida.GPerson.FIRST, aida.GPerson.THIRD)]
+    texts = [aida.render(phrase, aida.Ctx(config=config, cache=cache), {'x': 'a'}) for config in configs * 2]
+    assert texts == ['drive', 'drives'] * 2
+    assert (cache.misses, cache.hits) == (2, 2)
+
+    # without a config in the context, phrases render in the one above them
+    cake = aida.NP('cake').add_mapping('bolo', aida.Lang.PORTUGUESE)
+    config = aida.LangConfig(cake | 'ok')
+    assert aida.render(config.value, aida.Ctx(cache=cache)) == 'cake ok'
+    config.lang = aida.Lang.PORTUGUESE
+    assert aida.render(config.value, aida.Ctx(cache=cache)) == 'bolo ok'
@@ -0,0 +1,29 @@
+import aida
+
+
+def create_template():
+    name = aida.Var('name')
+    greeting = aida.Choices('hi', 'hello', 'hey', 'good morning')
+    return (greeting + ',' | name).sentence()
+
+
+RECORDS = [{'name': f'user{i}'} for i in range(60)]
+
+
+def test_parallel_is_deterministic():
+    template = create_template()
+    expected = aida.render_parallel(template, RECORDS, workers=1, seed=3)
+
+    assert aida.render_parallel(template, RECORDS, workers=2, chunksize=7, seed=3) == expected
+    assert aida.render_parallel(template, RECORDS, workers=3, chunksize=25, seed=3) == expected
+    assert aida.render_parallel(template, RECORDS, workers=1, chunksize=1, seed=3) == expected
+    assert len(set(text.split(',')[0] for text in expected)) > 1
+
+
+def test_parallel_seed():
+    template = create_template()
+    first = aida.render_parallel(template, RECORDS, workers=1, seed=1)
+    second = aida.render_parallel(template, RECORDS, workers=1, seed=2)
+
+    assert first != second
+    assert [text.split(', ')[1] for text in first] == [f'user{i}.' for i in range(60)]
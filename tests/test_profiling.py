@@ -0,0 +1,59 @@
+import io
+import json
+import random
+
+import aida
+from examples.weather import create_forecast
+
+
+def test_profiler_counts():
+    x = aida.Var('x')
+    alt = aida.Branch(~x.in_ctx(), x, 'again')
+    node = alt | aida.Choices('a', 'b') | alt
+
+    profiler = aida.Profiler()
+    ctx = aida.Ctx(rng=random.Random(3), profiler=profiler)
+    plain = aida.Ctx(rng=random.Random(3))
+    for _ in range(2):
+        text = aida.render(node, ctx, bindings={'x': 'you'})
+        assert text == aida.render(node, plain, bindings={'x': 'you'})
+
+    stats = {entry['node']: entry for entry in profiler.to_dict()['nodes']}
+    branch = stats[repr(alt)]
+    assert branch['renders'] == 4
+    # only the first mention of the shared context is a full one
+    assert branch['arms'] == {'left': 1, 'right': 3}
+    assert stats[repr(x.in_ctx().value)]['lookups'] == 4
+    assert stats[repr(aida.Choices('a', 'b'))]['renders'] == 2
+
+    # nodes that only wrap another one are left out
+    assert id(node) not in profiler.stats
+    root = profiler.stats[id(node.value)]
+    assert root.renders == 2
+    assert all(stats.total <= root.total and stats.self <= stats.total
+               for stats in profiler.stats.values())
+    assert json.loads(profiler.to_json()) == json.loads(json.dumps(profiler.to_dict()))
+
+    # the context renders normally once the profiler is gone
+    ctx.profiler = None
+    assert aida.render(node, ctx, bindings={'x': 'you'}).startswith('again')
+
+
+def test_collapsed_stacks():
+    ticks = iter(range(1000))
+    profiler = aida.Profiler(clock=lambda: next(ticks) * 1e-6)
+    forecast = create_forecast(aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod'))
+    bindings = {'time': 'evening', 'cond': 'clear', 'temp': 12, 'tod': 'in the night'}
+    text = aida.render(forecast, aida.Ctx(bindings, profiler=profiler))
+    assert text == 'In the night, the weather will be clear with a temperature of 12 degrees.'
+
+    out = io.StringIO()
+    profiler.write_collapsed(out)
+    lines = out.getvalue().splitlines()
+    assert lines
+    total = 0
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert stack.split(';')[0] == profiler.to_dict()['nodes'][0]['node']
+        total += int(count)
+    assert total == round(profiler.to_dict()['nodes'][0]['total'] * 1e6)
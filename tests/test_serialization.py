@@ -0,0 +1,87 @@
+import random
+from itertools import product
+
+import aida
+from examples.cake import conf as cake_conf
+from examples.weather import create_forecast
+
+
+def test_serialize_roundtrip():
+    configs = [aida.LangConfig(lang=lang, number=number, person=person) for lang, number, person in product(
+        (aida.Lang.ENGLISH, aida.Lang.PORTUGUESE), (aida.GNumber.SINGULAR, aida.GNumber.PLURAL),
+        (aida.GPerson.FIRST, aida.GPerson.THIRD))]
+    cake = aida.deserialize(aida.serialize(cake_conf))
+    for config in configs:
+        assert aida.render(cake.value, aida.Ctx(config=config)) == aida.render(cake_conf.value, aida.Ctx(config=config))
+    assert aida.render(cake) == aida.render(cake_conf)
+
+    variables = [aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod')]
+    forecast = create_forecast(*variables) | aida.Choices('Bye.', 'See you.', seed=3)
+    repeat = aida.Repeat(aida.Injector(variables, forecast), sep='\n')
+    data = [{'time': 'now', 'cond': 'rainy', 'temp': 20, 'tod': 'now'},
+            {'time': 'evening', 'cond': 'rainy', 'temp': 12, 'tod': 'in the night'}]
+    repeat.node.assign(data)
+    repeat.assign(len(data))
+    # the loaded tree takes the values assigned so far, and the state of the
+    # generators of seeded choices
+    compiled = aida.deserialize(aida.serialize(repeat))
+    plain = aida.deserialize(aida.serialize(repeat, program=False))
+    assert compiled._program is not None and plain._program is None
+    texts = []
+    for node in (repeat, compiled, plain):
+        random.seed(5)
+        texts.append(aida.render(node))
+    assert texts[0] == texts[1] == texts[2]
+
+    # variables used in several places are still one variable
+    name = aida.Var('name')
+    node = aida.deserialize(aida.serialize(name | 'and' | name))
+    stack, found = [node], {}
+    while stack:
+        item = stack.pop()
+        if isinstance(item, aida.Var):
+            found[id(item)] = item
+        stack.extend(item.child_nodes())
+    assert len(found) == 1
+    found.popitem()[1].assign('Ann')
+    assert aida.render(node) == 'Ann and Ann'
+
+    names = [f'name{i}' for i in range(5000)]
+    enumeration = aida.create_enumeration(aida.LangConfig(), *names)
+    assert aida.render(aida.deserialize(aida.serialize(enumeration))) == aida.render(enumeration)
+
+
+def test_template_cache(tmp_path, monkeypatch):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return create_forecast(aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod'))
+
+    bindings = {'time': 'evening', 'cond': 'clear', 'temp': 12, 'tod': 'in the night'}
+    first = aida.TemplateCache(str(tmp_path)).get('forecast-1', build)
+    expected = aida.render(first, bindings=bindings)
+
+    # a loaded template renders without compiling, alone or in batches
+    compiles = []
+    compile_tree = aida.compiler._Compiler.compile
+    monkeypatch.setattr(aida.compiler._Compiler, 'compile',
+                        lambda *args, **kwargs: compiles.append(1) or compile_tree(*args, **kwargs))
+    second = aida.TemplateCache(str(tmp_path)).get('forecast-1', build)
+    assert len(builds) == 1
+    assert aida.render(second, bindings=bindings) == expected
+    assert aida.render(second, aida.Ctx(bindings)) == expected
+    assert aida.render_many(second, [bindings]) == [expected]
+    assert next(aida.iter_render(second, [bindings])) == expected
+    assert aida.render_parallel(second, [bindings], workers=1) == [expected]
+    assert compiles == []
+
+    # entries are named by their content
+    cache = aida.TemplateCache(str(tmp_path))
+    assert cache.store(build()) == cache.store(second)
+    assert len(list(tmp_path.glob('*.aida'))) == 1
+
+    # broken entries are built again
+    (tmp_path / 'refs' / 'forecast-1').write_text('nothing')
+    cache.get('forecast-1', build)
+    assert len(builds) == 3
@@ -0,0 +1,51 @@
+import aida
+from examples.weather import create_forecast
+
+
+def test_count_and_iter_variants():
+    x = aida.Var('x')
+    pair = aida.Choices('c', 'd') | aida.Choices('e', 'f', 'g')
+    node = aida.Choices('a', 'b', pair) | 'and' | aida.Choices('h', aida.Branch(x == 1, aida.Choices('i', 'j'), 'k'))
+
+    assert aida.count_variants(node, {'x': 1}) == (2 + 6) * (1 + 2)
+    assert aida.count_variants(node, {'x': 2}) == (2 + 6) * 2
+    texts = list(aida.iter_variants(node, {'x': 1}))
+    assert len(set(texts)) == len(texts) == 24
+    assert texts[:4] == ['a and h', 'a and i', 'a and j', 'b and h']
+
+    # repeated items give the same text
+    assert aida.count_variants(aida.Choices('a', 'a')) == 2
+    assert list(aida.iter_variants(aida.Choices('a', 'a'))) == ['a']
+    assert list(aida.iter_variants('plain')) == ['plain']
+
+    # the injector of a forecast can render again afterwards
+    variables = [aida.Var('time'), aida.Var('cond'), aida.Var('temp'), aida.Var('tod')]
+    record = {'time': 'now', 'cond': 'rainy', 'temp': 3, 'tod': 'in the morning'}
+    injector = aida.Injector(variables, create_forecast(*variables)).assign([record])
+    texts = list(aida.iter_variants(injector))
+    assert aida.count_variants(injector) == len(texts) == 2
+    assert aida.render(injector) in texts
+
+
+def test_sample_variants():
+    node = aida.Empty
+    for i in range(40):
+        node = node | aida.Choices(*[f'w{i}.{j}' for j in range(3)])
+    assert aida.count_variants(node) == 3 ** 40
+
+    sample = aida.sample_variants(node, 50, seed=1)
+    assert len(set(sample)) == 50
+    assert sample == aida.sample_variants(node, 50, seed=1)
+    assert all(len(text.split()) == 40 for text in sample)
+
+    # when an item adds a node that is checked, every combination renders
+    name = aida.Var('name')
+    node = aida.Choices(name, 'someone') | 'met' | aida.create_alt(name, 'her')
+    assert aida.count_variants(node, {'name': 'Ann'}) == 2
+    assert sorted(aida.sample_variants(node, 5, {'name': 'Ann'})) == ['Ann met her', 'someone met Ann']
+
+    # combinations that mostly give the same texts don't keep it drawing
+    node = aida.Choices('a', 'b')
+    for _ in range(29):
+        node = node | aida.Choices('a', 'a')
+    assert sorted(text[0] for text in aida.sample_variants(node, 5, seed=1)) == ['a', 'b']